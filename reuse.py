@@ -1,22 +1,65 @@
 import sys
-import sqlite3
 import os
+import multiprocessing
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()  # 打包后并行扫描的工作进程需要，必须在单实例检查之前
+    # 单实例检查放在导入 Qt 和打开数据库之前：已有实例在运行时转交请求后立即退出
+    from reuse_instance import claim_instance
+    INSTANCE, INSTANCE_REQUEST = claim_instance(os.path.dirname(os.path.abspath(__file__)), sys.argv[1:])
+
+import sqlite3
+import re
+import hashlib
+import zlib
+import heapq
+import operator
+import json
+from array import array
+from functools import lru_cache
+import uuid
+from collections import Counter, OrderedDict
 import win32con
 import win32api
 import win32gui
 import time
+import threading
+import tracemalloc
+import cProfile
+import pstats
+import io
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import ctypes
 from pynput import keyboard as pynput_keyboard
 from datetime import datetime
 from PyQt5.QtWidgets import (QApplication, QSystemTrayIcon, QMenu, QPushButton, QHBoxLayout,
                             QWidget, QTableWidget, QTableWidgetItem, QLineEdit, QVBoxLayout, 
                             QMessageBox, QInputDialog, QHeaderView, QAbstractItemView, QSplitter, 
-                            QTextEdit, QFrame, QSizePolicy, QShortcut, QDialog, QComboBox)
-from PyQt5.QtGui import (QKeySequence, QIcon, QFont, QColor, QBrush, QTextOption, QTextCursor, QCursor)
-from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QEvent, QObject
+                            QTextEdit, QFrame, QSizePolicy, QShortcut, QDialog, QComboBox, QFileDialog,
+                            QListWidget, QListWidgetItem, QStyledItemDelegate,
+                            QStyleOptionViewItem, QStyle)
+from PyQt5.QtGui import (QKeySequence, QIcon, QFont, QColor, QBrush, QTextOption, QTextCursor, QCursor,
+                         QTextDocument, QAbstractTextDocumentLayout, QPalette)
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QEvent, QObject, QItemSelectionModel
+try:
+    import numpy as np
+except ImportError:  # 没有 NumPy 时相似内容改用纯 Python 计算（较慢）
+    np = None
 
 class WorkerSignals(QObject):
     show_window = pyqtSignal()
+    show_palette = pyqtSignal(int)           # 按下快捷键时的前台窗口句柄
+    backup_finished = pyqtSignal(bool, str)  # 是否成功, 备份文件或错误信息
+    clips_classified = pyqtSignal(list)      # [(clip_id, kind), ...]
+    clip_fingerprints = pyqtSignal(list)     # [(clip_id, 规范化摘要, SimHash), ...]
+    instance_request = pyqtSignal(dict)      # 再次启动的进程转交来的请求
+    clip_vectors = pyqtSignal(int, list, bool)  # 索引代数, [(clip_id, 向量), ...], 是否为新计算
+    clear_purged = pyqtSignal(int)           # 已彻底清理的清空历史水位线
+    clips_archived = pyqtSignal(list)        # 刚移入归档库的一批剪贴板 ID
+    scan_rows = pyqtSignal(int, list)        # 扫描代数, 按排序先后到达的一批结果
+    scan_finished = pyqtSignal(int)
+    archive_results = pyqtSignal(int, list)  # 归档搜索序号, [(月份, (id, content, timestamp, pinned)), ...]
+    maintenance_finished = pyqtSignal(bool, str)  # 是否全部完成, 日志信息
 
 class PreviewDialog(QDialog):
     """预览悬浮窗 - 宽度与主窗口一致，高度自适应内容"""
@@ -80,15 +123,667 @@ class PreviewDialog(QDialog):
         max_height = self.parent().height() if self.parent() else 500
         self.resize(self.width(), min(ideal_height, max_height))
 
+class SnippetDelegate(QStyledItemDelegate):
+    """内容列的绘制代理：搜索时显示匹配位置附近的片段并高亮匹配词
+
+    只在某一行真正被绘制时才计算片段，结果按 (模式, 行 ID, 查询, 写入代数) 缓存；
+    未搜索、或内容中没有可高亮的匹配时按普通方式绘制表格里的前 80 个字符。
+    """
+    SNIPPET_CHARS = 80
+    CONTEXT_CHARS = 20
+    CACHE_SIZE = 512
+
+    def __init__(self, parent, db, get_keyword, get_mode):
+        super().__init__(parent)
+        self.db = db
+        self.get_keyword = get_keyword  # 返回搜索框当前文字
+        self.get_mode = get_mode
+        self.keyword = None
+        self.pattern = None
+        self.cache = OrderedDict()
+
+    def current_pattern(self):
+        keyword = self.get_keyword().strip()
+        if keyword != self.keyword:
+            self.keyword = keyword
+            self.pattern = SearchQuery(keyword).match_pattern() if keyword else None
+        return self.pattern
+
+    def snippet_html(self, index):
+        pattern = self.current_pattern()
+        if pattern is None:
+            return None
+        row_id = index.sibling(index.row(), 0).data(Qt.UserRole)  # 序号列只存 ID，读取代价很小
+        if row_id is None:
+            return None
+        key = (self.get_mode(), row_id, pattern.pattern, self.db.write_generation)  # 内容修改后失效
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        data = index.data(Qt.UserRole)
+        html = self.build_snippet(pattern, data.get("content", "")) if data else None
+        self.cache[key] = html
+        while len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return html
+
+    def build_snippet(self, pattern, content):
+        match = pattern.search(content)
+        if match is None:
+            return None
+        start = max(match.start() - self.CONTEXT_CHARS, 0)
+        end = min(start + self.SNIPPET_CHARS, len(content))
+        # 换行、制表符替换为空格，长度不变，匹配位置仍然对应
+        text = content[start:end].replace('\r', ' ').replace('\n', ' ').replace('\t', ' ')
+        html, pos = [], 0
+        for m in pattern.finditer(text):
+            if m.end() == m.start():
+                continue
+            html.append(self.escape(text[pos:m.start()]))
+            html.append(f'<span style="background-color:#FFE58F;color:#000000;">{self.escape(m.group())}</span>')
+            pos = m.end()
+        html.append(self.escape(text[pos:]))
+        return ("…" if start > 0 else "") + ''.join(html) + ("…" if end < len(content) else "")
+
+    @staticmethod
+    def escape(text):
+        return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace(' ', '&nbsp;')
+
+    def paint(self, painter, option, index):
+        html = self.snippet_html(index)
+        if html is None:
+            super().paint(painter, option, index)
+            return
+        opt = QStyleOptionViewItem(option)
+        self.initStyleOption(opt, index)
+        opt.text = ''
+        style = opt.widget.style() if opt.widget else QApplication.style()
+        style.drawControl(QStyle.CE_ItemViewItem, opt, painter, opt.widget)  # 背景和选中状态
+
+        doc = QTextDocument()
+        doc.setDefaultFont(opt.font)
+        doc.setDocumentMargin(0)
+        doc.setHtml(html)
+        context = QAbstractTextDocumentLayout.PaintContext()
+        selected = opt.state & QStyle.State_Selected
+        context.palette.setColor(QPalette.Text, opt.palette.color(
+            QPalette.HighlightedText if selected else QPalette.Text))
+        rect = style.subElementRect(QStyle.SE_ItemViewItemText, opt, opt.widget)
+        painter.save()
+        painter.setClipRect(rect)
+        painter.translate(rect.left(), rect.top() + max((rect.height() - doc.size().height()) / 2, 0))
+        doc.documentLayout().draw(painter, context)
+        painter.restore()
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4            # 汉明距离 < 4 的两个指纹至少有一段 16 位完全相同
+SIMHASH_MIN_LENGTH = 32      # 太短的内容指纹不可靠，不参与近似去重
+SIMHASH_MAX_CHARS = 8192     # 只对前若干字符计算指纹，避免超长内容拖慢采集
+_TRAILING_SPACE_RE = re.compile(r'[ \t\f\v]+$', re.MULTILINE)
+
+def normalize_content(content):
+    """规范化：统一换行符、去掉行尾空白和首尾空白"""
+    content = content.replace('\r\n', '\n').replace('\r', '\n')
+    return _TRAILING_SPACE_RE.sub('', content).strip()
+
+def content_digest(normalized):
+    """规范化内容的摘要，用于“规范化后完全相同”的去重"""
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+def simhash(normalized):
+    """基于字符 3-gram 的 64 位 SimHash（以 SQLite 有符号整数形式返回），内容过短时返回 None"""
+    if len(normalized) < SIMHASH_MIN_LENGTH:
+        return None
+    text = ' '.join(normalized[:SIMHASH_MAX_CHARS].lower().split())
+    shingles = Counter(text[i:i + 3] for i in range(len(text) - 2))
+    weights = [0] * SIMHASH_BITS
+    for shingle, count in shingles.items():
+        h = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += count if h >> bit & 1 else -count
+    value = sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def simhash_bands(value):
+    """把指纹切成若干段，每段编码为 段号 << 16 | 段值，作为索引键"""
+    value &= (1 << 64) - 1
+    width = SIMHASH_BITS // SIMHASH_BANDS
+    return [band << width | (value >> band * width) & ((1 << width) - 1)
+            for band in range(SIMHASH_BANDS)]
+
+def hamming_distance(a, b):
+    return bin((a ^ b) & ((1 << 64) - 1)).count('1')
+
+NGRAM_DIM = 256         # 相似内容向量的维数（字符 3-gram 哈希到的桶数）
+NGRAM_MIN_LENGTH = 8    # 太短的内容没有可比性，不计算向量
+NGRAM_MIN_SIMILARITY = 0.2  # 余弦相似度不超过该值的内容视为不相关
+
+def ngram_vector(normalized):
+    """字符 3-gram 的特征哈希向量（带符号、次线性计数），量化为 NGRAM_DIM 字节的 int8；内容过短时返回 None"""
+    if len(normalized) < NGRAM_MIN_LENGTH:
+        return None
+    text = ' '.join(normalized[:SIMHASH_MAX_CHARS].lower().split())
+    weights = [0] * NGRAM_DIM
+    for shingle, count in Counter(text[i:i + 3] for i in range(len(text) - 2)).items():
+        # 用 crc32 而不是 hash()，保证不同进程、不同次启动算出的向量一致
+        h = zlib.crc32(shingle.encode('utf-8'))
+        weights[h % NGRAM_DIM] += -count if h >> 16 & 1 else count
+    weights = [(w if w >= 0 else -w) ** 0.5 * (1 if w >= 0 else -1) for w in weights]
+    peak = max(abs(w) for w in weights)
+    if peak == 0:
+        return None
+    return array('b', (round(w * 127 / peak) for w in weights)).tobytes()
+
+class ClipVectorIndex:
+    """相似内容索引：每条剪贴板一行 int8 向量，按行连续存放在 bytearray 中
+
+    删除只把 ID 置 0，失效行过多时再压缩。有 NumPy 时分块做矩阵乘法计算余弦相似度，
+    否则逐行计算。只在主线程中读写。
+    """
+    CHUNK_ROWS = 16384  # 分块计算，避免一次把整个矩阵转换为浮点数
+
+    def __init__(self):
+        self.ids = array('q')       # 行号 -> clip_id，0 表示已删除
+        self.norms = array('f')     # 行号 -> 向量长度
+        self.vectors = bytearray()  # 行号 * NGRAM_DIM 起的 NGRAM_DIM 个字节
+        self.rows = {}              # clip_id -> 行号
+        self.dead = 0
+        self.generation = 0         # 清空时加一，丢弃清空前开始的后台加载结果
+
+    def __len__(self):
+        return len(self.rows)
+
+    def memory_usage(self):
+        size = len(self.vectors) + self.ids.itemsize * len(self.ids) + self.norms.itemsize * len(self.norms)
+        return size + sys.getsizeof(self.rows), f"{len(self.rows)} 条向量，{self.dead} 行待压缩"
+
+    def add(self, clip_id, vector):
+        if not vector:
+            return
+        norm = sum(v * v for v in array('b', vector)) ** 0.5
+        row = self.rows.get(clip_id)
+        if row is not None:
+            self.vectors[row * NGRAM_DIM:(row + 1) * NGRAM_DIM] = vector
+            self.norms[row] = norm
+            return
+        self.rows[clip_id] = len(self.ids)
+        self.ids.append(clip_id)
+        self.norms.append(norm)
+        self.vectors += vector
+
+    def vector(self, clip_id):
+        row = self.rows.get(clip_id)
+        if row is None:
+            return None
+        return bytes(self.vectors[row * NGRAM_DIM:(row + 1) * NGRAM_DIM])
+
+    def discard(self, clip_ids):
+        for clip_id in clip_ids:
+            row = self.rows.pop(clip_id, None)
+            if row is not None:
+                self.ids[row] = 0
+                self.dead += 1
+        if self.dead > 1024 and self.dead > len(self.rows):
+            self.compact()
+
+    def discard_upto(self, max_id):
+        """去掉 ID 不超过 max_id 的行（清空历史被彻底清理后调用）"""
+        self.discard([clip_id for clip_id in self.rows if clip_id <= max_id])
+
+    def retain(self, clip_ids):
+        """只保留给定的 ID（批量清理后调用）"""
+        keep = set(clip_ids)
+        self.discard([clip_id for clip_id in self.rows if clip_id not in keep])
+
+    def clear(self):
+        self.ids, self.norms, self.vectors, self.rows, self.dead = array('q'), array('f'), bytearray(), {}, 0
+        self.generation += 1
+
+    def compact(self):
+        """去掉已删除的行，按原顺序重建存储"""
+        ids, norms, vectors = array('q'), array('f'), bytearray()
+        rows = {}
+        for row, clip_id in enumerate(self.ids):
+            if clip_id:
+                rows[clip_id] = len(ids)
+                ids.append(clip_id)
+                norms.append(self.norms[row])
+                vectors += self.vectors[row * NGRAM_DIM:(row + 1) * NGRAM_DIM]
+        self.ids, self.norms, self.vectors, self.rows, self.dead = ids, norms, vectors, rows, 0
+
+    def nearest(self, vector, limit, exclude=(), min_id=0):
+        """余弦相似度最高的 limit 条 [(clip_id, 相似度), ...]，从高到低排列，不含 exclude 中和不大于 min_id 的 ID"""
+        query = array('b', vector)
+        query_norm = sum(v * v for v in query) ** 0.5
+        if not self.rows or query_norm == 0 or limit <= 0:
+            return []
+        if np is None:
+            return self._nearest_python(query, query_norm, limit, exclude, min_id)
+
+        # 向量存储不能在存在 NumPy 视图时扩容，视图只在本函数内使用
+        count = len(self.ids)
+        matrix = np.frombuffer(self.vectors, dtype=np.int8).reshape(count, NGRAM_DIM)
+        q = np.frombuffer(query, dtype=np.int8).astype(np.float32)
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, self.CHUNK_ROWS):
+            scores[start:start + self.CHUNK_ROWS] = matrix[start:start + self.CHUNK_ROWS].astype(np.float32) @ q
+        scores /= np.frombuffer(self.norms, dtype=np.float32) * np.float32(query_norm)
+        scores[np.frombuffer(self.ids, dtype=np.int64) <= min_id] = -np.inf  # 已删除的行 ID 为 0
+        for clip_id in exclude:
+            row = self.rows.get(clip_id)
+            if row is not None:
+                scores[row] = -np.inf
+        del matrix
+
+        limit = min(limit, count)
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.ids[row], float(scores[row])) for row in top.tolist() if scores[row] > -np.inf]
+
+    def _nearest_python(self, query, query_norm, limit, exclude, min_id):
+        def scored():
+            with memoryview(self.vectors).cast('b') as vectors:
+                for row, clip_id in enumerate(self.ids):
+                    if clip_id > min_id and clip_id not in exclude:
+                        start = row * NGRAM_DIM
+                        dot = sum(map(operator.mul, query, vectors[start:start + NGRAM_DIM]))
+                        yield dot / (self.norms[row] * query_norm), clip_id
+        return [(clip_id, score) for score, clip_id in heapq.nlargest(limit, scored())]
+
+# 记录的手动排序键：62 进制小数（只含小数部分，不以 0 结尾），按字符串比较即按数值比较，
+# 任意两个键之间总能生成新键，因此调整顺序只需修改被移动的那一行
+SORT_KEY_DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+SORT_KEY_MAX_LENGTH = 12  # 键超过该长度时，稍后重排整个组
+
+def sort_key_between(lo, hi):
+    """生成介于 lo 和 hi 之间的排序键，None 表示没有下界/上界"""
+    if hi is None:
+        # 放到最后：把第一个不是最大值的位加一，每次追加键长基本不变
+        lo = lo or ''
+        for i, ch in enumerate(lo):
+            digit = SORT_KEY_DIGITS.index(ch)
+            if digit < len(SORT_KEY_DIGITS) - 1:
+                return lo[:i] + SORT_KEY_DIGITS[digit + 1]
+        return lo + SORT_KEY_DIGITS[len(SORT_KEY_DIGITS) // 2]
+    if lo is None:
+        # 放到最前：把第一个大于 1 的位减一
+        for i, ch in enumerate(hi):
+            digit = SORT_KEY_DIGITS.index(ch)
+            if digit > 1:
+                return hi[:i] + SORT_KEY_DIGITS[digit - 1]
+        lo = ''
+    # 两键之间取中点：跳过公共前缀后比较首位
+    n = 0
+    while n < len(hi) and (lo[n] if n < len(lo) else '0') == hi[n]:
+        n += 1
+    if n:
+        return hi[:n] + sort_key_between(lo[n:], hi[n:])
+    low = SORT_KEY_DIGITS.index(lo[0]) if lo else 0
+    high = SORT_KEY_DIGITS.index(hi[0])
+    if high - low > 1:
+        return SORT_KEY_DIGITS[(low + high + 1) // 2]
+    if len(hi) > 1:
+        return hi[0]
+    return SORT_KEY_DIGITS[low] + sort_key_between(lo[1:], None)
+
+def sort_keys_between(lo, hi, n):
+    """生成 n 个递增且介于 lo 和 hi 之间的排序键"""
+    if n <= 0:
+        return []
+    if hi is None or lo is None:
+        keys = []
+        for _ in range(n):
+            keys.append(sort_key_between(keys[-1] if keys else lo, None) if hi is None
+                        else sort_key_between(None, keys[-1] if keys else hi))
+        return keys if hi is None else keys[::-1]
+    mid = sort_key_between(lo, hi)
+    return sort_keys_between(lo, mid, n // 2) + [mid] + sort_keys_between(mid, hi, n - n // 2 - 1)
+
+def spread_sort_keys(n):
+    """n 个等距、等长的排序键（重排用），两端和相邻键之间都留出空间"""
+    base = len(SORT_KEY_DIGITS)
+    width = 1
+    while base ** width < (n + 1) * base:
+        width += 1
+    keys = []
+    for i in range(1, n + 1):
+        value = i * base ** width // (n + 1)
+        digits = ''
+        for _ in range(width):
+            value, digit = divmod(value, base)
+            digits = SORT_KEY_DIGITS[digit] + digits
+        keys.append(digits.rstrip('0'))
+    return keys
+
+class QueryCache:
+    """有容量上限的查询结果缓存（LRU）
+
+    每个结果记录写入代数，数据库的写入代数变化后旧结果一律失效，不会返回过期数据。
+    结果以元组保存，调用方只读不改。条目数和估算的字节数任一超出上限时淘汰最久未用的结果。
+    """
+    def __init__(self, max_entries=64, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (写入代数, 结果, 估算字节数)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, generation):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != generation:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, generation, result):
+        old = self.entries.pop(key, None)
+        if old:
+            self.bytes -= old[2]
+        size = estimate_rows_size(result)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # 单个结果就超出预算，不缓存
+        self.entries[key] = (generation, result, size)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or (
+                self.max_bytes is not None and self.bytes > self.max_bytes):
+            self.bytes -= self.entries.popitem(last=False)[1][2]
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+def estimate_rows_size(rows):
+    """查询结果（行元组的元组）占用内存的估算值（字节）"""
+    return sys.getsizeof(rows) + sum(
+        sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in rows)
+
+# 内容类型：代码中的标识 -> 界面显示名称
+CONTENT_KINDS = OrderedDict([
+    ('url', '链接'),
+    ('email', '邮箱'),
+    ('path', '文件路径'),
+    ('json', 'JSON'),
+    ('code', '代码'),
+    ('number', '数字'),
+    ('multiline', '多行文本'),
+    ('text', '文本'),
+])
+_URL_RE = re.compile(r'(?:(?:https?|ftp)://|www\.)\S+$', re.I)
+_EMAIL_RE = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+$')
+_PATH_RE = re.compile(r'(?:[A-Za-z]:[\\/]|\\\\[^\\\s]+\\|~?/)[^\n<>|"?*]*$')
+_NUMBER_RE = re.compile(r'[+-]?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?(?:[eE][+-]?\d+)?%?$')
+_CODE_LINE_RE = re.compile(
+    r'^\s*(?:def |class |import |from \S+ import|function\b|const |let |var |return\b|if\s*\(|for\s*\(|'
+    r'#include|public |private |SELECT\b|INSERT\b|UPDATE\b)|[;{}]\s*$|=>|\)\s*\{', re.I)
+CLASSIFY_MAX_CHARS = 200000  # 超长内容只看开头部分
+
+def classify_content(content):
+    """粗略判断剪贴板内容的类型，返回 CONTENT_KINDS 中的键"""
+    text = content[:CLASSIFY_MAX_CHARS].strip()
+    single_line = '\n' not in text
+    if single_line and _URL_RE.match(text):
+        return 'url'
+    if single_line and _EMAIL_RE.match(text):
+        return 'email'
+    if single_line and _NUMBER_RE.match(text):
+        return 'number'
+    if single_line and len(text) < 1024 and _PATH_RE.match(text):
+        return 'path'
+    if text[:1] in '{[' and text[-1:] in '}]':
+        try:
+            json.loads(text)
+            return 'json'
+        except ValueError:
+            pass
+    if not single_line:
+        lines = [line for line in text.splitlines() if line.strip()]
+        code_lines = sum(1 for line in lines if _CODE_LINE_RE.search(line))
+        if lines and code_lines * 3 >= len(lines):
+            return 'code'
+        return 'multiline'
+    if _CODE_LINE_RE.search(text) and text.endswith((';', '{', '}', ')')):
+        return 'code'
+    return 'text'
+
+@lru_cache(maxsize=128)
+def compile_pattern(pattern, flags=0):
+    """编译正则并缓存，供 SQLite 的 REGEXP 函数反复调用"""
+    return re.compile(pattern, flags)
+
+def sqlite_regexp(pattern, value):
+    """SQLite 中 X REGEXP Y 调用 regexp(Y, X)；模式以 (?i) 开头表示忽略大小写"""
+    if value is None:
+        return False
+    return compile_pattern(pattern).search(value) is not None
+
+def parse_query_date(value):
+    """解析 after:/before: 的日期，支持 2026-09-01、2026-09-01T08:00 和 7d/12h（多少天/小时前）"""
+    match = re.fullmatch(r'(\d+)([dh])', value)
+    if match:
+        return int(time.time()) - int(match.group(1)) * (86400 if match.group(2) == 'd' else 3600)
+    for fmt in ('%Y-%m-%d', '%Y-%m-%dT%H:%M', '%Y/%m/%d'):
+        try:
+            return int(datetime.strptime(value, fmt).timestamp())  # 按本地时间解释
+        except ValueError:
+            pass
+    return None
+
+class SearchQuery:
+    """搜索框查询语法
+
+    - 普通词：内容包含该词（多个词同时满足），"带 空格的短语" 用引号（空白数量、换行不敏感）
+    - ~词：模糊匹配，按顺序包含这些字符即可（如 ~gco 匹配 git checkout）
+    - -词：内容不包含该词
+    - group:组名：只搜索该组的记录
+    - after:日期 / before:日期：按创建时间过滤（走索引）
+    - len>500、len<=20 等：按内容长度过滤（走索引）
+    - type:url 等：按内容类型过滤（剪贴板，走索引）
+    - /正则/ 或 /正则/i：正则匹配，仅在上面条件缩小后的候选行上执行
+    """
+    TOKEN_RE = re.compile(r'(-?)"([^"]*)"|(\S+)')
+    LEN_RE = re.compile(r'len(>=|<=|>|<|=)(\d+)$')
+
+    def __init__(self, text=""):
+        self.terms = []
+        self.excludes = []
+        self.regexes = []
+        self.group = None
+        self.kind = None
+        self.after = None
+        self.before = None
+        self.min_len = None
+        self.max_len = None
+        self.parse(text or "")
+
+    def parse(self, text):
+        for match in self.TOKEN_RE.finditer(text):
+            negate, phrase, token = match.groups()
+            if phrase is not None:  # 引号短语不解析过滤条件
+                words = phrase.split()
+                if negate and phrase:
+                    self.excludes.append(phrase)
+                elif len(words) > 1:
+                    # LIKE 先粗筛，再用正则确认词之间只有空白
+                    self.terms.append('%'.join(words))
+                    self.regexes.append('(?i)' + r'\s+'.join(map(re.escape, words)))
+                elif words:
+                    self.terms.append(words[0])
+            else:
+                self.parse_token(token)
+
+    def parse_token(self, token):
+        match = re.fullmatch(r'/(.+)/(i?)', token, re.S)
+        if match:
+            pattern = ('(?i)' if match.group(2) else '') + match.group(1)
+            try:
+                compile_pattern(pattern)
+                self.regexes.append(pattern)
+            except re.error:
+                self.terms.append(token)  # 非法正则按普通文字搜索
+            return
+
+        key, _, value = token.partition(':')
+        if value and key == 'group':
+            self.group = value
+            return
+        if key == 'type' and value in CONTENT_KINDS:
+            self.kind = value
+            return
+        if value and key in ('after', 'before'):
+            epoch = parse_query_date(value)
+            if epoch is not None:
+                setattr(self, key, epoch)
+                return
+
+        match = self.LEN_RE.match(token)
+        if match:
+            op, n = match.group(1), int(match.group(2))
+            if op in ('>', '>=', '='):
+                self.min_len = max(self.min_len or 0, n + 1 if op == '>' else n)
+            if op in ('<', '<=', '='):
+                limit = n - 1 if op == '<' else n
+                self.max_len = limit if self.max_len is None else min(self.max_len, limit)
+            return
+
+        if token.startswith('~') and len(token) > 1:
+            self.terms.append('%'.join(token[1:]))  # 模糊：字符按顺序出现
+        elif token.startswith('-') and len(token) > 1:
+            self.excludes.append(token[1:])
+        elif token:
+            self.terms.append(token)
+
+    def is_plain(self):
+        """没有任何过滤条件（相当于列出全部）"""
+        return not (self.terms or self.excludes or self.regexes or self.group or self.kind
+                    or self.after is not None or self.before is not None
+                    or self.min_len is not None or self.max_len is not None)
+
+    def cache_key(self):
+        """查询计划的规范形式；LIKE 对 ASCII 字母不区分大小写，因此普通词中 ASCII 统一小写"""
+        fold = lambda word: ''.join(c.lower() if c.isascii() else c for c in word)
+        return (tuple(sorted(set(map(fold, self.terms)))), tuple(sorted(set(map(fold, self.excludes)))),
+                tuple(self.regexes), self.group, self.kind, self.after, self.before, self.min_len, self.max_len)
+
+    def match_pattern(self):
+        """把普通词（LIKE 语义）和正则合成一个用于定位匹配位置的正则，没有可高亮的条件时返回 None"""
+        parts = []
+        for term in self.terms:
+            # LIKE 中 % 匹配任意串、_ 匹配单个字符，ASCII 不区分大小写
+            like = '.*?'.join(re.escape(piece).replace('_', '.') for piece in term.split('%'))
+            parts.append(f"(?i:{like})")
+        for pattern in self.regexes:
+            parts.append(f"(?i:{pattern[4:]})" if pattern.startswith('(?i)') else f"(?:{pattern})")
+        if not parts:
+            return None
+        try:
+            return compile_pattern('|'.join(parts), re.S)
+        except re.error:
+            return None
+
+    def needs_scan(self):
+        """是否包含索引无法回答、需要逐行检查内容的条件"""
+        return bool(self.terms or self.excludes or self.regexes)
+
+    def range_conditions(self, content_column, created_column):
+        """时间和长度条件，按可用的索引分开：{'created': (条件, 参数), 'length': (条件, 参数)}，没有的不出现"""
+        ranges = {}
+        for name, column, bounds in (('created', created_column, ((">=", self.after), ("<", self.before))),
+                                     ('length', f"length({content_column})",
+                                      ((">=", self.min_len), ("<=", self.max_len)))):
+            bounds = [(op, value) for op, value in bounds if value is not None]
+            if bounds:
+                ranges[name] = ([f"{column} {op} ?" for op, _ in bounds], [value for _, value in bounds])
+        return ranges
+
+    def conditions(self, content_column, created_column, kind_column=None, candidates=None):
+        """生成 WHERE 条件：先放可走索引的类型、时间和长度条件，正则放在最后
+
+        candidates 为 'created' 或 'length' 时（仅用于剪贴板），该范围条件改为
+        id IN (SELECT id FROM clips WHERE ...)，先按范围索引选出候选行，再沿 idx_clips_live 按顺序取出。
+        """
+        clauses, params = [], []
+        if kind_column and self.kind:
+            clauses.append(f"{kind_column} = ?")
+            params.append(self.kind)
+        for name, (range_clauses, range_params) in self.range_conditions(content_column, created_column).items():
+            if name == candidates:
+                clauses.append(f"id IN (SELECT id FROM clips WHERE {' AND '.join(range_clauses)})")
+            else:
+                clauses.extend(range_clauses)
+            params.extend(range_params)
+        for term in self.terms:
+            clauses.append(f"{content_column} LIKE ?")
+            params.append('%' + term + '%')
+        for term in self.excludes:
+            clauses.append(f"{content_column} NOT LIKE ?")
+            params.append('%' + term + '%')
+        for pattern in self.regexes:
+            clauses.append(f"{content_column} REGEXP ?")
+            params.append(pattern)
+        return clauses, params
+
+# “清空历史”的水位线：尚未清理的清空批次中最大的 clear_upto，ID 不超过它的剪贴板行都已被清空
+CLEAR_WATERMARK_SQL = "(SELECT COALESCE(MAX(clear_upto), 0) FROM deletions)"
+
+def live_clip_condition(alias=''):
+    """剪贴板行可见的 SQL 条件：没有删除标记，且不在清空历史的水位线以下"""
+    return f"{alias}deleted = 0 AND {alias}id > {CLEAR_WATERMARK_SQL}"
+
 class ReuseDatabase:
     """管理剪贴板历史记录的数据库"""
+    DEFAULT_GROUP = '默认'
+    RANGE_CANDIDATES_MAX = 20000  # 时间/长度范围命中的行不超过该数时，先按范围索引选出候选行
+    # 可在设置中修改的选项及默认值
+    DEFAULT_SETTINGS = {
+        'dedup_normalized': True,   # 忽略换行符/行尾空白差异
+        'dedup_near': False,        # 合并近似重复（SimHash）
+        'near_dup_distance': 3,     # 近似重复的最大汉明距离（0-3）
+        'device_id': '',            # 本机标识，首次启动时生成
+        'sync_dir': '',             # 多机同步的共享目录，为空表示不同步
+        'backup_dir': '',           # 备份目录，为空时使用数据库旁的 backups 目录
+        'backup_interval_hours': 24,
+        'backup_keep': 7,           # 保留最近几份备份
+        'capture_coalesce_ms': 100, # 该时间窗口内的多次剪贴板变化合并为一次采集
+        'max_capture_chars': 1000000,  # 超过该长度的内容不采集，0 表示不限制
+        'parallel_scan_min_rows': 50000,  # 历史超过该行数时，正则/模糊搜索改用多进程并行扫描
+        'scan_workers': 0,          # 并行扫描的进程数，0 表示按 CPU 核数
+        'maintenance_idle_minutes': 10,   # 窗口隐藏且无采集超过该时间视为空闲
+        'maintenance_interval_hours': 24, # 两次数据库维护的最小间隔
+        'maintenance_last_run': 0,        # 上次完成维护的时间戳
+        'palette_size': 9,          # 快速粘贴面板显示的最近条目数（数字键 1-9 直接粘贴）
+        'query_cache_budget_kb': 32768,  # 查询缓存的内存预算，超出时淘汰最久未用的结果
+        'sqlite_cache_budget_kb': 8192,  # SQLite 页缓存上限（每个连接）
+        'preview_budget_kb': 1024,       # 预览窗口文档的上限，超长内容只预览开头部分
+        'archive_after_days': 0,    # 超过该天数的非置顶剪贴板内容在空闲维护时移入按月归档库，0 表示不归档
+        'archive_dir': '',          # 归档目录，为空时使用数据库旁的 archives 目录
+        'undo_minutes': 10,         # 删除后可撤销的时间，之后由后台分批彻底清理
+    }
+
     def __init__(self, db_path='reuse_history.db'):
         self.db_path = db_path
+        self.write_generation = 0  # 每次写入加一，用于让查询缓存失效
+        self.query_cache = QueryCache()
+        self.unbalanced_groups = set()  # 排序键过长、等待重排的组
+        self.vector_index = ClipVectorIndex()  # 由后台线程加载，新采集的内容随插入加入
         self.conn = sqlite3.connect(db_path)
+        self.conn.create_function('REGEXP', 2, sqlite_regexp, deterministic=True)
+        # WAL 模式下读（搜索、在线备份）不阻塞写（采集）
+        self.conn.execute("PRAGMA journal_mode = WAL")
         self.create_table()
+        self.migrate()
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.settings = self.load_settings()
+        self.apply_memory_budgets()
+        self.init_sync_state()
         print(f"数据库文件: {os.path.abspath(db_path)}")
     
     def create_table(self):
+        """创建初始版本（user_version = 0）的表，后续结构变更由 migrate() 完成"""
         # 原始剪贴板历史表
         self.conn.execute('''CREATE TABLE IF NOT EXISTS clips (
                         id INTEGER PRIMARY KEY,
@@ -104,19 +799,346 @@ class ReuseDatabase:
         self.conn.execute('''CREATE TABLE IF NOT EXISTS groups (
                         name TEXT PRIMARY KEY)''')
         self.conn.commit()
+
+    def migrations(self):
+        """按顺序排列的迁移步骤，第 N 项把数据库从 user_version N-1 升级到 N"""
+        return [
+            self._migrate_v1_group_ids,
+            self._migrate_v2_pinned_clips,
+            self._migrate_v3_clip_fingerprints,
+            self._migrate_v4_change_log,
+            self._migrate_v5_query_indexes,
+            self._migrate_v6_content_kind,
+            self._migrate_v7_record_order,
+            self._migrate_v8_clip_vectors,
+            self._migrate_v9_soft_delete,
+            self._migrate_v10_clear_watermark,
+        ]
+
+    def migrate(self):
+        """根据 PRAGMA user_version 原地升级数据库，每一步在单独事务中完成"""
+        steps = self.migrations()
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > len(steps):
+            raise RuntimeError(f"数据库版本 {version} 高于程序支持的版本 {len(steps)}")
+
+        # 重建表时需要关闭外键检查（该 PRAGMA 在事务内无效）
+        self.conn.execute("PRAGMA foreign_keys = OFF")
+        for target in range(version + 1, len(steps) + 1):
+            try:
+                self.conn.execute("BEGIN")
+                steps[target - 1]()
+                self.conn.execute(f"PRAGMA user_version = {target}")
+                self.conn.commit()
+                print(f"数据库已升级到版本 {target}")
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+
+    def _migrate_v1_group_ids(self):
+        """组改为整数 ID + 外键，记录按 group_id 建索引，组内记录数由触发器维护"""
+        self.conn.execute('''CREATE TABLE groups_v1 (
+                        id INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL UNIQUE,
+                        record_count INTEGER NOT NULL DEFAULT 0)''')
+        self.conn.execute("INSERT INTO groups_v1 (name) SELECT name FROM groups ORDER BY rowid")
+        # 旧版本允许记录引用 groups 中不存在的组名，这里补齐
+        self.conn.execute(
+            "INSERT OR IGNORE INTO groups_v1 (name) "
+            "SELECT DISTINCT COALESCE(NULLIF(group_name, ''), ?) FROM records",
+            (self.DEFAULT_GROUP,))
+
+        self.conn.execute('''CREATE TABLE records_v1 (
+                        id INTEGER PRIMARY KEY,
+                        group_id INTEGER NOT NULL
+                            REFERENCES groups(id) ON DELETE CASCADE,
+                        content TEXT NOT NULL)''')
+        self.conn.execute(
+            "INSERT INTO records_v1 (id, group_id, content) "
+            "SELECT r.id, g.id, r.content FROM records r "
+            "JOIN groups_v1 g ON g.name = COALESCE(NULLIF(r.group_name, ''), ?)",
+            (self.DEFAULT_GROUP,))
+
+        self.conn.execute("DROP TABLE records")
+        self.conn.execute("DROP TABLE groups")
+        self.conn.execute("ALTER TABLE groups_v1 RENAME TO groups")
+        self.conn.execute("ALTER TABLE records_v1 RENAME TO records")
+        self.conn.execute("CREATE INDEX idx_records_group ON records(group_id)")
+
+        self.conn.execute(
+            "UPDATE groups SET record_count = "
+            "(SELECT COUNT(*) FROM records WHERE records.group_id = groups.id)")
+        self.conn.execute('''CREATE TRIGGER trg_records_insert AFTER INSERT ON records BEGIN
+                            UPDATE groups SET record_count = record_count + 1 WHERE id = NEW.group_id;
+                        END''')
+        self.conn.execute('''CREATE TRIGGER trg_records_delete AFTER DELETE ON records BEGIN
+                            UPDATE groups SET record_count = record_count - 1 WHERE id = OLD.group_id;
+                        END''')
+        self.conn.execute('''CREATE TRIGGER trg_records_move AFTER UPDATE OF group_id ON records
+                        WHEN OLD.group_id <> NEW.group_id BEGIN
+                            UPDATE groups SET record_count = record_count - 1 WHERE id = OLD.group_id;
+                            UPDATE groups SET record_count = record_count + 1 WHERE id = NEW.group_id;
+                        END''')
+
+    def _migrate_v2_pinned_clips(self):
+        """剪贴板记录支持置顶，置顶记录优先显示且不会被清空或按数量淘汰"""
+        self.conn.execute("ALTER TABLE clips ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0")
+        self.conn.execute("CREATE INDEX idx_clips_pinned ON clips(pinned, id)")
+
+    def _migrate_v3_clip_fingerprints(self):
+        """设置表；剪贴板记录增加规范化摘要和 SimHash 指纹（分段索引）"""
+        self.conn.execute('''CREATE TABLE settings (
+                        key TEXT PRIMARY KEY,
+                        value TEXT NOT NULL)''')
+        self.conn.execute("ALTER TABLE clips ADD COLUMN norm_hash TEXT")
+        self.conn.execute("ALTER TABLE clips ADD COLUMN simhash INTEGER")
+        self.conn.execute("CREATE INDEX idx_clips_norm_hash ON clips(norm_hash)")
+        self.conn.execute('''CREATE TABLE clip_simhash_bands (
+                        band_key INTEGER NOT NULL,
+                        clip_id INTEGER NOT NULL REFERENCES clips(id) ON DELETE CASCADE,
+                        PRIMARY KEY (band_key, clip_id)) WITHOUT ROWID''')
+        self.conn.execute("CREATE INDEX idx_clip_simhash_bands_clip ON clip_simhash_bands(clip_id)")
+        # 已有记录的指纹由后台线程分批回填（norm_hash 为 NULL 表示尚未回填），不阻塞启动
+
+    def _migrate_v4_change_log(self):
+        """多机同步：记录全局 uid、本机变更日志、各设备同步进度和实体版本"""
+        self.conn.execute("ALTER TABLE records ADD COLUMN uid TEXT")
+        for (record_id,) in self.conn.execute("SELECT id FROM records").fetchall():
+            self.conn.execute("UPDATE records SET uid = ? WHERE id = ?", (uuid.uuid4().hex, record_id))
+        self.conn.execute("CREATE UNIQUE INDEX idx_records_uid ON records(uid)")
+
+        # 仅追加的本机变更日志，导出到共享目录后即可清理
+        self.conn.execute('''CREATE TABLE change_log (
+                        device_id TEXT NOT NULL,
+                        seq INTEGER NOT NULL,
+                        ts INTEGER NOT NULL,
+                        op TEXT NOT NULL,
+                        entity TEXT NOT NULL,
+                        payload TEXT NOT NULL,
+                        PRIMARY KEY (device_id, seq)) WITHOUT ROWID''')
+        # 本机一行：last_seq 为最后写入的序号，exported_seq 为已导出的序号；
+        # 其他设备各一行：last_seq 为已导入的序号
+        self.conn.execute('''CREATE TABLE sync_state (
+                        device_id TEXT PRIMARY KEY,
+                        last_seq INTEGER NOT NULL DEFAULT 0,
+                        exported_seq INTEGER NOT NULL DEFAULT 0)''')
+        # 每个实体最后一次修改的 (时间戳, 设备)，用于确定性的“后写者胜”冲突处理
+        self.conn.execute('''CREATE TABLE entity_versions (
+                        entity TEXT PRIMARY KEY,
+                        ts INTEGER NOT NULL,
+                        device_id TEXT NOT NULL) WITHOUT ROWID''')
+
+    def _migrate_v5_query_indexes(self):
+        """查询语法支持：整数时间戳列（UTC 秒）以及时间和长度索引"""
+        self.conn.execute("ALTER TABLE clips ADD COLUMN created INTEGER")
+        self.conn.execute("UPDATE clips SET created = CAST(strftime('%s', timestamp) AS INTEGER)")
+        self.conn.execute("CREATE INDEX idx_clips_created ON clips(created)")
+        self.conn.execute("CREATE INDEX idx_clips_length ON clips(length(content))")
+
+        # 旧记录没有创建时间，以升级时间为准
+        self.conn.execute("ALTER TABLE records ADD COLUMN created INTEGER")
+        self.conn.execute("UPDATE records SET created = CAST(strftime('%s', 'now') AS INTEGER)")
+        self.conn.execute("CREATE INDEX idx_records_created ON records(created)")
+        self.conn.execute("CREATE INDEX idx_records_length ON records(length(content))")
+
+    def _migrate_v6_content_kind(self):
+        """剪贴板内容类型列（后台分类，NULL 表示尚未分类）"""
+        self.conn.execute("ALTER TABLE clips ADD COLUMN kind TEXT")
+        self.conn.execute("CREATE INDEX idx_clips_kind ON clips(kind, pinned, id)")
+        # 待分类行的部分索引，回填时无需扫描整表
+        self.conn.execute("CREATE INDEX idx_clips_unclassified ON clips(id) WHERE kind IS NULL")
+
+    def _migrate_v7_record_order(self):
+        """记录的手动排序键，组内按原有 ID 顺序初始化"""
+        self.conn.execute("ALTER TABLE records ADD COLUMN sort_key TEXT NOT NULL DEFAULT ''")
+        for (group_id,) in self.conn.execute("SELECT id FROM groups").fetchall():
+            ids = [row[0] for row in self.conn.execute(
+                "SELECT id FROM records WHERE group_id = ? ORDER BY id", (group_id,))]
+            self.conn.executemany("UPDATE records SET sort_key = ? WHERE id = ?",
+                                  zip(spread_sort_keys(len(ids)), ids))
+        self.conn.execute("CREATE INDEX idx_records_sort ON records(group_id, sort_key)")
+
+    def _migrate_v8_clip_vectors(self):
+        """剪贴板内容的 3-gram 向量（相似内容），旧记录由后台线程回填"""
+        self.conn.execute("ALTER TABLE clips ADD COLUMN ngram BLOB")
+        self.conn.execute("CREATE INDEX idx_clips_no_ngram ON clips(id) WHERE ngram IS NULL")
+
+    def _migrate_v9_soft_delete(self):
+        """软删除：deleted 为所属删除批次的 ID（0 表示未删除），可撤销，过期后由后台分批清理"""
+        self.conn.execute('''CREATE TABLE deletions (
+                        id INTEGER PRIMARY KEY,
+                        created INTEGER NOT NULL,
+                        label TEXT NOT NULL,
+                        local INTEGER NOT NULL DEFAULT 0)''')  # 只作用于本机的删除，撤销时也不写同步日志
+        for table in ('clips', 'records', 'groups'):
+            self.conn.execute(f"ALTER TABLE {table} ADD COLUMN deleted INTEGER NOT NULL DEFAULT 0")
+        # 默认列表只走未删除行的部分索引；已删除行另有部分索引供清理时查找
+        self.conn.execute("DROP INDEX idx_clips_pinned")
+        self.conn.execute("CREATE INDEX idx_clips_live ON clips(pinned, id) WHERE deleted = 0")
+        self.conn.execute("CREATE INDEX idx_clips_deleted ON clips(deleted) WHERE deleted <> 0")
+        self.conn.execute("CREATE INDEX idx_records_deleted ON records(deleted) WHERE deleted <> 0")
+
+        # 组内记录数只统计未删除的记录
+        self.conn.execute("DROP TRIGGER trg_records_delete")
+        self.conn.execute('''CREATE TRIGGER trg_records_delete AFTER DELETE ON records WHEN OLD.deleted = 0 BEGIN
+                            UPDATE groups SET record_count = record_count - 1 WHERE id = OLD.group_id;
+                        END''')
+        self.conn.execute('''CREATE TRIGGER trg_records_tombstone AFTER UPDATE OF deleted ON records
+                        WHEN (OLD.deleted = 0) <> (NEW.deleted = 0) BEGIN
+                            UPDATE groups SET record_count = record_count + (CASE WHEN NEW.deleted = 0 THEN 1 ELSE -1 END)
+                            WHERE id = NEW.group_id;
+                        END''')
+
+    def _migrate_v10_clear_watermark(self):
+        """清空历史只记水位线：clear_upto 为清空时的最大 ID（0 表示普通删除批次），不再逐行打删除标记"""
+        self.conn.execute("ALTER TABLE deletions ADD COLUMN clear_upto INTEGER NOT NULL DEFAULT 0")
+
+    def changed(self):
+        """所有修改数据的方法都要调用，使查询缓存失效"""
+        self.write_generation += 1
+        self.query_cache.clear()
+
+    def reload(self):
+        """数据库内容被整体替换（如从备份恢复）后，升级结构并重新读取缓存状态"""
+        self.changed()
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.migrate()
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.settings = self.load_settings()
+        self.apply_memory_budgets()
+        self.init_sync_state()
+        self.vector_index.clear()
+
+    def apply_memory_budgets(self):
+        """按设置限制查询缓存和 SQLite 页缓存的大小"""
+        self.query_cache.max_bytes = self.get_setting('query_cache_budget_kb') * 1024
+        self.conn.execute(f"PRAGMA cache_size = -{max(int(self.get_setting('sqlite_cache_budget_kb')), 64)}")
+
+    def load_settings(self):
+        """读取设置，缺省项使用 DEFAULT_SETTINGS，并按默认值的类型转换"""
+        settings = dict(self.DEFAULT_SETTINGS)
+        for key, value in self.conn.execute("SELECT key, value FROM settings"):
+            if key in settings:
+                default = settings[key]
+                try:
+                    settings[key] = (value == '1') if isinstance(default, bool) else type(default)(value)
+                except ValueError:
+                    pass
+            else:
+                settings[key] = value
+        return settings
+
+    def get_setting(self, key):
+        return self.settings.get(key, self.DEFAULT_SETTINGS.get(key))
+
+    def set_setting(self, key, value):
+        self.settings[key] = value
+        stored = str(int(value)) if isinstance(value, bool) else str(value)
+        self.conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, stored))
+        self.conn.commit()
+
+    def init_sync_state(self):
+        """生成本机设备 ID 并读取变更日志序号和逻辑时钟"""
+        if not self.get_setting('device_id'):
+            self.set_setting('device_id', uuid.uuid4().hex)
+        self.device_id = self.get_setting('device_id')
+        self.conn.execute("INSERT OR IGNORE INTO sync_state (device_id) VALUES (?)", (self.device_id,))
+        self.conn.commit()
+        self.sync_seq = self.conn.execute(
+            "SELECT last_seq FROM sync_state WHERE device_id = ?", (self.device_id,)).fetchone()[0]
+        self.clock = self.conn.execute("SELECT COALESCE(MAX(ts), 0) FROM entity_versions").fetchone()[0]
+
+    @property
+    def sync_enabled(self):
+        return bool(self.get_setting('sync_dir'))
+
+    def tick(self, observed=0):
+        """混合逻辑时钟：取当前毫秒时间、上次时钟 +1 和观察到的远端时间戳中的最大值"""
+        self.clock = max(int(time.time() * 1000), self.clock + 1, observed)
+        return self.clock
+
+    def set_entity_version(self, entity, ts, device_id):
+        self.conn.execute("INSERT OR REPLACE INTO entity_versions (entity, ts, device_id) VALUES (?, ?, ?)",
+                          (entity, ts, device_id))
+
+    def log_change(self, op, entity, payload):
+        """同步开启时在当前事务中追加一条变更日志（由调用方提交）"""
+        if not self.sync_enabled:
+            return
+        ts = self.tick()
+        self.sync_seq += 1
+        self.conn.execute("UPDATE sync_state SET last_seq = ? WHERE device_id = ?", (self.sync_seq, self.device_id))
+        self.conn.execute(
+            "INSERT INTO change_log (device_id, seq, ts, op, entity, payload) VALUES (?, ?, ?, ?, ?, ?)",
+            (self.device_id, self.sync_seq, ts, op, entity, json.dumps(payload, ensure_ascii=False)))
+        self.set_entity_version(entity, ts, self.device_id)
+
+    def log_clip_changes(self, op, clip_ids, **extra):
+        """为一批剪贴板记录写变更日志，实体以内容摘要标识（各设备上的行 ID 不同）"""
+        if not self.sync_enabled or not clip_ids:
+            return
+        rows = self.conn.execute(
+            f"SELECT content, norm_hash FROM clips WHERE id IN ({','.join('?' * len(clip_ids))})",
+            list(clip_ids)).fetchall()
+        for content, norm_hash in rows:
+            digest = content_digest(content)
+            payload = {'content': content} if op == 'clip_put' else {'digest': digest, 'norm_hash': norm_hash}
+            payload.update(extra)
+            self.log_change(op, 'clip:' + digest, payload)
+
+    def log_record_changes(self, op, record_ids):
+        if not self.sync_enabled or not record_ids:
+            return
+        rows = self.conn.execute(
+            "SELECT r.uid, g.name, r.content, r.sort_key FROM records r JOIN groups g ON g.id = r.group_id "
+            f"WHERE r.id IN ({','.join('?' * len(record_ids))})", list(record_ids)).fetchall()
+        for uid, group, content, sort_key in rows:
+            payload = {'uid': uid} if op == 'record_delete' else {
+                'uid': uid, 'group': group, 'content': content, 'sort_key': sort_key}
+            self.log_change(op, 'record:' + uid, payload)
+
+    def find_duplicate(self, content, normalized, digest, fingerprint):
+        """按配置查找与新内容重复的记录 ID：完全相同 → 规范化后相同 → 近似重复"""
+        # 完全相同（借助 norm_hash 索引，无需扫描 content）；尚未回填指纹的旧记录只能按原文比较
+        row = self.conn.execute("SELECT id FROM clips WHERE (norm_hash = ? OR norm_hash IS NULL) "
+                                f"AND content = ? AND {live_clip_condition()}", (digest, content)).fetchone()
+        if row:
+            return row[0]
+
+        if self.get_setting('dedup_normalized'):
+            row = self.conn.execute(f"SELECT id FROM clips WHERE norm_hash = ? AND {live_clip_condition()} LIMIT 1",
+                                    (digest,)).fetchone()
+            if row:
+                return row[0]
+
+        if self.get_setting('dedup_near') and fingerprint is not None:
+            max_distance = min(self.get_setting('near_dup_distance'), SIMHASH_BANDS - 1)
+            keys = simhash_bands(fingerprint)
+            candidates = self.conn.execute(
+                "SELECT DISTINCT c.id, c.simhash FROM clip_simhash_bands b "
+                "JOIN clips c ON c.id = b.clip_id "
+                f"WHERE b.band_key IN ({','.join('?' * len(keys))}) AND {live_clip_condition('c.')}", keys)
+            for clip_id, other in candidates:
+                if other is not None and hamming_distance(fingerprint, other) <= max_distance:
+                    return clip_id
+        return None
     
     def save_clip(self, content):
-        """保存新的剪贴板内容"""
+        """保存新的剪贴板内容（按设置合并完全相同、规范化后相同和近似重复的内容）"""
         if not content or content.isspace():
             return False
             
         try:
+            normalized = normalize_content(content)
+            digest = content_digest(normalized)
+            fingerprint = simhash(normalized)
+
             # 检查是否已存在相同内容
-            cursor = self.conn.execute("SELECT id FROM clips WHERE content = ?", (content,))
-            if cursor.fetchone():
+            if self.find_duplicate(content, normalized, digest, fingerprint) is not None:
                 return False
                 
-            self.conn.execute("INSERT INTO clips (content) VALUES (?)", (content,))
+            clip_id = self.insert_clip(content, digest, fingerprint, vector=ngram_vector(normalized))
+            self.log_clip_changes('clip_put', [clip_id])
             self.conn.commit()
             print(f"保存新内容: {content[:50]}{'...' if len(content) > 50 else ''}")
             return True
@@ -124,109 +1146,1814 @@ class ReuseDatabase:
             print(f"数据库保存错误: {e}")
             return False
     
+    def insert_clip(self, content, digest=None, fingerprint=None, pinned=0, vector=None):
+        """插入一条剪贴板记录及其指纹索引和相似内容向量（不检查重复、不提交）"""
+        if digest is None:
+            normalized = normalize_content(content)
+            digest, fingerprint = content_digest(normalized), simhash(normalized)
+            vector = ngram_vector(normalized)
+        self.changed()
+        clip_id = self.conn.execute(
+            "INSERT INTO clips (id, content, pinned, norm_hash, simhash, created, ngram) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self.next_clip_id(), content, pinned, digest, fingerprint, int(time.time()),
+             vector or b'')).lastrowid  # 空串：内容过短，无需回填
+        self.last_clip_id = clip_id
+        self.vector_index.add(clip_id, vector)
+        if fingerprint is not None:
+            self.conn.executemany("INSERT INTO clip_simhash_bands (band_key, clip_id) VALUES (?, ?)",
+                                  [(key, clip_id) for key in simhash_bands(fingerprint)])
+        return clip_id
+
+    def next_clip_id(self):
+        """新行的 ID：高于现有的最大 ID 和清空历史的水位线
+
+        清空的行被后台清理掉之后，SQLite 默认的“最大 ID + 1”可能落在水位线以下，新内容会被当作已清空。
+        """
+        return self.conn.execute(f"SELECT MAX(COALESCE((SELECT MAX(id) FROM clips), 0), {CLEAR_WATERMARK_SQL}) + 1"
+                                 ).fetchone()[0]
+
+    def clear_watermark(self):
+        return self.conn.execute(f"SELECT {CLEAR_WATERMARK_SQL}").fetchone()[0]
+
     def get_all_clips(self, limit=200):
+        key = ('clip', None, '', limit)
+        clips = self.query_cache.get(key, self.write_generation)
+        if clips is not None:
+            return clips
         try:
             cursor = self.conn.execute(
-                "SELECT id, content, timestamp FROM clips "
-                "ORDER BY id DESC LIMIT ?", 
+                # pinned IN (1, 0) 让两段都按 (pinned, id) 范围查找，跳过清空历史水位线以下、尚未清理的行
+                f"SELECT id, content, timestamp, pinned FROM clips WHERE pinned IN (1, 0) AND {live_clip_condition()} "
+                "ORDER BY pinned DESC, id DESC LIMIT ?",  # 由部分索引 idx_clips_live 提供顺序
                 (limit,))
-            clips = cursor.fetchall()
+            clips = tuple(cursor.fetchall())
             print(f"从数据库加载 {len(clips)} 条记录")
+            self.query_cache.put(key, self.write_generation, clips)
             return clips
         except sqlite3.Error as e:
             print(f"数据库查询错误: {e}")
             return []
     
-    def search_clips(self, keyword, limit=100):
+    def get_recent_clips(self, limit, preview_chars=200):
+        """最近使用的剪贴板内容 [(id, 内容开头), ...]（复制、粘贴都会把内容移到最新）"""
+        return self.conn.execute(f"SELECT id, substr(content, 1, ?) FROM clips WHERE {live_clip_condition()} "
+                                 "ORDER BY id DESC LIMIT ?", (preview_chars, limit)).fetchall()
+
+    def get_clip_content(self, clip_id):
+        row = self.conn.execute("SELECT content FROM clips WHERE id = ?", (clip_id,)).fetchone()
+        return row[0] if row else None
+
+    def search_clips(self, keyword, limit=100, kind=None):
+        """按查询语法搜索剪贴板（group: 条件只对记录有效），kind 为类型筛选框的选择"""
+        query = SearchQuery(keyword)
+        if kind:
+            query.kind = kind
+        key = self.clip_search_key(query, limit)
+        clips = self.query_cache.get(key, self.write_generation)
+        if clips is not None:
+            return clips
         try:
+            clauses, params = query.conditions('content', 'created', 'kind', self.clip_range_index(query))
             cursor = self.conn.execute(
-                "SELECT id, content, timestamp FROM clips "
-                "WHERE content LIKE ? "
-                "ORDER BY id DESC LIMIT ?",
-                ('%' + keyword + '%', limit)
+                "SELECT id, content, timestamp, pinned FROM clips "
+                f"WHERE {' AND '.join(['pinned IN (1, 0)', live_clip_condition()] + clauses)} "
+                "ORDER BY pinned DESC, id DESC LIMIT ?",
+                params + [limit]
             )
-            return cursor.fetchall()
+            clips = tuple(cursor.fetchall())
+            self.query_cache.put(key, self.write_generation, clips)
+            return clips
         except sqlite3.Error as e:
             print(f"数据库搜索错误: {e}")
             return []
     
+    def clip_range_index(self, query):
+        """范围条件足够有选择性时，返回用来选候选行的范围索引（'created' 或 'length'），否则返回 None
+
+        范围很宽时沿 idx_clips_live 从新到旧过滤，很快就能凑够结果；范围很窄时这样会扫过大半个表，
+        改为先在 idx_clips_created / idx_clips_length 中取出范围内的 ID。命中行数只数到 RANGE_CANDIDATES_MAX。
+        """
+        best = None
+        for name, (clauses, params) in query.range_conditions('content', 'created').items():
+            count = self.conn.execute(
+                f"SELECT COUNT(*) FROM (SELECT 1 FROM clips WHERE {' AND '.join(clauses)} LIMIT ?)",
+                params + [self.RANGE_CANDIDATES_MAX + 1]).fetchone()[0]
+            if count <= self.RANGE_CANDIDATES_MAX and (best is None or count < best[0]):
+                best = (count, name)
+        return best and best[1]
+
+    def clip_search_key(self, query, limit):
+        """剪贴板搜索结果在查询缓存中的键（并行扫描的结果也存放在这里）"""
+        return ('clip', None, query.cache_key(), limit)
+
+    def set_clip_vectors(self, generation, pairs, computed=True):
+        """后台线程加载或回填的向量 [(clip_id, 向量), ...]：加入索引，新计算的写回数据库
+
+        索引在加载开始后被清空（如从备份恢复）时丢弃结果。向量不影响任何查询结果，写回时不使查询缓存失效。
+        """
+        if generation != self.vector_index.generation:
+            return
+        for clip_id, vector in pairs:
+            self.vector_index.add(clip_id, vector)
+        if computed:
+            with self.conn:
+                self.conn.executemany("UPDATE clips SET ngram = ? WHERE id = ? AND ngram IS NULL",
+                                      [(vector, clip_id) for clip_id, vector in pairs])
+
+    def similar_clips(self, clip_id, limit=20):
+        """与指定剪贴板内容最相似的至多 limit 条记录 [((id, content, timestamp, pinned), 相似度), ...]
+
+        相似度不超过 NGRAM_MIN_SIMILARITY 的不算相似，没有相似内容时返回空列表。
+        """
+        vector = self.vector_index.vector(clip_id)
+        if vector is None:
+            row = self.conn.execute("SELECT content, ngram FROM clips WHERE id = ?", (clip_id,)).fetchone()
+            if row is None:
+                return []
+            vector = row[1] or ngram_vector(normalize_content(row[0]))
+            if vector is None:
+                return []
+
+        # 索引中的行可能已被清理或同步删除，查到不存在的 ID 时从索引移除并补足；
+        # 已清空的行在可撤销期间仍留在索引中，按水位线跳过
+        results, exclude, watermark = [], {clip_id}, self.clear_watermark()
+        while len(results) < limit:
+            found = self.vector_index.nearest(vector, limit - len(results), exclude, watermark)
+            # 结果按相似度从高到低排列，出现不相关的内容后就不必再补足
+            candidates = [(i, score) for i, score in found if score > NGRAM_MIN_SIMILARITY]
+            if not candidates:
+                break
+            ids = [candidate for candidate, _ in candidates]
+            rows = {row[0]: row for row in self.conn.execute(
+                f"SELECT id, content, timestamp, pinned FROM clips WHERE id IN ({','.join('?' * len(ids))}) "
+                f"AND {live_clip_condition()}", ids)}
+            self.vector_index.discard([i for i in ids if i not in rows])
+            results.extend((rows[i], score) for i, score in candidates if i in rows)
+            exclude.update(ids)
+            if len(candidates) < len(found):
+                break
+        return results
+
+    def clips_archived(self, clip_ids):
+        """后台维护把一批剪贴板内容移入了归档库：使查询缓存失效，并从相似内容索引中去掉已不在主库的行"""
+        self.changed()
+        placeholders = ','.join('?' * len(clip_ids))
+        remaining = {row[0] for row in self.conn.execute(f"SELECT id FROM clips WHERE id IN ({placeholders})",
+                                                          clip_ids)}
+        self.vector_index.discard([clip_id for clip_id in clip_ids if clip_id not in remaining])
+
+    def set_clip_fingerprints(self, rows):
+        """写入后台回填的指纹 [(clip_id, 规范化摘要, SimHash), ...]（不影响查询结果，不使查询缓存失效）"""
+        with self.conn:
+            for clip_id, digest, fingerprint in rows:
+                cursor = self.conn.execute("UPDATE clips SET norm_hash = ?, simhash = ? "
+                                           "WHERE id = ? AND norm_hash IS NULL", (digest, fingerprint, clip_id))
+                if cursor.rowcount and fingerprint is not None:
+                    self.conn.executemany("INSERT INTO clip_simhash_bands (band_key, clip_id) VALUES (?, ?)",
+                                          [(key, clip_id) for key in simhash_bands(fingerprint)])
+
+    def set_clip_kinds(self, pairs):
+        """写入后台分类结果 [(clip_id, kind), ...]；提交后、确有行被分类时才使查询缓存失效"""
+        with self.conn:
+            cursor = self.conn.executemany("UPDATE clips SET kind = ? WHERE id = ? AND kind IS NULL",
+                                           [(kind, clip_id) for clip_id, kind in pairs])
+        if cursor.rowcount > 0:
+            self.changed()
+
+    def clip_id_range(self):
+        """剪贴板 ID 的最小值和最大值（主键索引两端，代价为常数）"""
+        return self.conn.execute("SELECT MIN(id), MAX(id) FROM clips").fetchone()
+
     def delete_clip(self, clip_id):
         """删除指定ID的记录""" 
-        self.conn.execute("DELETE FROM clips WHERE id = ?", (clip_id,))
-        self.conn.commit()
+        self.delete_clips([clip_id])
+    
+    def delete_clips(self, clip_ids):
+        """批量删除剪贴板记录（单个事务，只做删除标记，可撤销），返回删除批次 ID"""
+        self.changed()
+        with self.conn:
+            self.log_clip_changes('clip_delete', clip_ids)
+            deletion = self.new_deletion(f"删除 {len(clip_ids)} 条剪贴板内容")
+            cursor = self.conn.executemany("UPDATE clips SET deleted = ? WHERE id = ? AND deleted = 0",
+                                           [(deletion, i) for i in clip_ids])
+            deletion = self.finish_deletion(deletion, cursor.rowcount)
+        self.vector_index.discard(clip_ids)
+        return deletion
+
+    def new_deletion(self, label, local=False, clear_upto=0):
+        """新建一个删除批次（不提交），被删除的行以批次 ID 标记；清空历史的批次只记水位线 clear_upto"""
+        return self.conn.execute("INSERT INTO deletions (created, label, local, clear_upto) VALUES (?, ?, ?, ?)",
+                                 (int(time.time()), label, int(local), clear_upto)).lastrowid
+
+    def finish_deletion(self, deletion, count):
+        """没有标记任何行时去掉空的删除批次，返回批次 ID 或 None"""
+        if count > 0:
+            return deletion
+        self.conn.execute("DELETE FROM deletions WHERE id = ?", (deletion,))
+        return None
+
+    def undoable_deletions(self, limit=20):
+        """撤销栈：仍在可撤销时间内的删除批次 [(id, 时间戳, 说明), ...]，最新的在前"""
+        cutoff = int(time.time()) - self.get_setting('undo_minutes') * 60
+        return self.conn.execute("SELECT id, created, label FROM deletions WHERE created >= ? "
+                                 "ORDER BY id DESC LIMIT ?", (cutoff, limit)).fetchall()
+
+    def undo_deletion(self, deletion):
+        """撤销一个删除批次，返回恢复的行数；已超过可撤销时间（可能正在被清理）时返回 None
+
+        删除后又重新复制过的内容不再恢复（与去重规则一致，保留较新的那一行和它的位置），
+        这些行留在批次中，批次立即过期，由后台清理。
+        """
+        cutoff = int(time.time()) - self.get_setting('undo_minutes') * 60
+        row = self.conn.execute("SELECT created, local, clear_upto FROM deletions WHERE id = ?",
+                                (deletion,)).fetchone()
+        if row is None or row[0] < cutoff:
+            return None
+        local, clear_upto = row[1], row[2]
+        if clear_upto:
+            return self.undo_clear(deletion, clear_upto)
+        # 尚未回填指纹的行先补上摘要，才能与现有内容比较
+        pending = self.conn.execute("SELECT id, content FROM clips WHERE deleted = ? AND deleted <> 0 AND norm_hash IS NULL",
+                                    (deletion,)).fetchall()
+        if pending:
+            self.set_clip_fingerprints([(clip_id, content_digest(normalized), simhash(normalized))
+                                        for clip_id, normalized in
+                                        ((clip_id, normalize_content(content)) for clip_id, content in pending)])
+        self.changed()
+        with self.conn:
+            # 条件中的 deleted <> 0 让查询使用已删除行的部分索引，而不是扫描整表
+            candidates = self.conn.execute("SELECT id, ngram FROM clips WHERE deleted = ? AND deleted <> 0",
+                                           (deletion,)).fetchall()
+            record_ids = [r[0] for r in self.conn.execute("SELECT id FROM records WHERE deleted = ? AND deleted <> 0",
+                                                          (deletion,))]
+            groups = self.conn.execute("SELECT id, name FROM groups WHERE deleted = ?", (deletion,)).fetchall()
+            self.conn.execute(
+                "UPDATE clips SET deleted = 0 WHERE deleted = ? AND deleted <> 0 AND NOT EXISTS ("
+                f"  SELECT 1 FROM clips live WHERE live.norm_hash = clips.norm_hash AND {live_clip_condition('live.')}"
+                "  AND (? OR live.content = clips.content))",
+                (deletion, int(self.get_setting('dedup_normalized'))))
+            skipped = {r[0] for r in self.conn.execute("SELECT id FROM clips WHERE deleted = ? AND deleted <> 0",
+                                                      (deletion,))}
+            clips = [(clip_id, vector) for clip_id, vector in candidates if clip_id not in skipped]
+            for table in ('records', 'groups'):
+                self.conn.execute(f"UPDATE {table} SET deleted = 0 WHERE deleted = ? AND deleted <> 0", (deletion,))
+            if skipped:
+                self.conn.execute("UPDATE deletions SET created = 0 WHERE id = ?", (deletion,))
+            else:
+                self.conn.execute("DELETE FROM deletions WHERE id = ?", (deletion,))
+
+            # 其他设备上已按同步日志删除，撤销时重新写入
+            if not local:
+                self.log_clip_changes('clip_put', [clip_id for clip_id, _ in clips])
+                for group_id, name in groups:
+                    self.log_change('group_add', 'group:' + name, {'name': name})
+                    record_ids += [r[0] for r in self.conn.execute(
+                        "SELECT id FROM records WHERE group_id = ? AND deleted = 0", (group_id,))]
+                self.log_record_changes('record_put', record_ids)
+        for clip_id, vector in clips:
+            self.vector_index.add(clip_id, vector)
+        return len(clips) + len(record_ids) + len(groups)
+
+    def undo_clear(self, deletion, clear_upto):
+        """撤销清空历史：去掉水位线，(其余清空批次的水位线, clear_upto] 区间内未删除的行重新可见，返回恢复的行数
+
+        清空后又复制过的内容（水位线以上的行）保留，区间内与之重复的旧行改用本批次标记，批次立即过期，由后台清理。
+        """
+        self.changed()
+        with self.conn:
+            lower = self.conn.execute("SELECT COALESCE(MAX(clear_upto), 0) FROM deletions WHERE id <> ?",
+                                      (deletion,)).fetchone()[0]
+            restored, skipped = 0, []
+            if lower < clear_upto:  # 否则这些行仍在更晚一次清空的水位线以下
+                # 从水位线以上的少量新行出发（CROSS JOIN 固定连接顺序），经 norm_hash 索引找到区间内的重复行
+                self.conn.execute(
+                    "UPDATE clips SET deleted = ?1 WHERE id IN ("
+                    "  SELECT old.id FROM clips live CROSS JOIN clips old ON old.norm_hash = live.norm_hash"
+                    "  WHERE live.id > ?3 AND live.deleted = 0 AND old.id > ?2 AND old.id <= ?3 AND old.deleted = 0"
+                    "  AND (?4 OR old.content = live.content))",
+                    (deletion, lower, clear_upto, int(self.get_setting('dedup_normalized'))))
+                skipped = [r[0] for r in self.conn.execute(
+                    "SELECT id FROM clips WHERE deleted = ? AND deleted <> 0", (deletion,))]
+                restored = self.conn.execute("SELECT COUNT(*) FROM clips WHERE id > ? AND id <= ? AND deleted = 0",
+                                             (lower, clear_upto)).fetchone()[0]
+            if skipped:
+                self.conn.execute("UPDATE deletions SET created = 0, clear_upto = 0 WHERE id = ?", (deletion,))
+            else:
+                self.conn.execute("DELETE FROM deletions WHERE id = ?", (deletion,))
+        self.vector_index.discard(skipped)
+        return restored
+
+    def set_clips_pinned(self, clip_ids, pinned=True):
+        """批量置顶/取消置顶（单个事务）"""
+        self.changed()
+        with self.conn:
+            self.conn.executemany("UPDATE clips SET pinned = ? WHERE id = ?",
+                                  [(int(pinned), i) for i in clip_ids])
+            self.log_clip_changes('clip_pin', clip_ids, pinned=bool(pinned))
     
     def clear_all(self):
-        """清空所有记录"""
-        self.conn.execute("DELETE FROM clips")
-        self.conn.commit()
+        """清空所有非置顶记录（只作用于本机，不同步），可撤销，返回删除批次 ID（没有可清空的内容时返回 None）
+
+        不逐行修改：置顶记录先移到最新，再把清空前的最大 ID 记为水位线，水位线以下的行对所有查询立即不可见，
+        过期后由后台分批删除。耗时只与置顶记录数有关，与历史条数无关。
+        """
+        if self.conn.execute(f"SELECT 1 FROM clips WHERE pinned = 0 AND {live_clip_condition()} LIMIT 1"
+                             ).fetchone() is None:
+            return None
+        self.changed()
+        with self.conn:
+            clear_upto = self.conn.execute("SELECT MAX(id) FROM clips").fetchone()[0]
+            for (clip_id,) in self.conn.execute(
+                    f"SELECT id FROM clips WHERE pinned = 1 AND {live_clip_condition()} ORDER BY id").fetchall():
+                self.move_clip_to_latest(clip_id, keep_time=True)
+            return self.new_deletion("清空剪贴板历史", local=True, clear_upto=clear_upto)
     
     def set_limit(self, limit):
-        """设置历史记录最大数量并保留最新记录"""
+        """设置历史记录最大数量并保留最新记录（置顶记录不计入、不删除；只作用于本机）
+
+        已做删除标记或已清空的行不计入也不在这里删除，仍可撤销，过期后由后台清理。
+        """
+        self.changed()
         self.conn.execute(
-            "DELETE FROM clips WHERE id NOT IN ("
-            "  SELECT id FROM clips "
+            f"DELETE FROM clips WHERE pinned = 0 AND {live_clip_condition()} AND id NOT IN ("
+            f"  SELECT id FROM clips WHERE pinned = 0 AND {live_clip_condition()} "
             "  ORDER BY id DESC LIMIT ?"
             ")", (limit,))
         self.conn.commit()
+        self.vector_index.retain(row[0] for row in self.conn.execute("SELECT id FROM clips WHERE deleted = 0"))
+
+    def update_clip_as_latest(self, clip_id):
+        """将指定ID的内容更新为最新记录（删除后重新插入）"""
+        new_id = self.move_clip_to_latest(clip_id)
+        if new_id is None:
+            return False
+        self.log_clip_changes('clip_put', [new_id])
+        self.conn.commit()
+        return True
+
+    def move_clip_to_latest(self, clip_id, keep_time=False):
+        """复制为新行（保留置顶和指纹，keep_time 时也保留时间）后删除旧行，返回新 ID（不提交）"""
+        self.changed()
+        now = None if keep_time else int(time.time())
+        cursor = self.conn.execute(
+            "INSERT INTO clips (id, content, pinned, norm_hash, simhash, created, timestamp, kind, ngram) "
+            "SELECT ?1, content, pinned, norm_hash, simhash, COALESCE(?2, created), "
+            "COALESCE(datetime(?2, 'unixepoch'), timestamp), kind, ngram FROM clips WHERE id = ?3",
+            (self.next_clip_id(), now, clip_id))
+        if cursor.rowcount == 0:
+            return None
+
+        new_id = cursor.lastrowid
+        self.conn.execute("INSERT INTO clip_simhash_bands (band_key, clip_id) "
+                          "SELECT band_key, ? FROM clip_simhash_bands WHERE clip_id = ?", (new_id, clip_id))
+        self.conn.execute("DELETE FROM clips WHERE id = ?", (clip_id,))
+        self.vector_index.discard([clip_id])
+        self.vector_index.add(new_id, self.conn.execute("SELECT ngram FROM clips WHERE id = ?", (new_id,)).fetchone()[0])
+        return new_id
+
+    def get_group_id(self, group_name, create=False):
+        """根据组名查询组 ID，create=True 时不存在则新建"""
+        row = self.conn.execute("SELECT id FROM groups WHERE name = ? AND deleted = 0", (group_name,)).fetchone()
+        if row:
+            return row[0]
+        if not create:
+            return None
+        self.changed()
+        group_id = self.revive_deleted_group(group_name)
+        if group_id is not None:
+            return group_id
+        return self.conn.execute("INSERT INTO groups (name) VALUES (?)", (group_name,)).lastrowid
+
+    def add_record(self, content, group="默认"):
+        """添加一条记录（组不存在时自动创建）"""
+        self.add_records([content], group)
+
+    def add_records(self, contents, group="默认"):
+        """批量添加记录到同一个组（单个事务）"""
+        self.changed()
+        with self.conn:
+            group_id = self.get_group_id(group or self.DEFAULT_GROUP, create=True)
+            keys = self.sort_keys_at_end(group_id, len(contents))
+            record_ids = [
+                self.conn.execute("INSERT INTO records (group_id, content, uid, created, sort_key) "
+                                  "VALUES (?, ?, ?, ?, ?)",
+                                  (group_id, c, uuid.uuid4().hex, int(time.time()), key)).lastrowid
+                for c, key in zip(contents, keys)
+            ]
+            self.log_record_changes('record_put', record_ids)
+
+    def get_records(self, group=None, keyword=""):
+        """按组和查询语法获取记录；下拉框的组与 group: 条件同时生效"""
+        query = SearchQuery(keyword)
+        key = ('record', group or None, query.cache_key(), None)
+        records = self.query_cache.get(key, self.write_generation)
+        if records is not None:
+            return records
+        clauses, params = query.conditions('r.content', 'r.created')
+        for name in {group, query.group} - {None, ''}:
+            group_id = self.get_group_id(name)
+            if group_id is None:
+                return ()
+            clauses.insert(0, "r.group_id = ?")
+            params.insert(0, group_id)
+        sql = ("SELECT r.id, g.name, r.content FROM records r "
+               "JOIN groups g ON g.id = r.group_id "
+               "WHERE " + " AND ".join(clauses + ["r.deleted = 0", "g.deleted = 0"]))
+        sql += " ORDER BY r.group_id, r.sort_key, r.id"  # 由 idx_records_sort 提供顺序
+        try:
+            cursor = self.conn.execute(sql, params)
+        except sqlite3.Error as e:
+            print(f"数据库搜索错误: {e}")
+            return ()
+        records = tuple(cursor.fetchall())
+        self.query_cache.put(key, self.write_generation, records)
+        return records
+
+    def delete_record(self, record_id):
+        """删除指定记录"""
+        self.delete_records([record_id])
+
+    def delete_records(self, record_ids):
+        """批量删除记录（单个事务，只做删除标记，可撤销），返回删除批次 ID"""
+        self.changed()
+        with self.conn:
+            self.log_record_changes('record_delete', record_ids)
+            deletion = self.new_deletion(f"删除 {len(record_ids)} 条记录")
+            cursor = self.conn.executemany("UPDATE records SET deleted = ? WHERE id = ? AND deleted = 0",
+                                           [(deletion, i) for i in record_ids])
+            return self.finish_deletion(deletion, cursor.rowcount)
+
+    def move_records(self, record_ids, group_name):
+        """批量移动记录到已存在的组（单个事务）"""
+        group_id = self.get_group_id(group_name)
+        if group_id is None:
+            return False
+        self.changed()
+        with self.conn:
+            keys = self.sort_keys_at_end(group_id, len(record_ids))  # 移入的记录排在目标组末尾
+            self.conn.executemany("UPDATE records SET group_id = ?, sort_key = ? WHERE id = ?",
+                                  [(group_id, key, i) for i, key in zip(record_ids, keys)])
+            self.log_record_changes('record_put', record_ids)
+        return True
+
+    def sort_keys_at_end(self, group_id, count):
+        last = self.conn.execute("SELECT MAX(sort_key) FROM records WHERE group_id = ?", (group_id,)).fetchone()[0]
+        return self.assign_sort_keys(group_id, last or None, None, count)
+
+    def assign_sort_keys(self, group_id, lo, hi, count):
+        """生成 count 个介于 lo 和 hi 之间的键，键过长时记下该组等待重排"""
+        keys = sort_keys_between(lo, hi, count)
+        if keys and max(len(key) for key in keys) > SORT_KEY_MAX_LENGTH:
+            self.unbalanced_groups.add(group_id)
+        return keys
+
+    def place_records(self, record_ids, before_id=None, group_name=None):
+        """把同组的记录按给定顺序放到 before_id 之前（None 表示 group_name 组末尾）
+
+        只修改被移动的行，不会给整组重新编号；与目标不在同一组的记录忽略。
+        """
+        if before_id is not None:
+            row = self.conn.execute("SELECT group_id, sort_key FROM records WHERE id = ?", (before_id,)).fetchone()
+            if row is None:
+                return False
+            group_id, hi = row
+        else:
+            group_id, hi = self.get_group_id(group_name), None
+        moving = [i for i in record_ids if i != before_id]
+        in_group = {row[0] for row in self.conn.execute(
+            f"SELECT id FROM records WHERE group_id = ? AND id IN ({','.join('?' * len(moving))})",
+            [group_id] + moving)} if moving else set()
+        moving = [i for i in moving if i in in_group]
+        if not moving:
+            return False
+
+        # 下界：目标之前第一条不参与移动的记录
+        params = [group_id] + moving
+        where = f"group_id = ? AND id NOT IN ({','.join('?' * len(moving))})"
+        if hi is not None:
+            where += " AND sort_key < ?"
+            params.append(hi)
+        lo = self.conn.execute(f"SELECT MAX(sort_key) FROM records WHERE {where}", params).fetchone()[0]
+        self.changed()
+        with self.conn:
+            keys = self.assign_sort_keys(group_id, lo or None, hi, len(moving))
+            self.conn.executemany("UPDATE records SET sort_key = ? WHERE id = ?", zip(keys, moving))
+            self.log_record_changes('record_put', moving)
+        return True
+
+    def move_records_to_top(self, record_ids):
+        """把记录移到各自组的最前面（保持它们之间的相对顺序）"""
+        rows = self.conn.execute(
+            f"SELECT id, group_id FROM records WHERE id IN ({','.join('?' * len(record_ids))}) "
+            "ORDER BY group_id, sort_key, id", list(record_ids)).fetchall()
+        groups = OrderedDict()
+        for record_id, group_id in rows:
+            groups.setdefault(group_id, []).append(record_id)
+        for group_id, ids in groups.items():
+            first = self.conn.execute(
+                f"SELECT id FROM records WHERE group_id = ? AND id NOT IN ({','.join('?' * len(ids))}) "
+                "ORDER BY sort_key, id LIMIT 1", [group_id] + ids).fetchone()
+            if first:
+                self.place_records(ids, before_id=first[0])
+
+    def rebalance_sort_keys(self):
+        """给排序键过长的组重新生成等距的短键（很少发生，由界面在空闲时调用）"""
+        if not self.unbalanced_groups:
+            return
+        groups, self.unbalanced_groups = self.unbalanced_groups, set()
+        self.changed()
+        with self.conn:
+            for group_id in groups:
+                ids = [row[0] for row in self.conn.execute(
+                    "SELECT id FROM records WHERE group_id = ? ORDER BY sort_key, id", (group_id,))]
+                self.conn.executemany("UPDATE records SET sort_key = ? WHERE id = ?",
+                                      zip(spread_sort_keys(len(ids)), ids))
+                self.log_record_changes('record_put', ids)
+                print(f"已重排组 {group_id} 的 {len(ids)} 条记录的排序键")
+
+    def update_record(self, record_id, new_content, new_group="默认"):
+        """修改记录内容与组，目标组必须已存在"""
+        group_id = self.get_group_id(new_group)
+        if group_id is None:
+            return False
+        self.changed()
+        row = self.conn.execute("SELECT group_id FROM records WHERE id = ?", (record_id,)).fetchone()
+        if row and row[0] != group_id:
+            key = self.sort_keys_at_end(group_id, 1)[0]  # 换组时排到新组末尾
+            self.conn.execute("UPDATE records SET sort_key = ? WHERE id = ?", (key, record_id))
+        self.conn.execute("UPDATE records SET content=?, group_id=? WHERE id=?", (new_content, group_id, record_id))
+        self.log_record_changes('record_put', [record_id])
+        self.conn.commit()
+        return True
+
+    def get_groups(self):
+        """返回 [(组名, 记录数), ...]，记录数由触发器实时维护"""
+        return self.conn.execute("SELECT name, record_count FROM groups WHERE deleted = 0 ORDER BY id").fetchall()
+
+    def get_group_names(self):
+        return [name for name, _ in self.get_groups()]
+
+    def add_group(self, group_name):
+        """新建一个组"""
+        self.changed()
+        try:
+            if self.revive_deleted_group(group_name) is None:
+                self.conn.execute("INSERT INTO groups (name) VALUES (?)", (group_name,))
+            self.log_change('group_add', 'group:' + group_name, {'name': group_name})
+            self.conn.commit()
+            return True
+        except sqlite3.IntegrityError:
+            return False  # 组名已存在
+
+    def rename_group(self, old_name, new_name):
+        """重命名组，只修改 groups 中的一行"""
+        self.changed()
+        try:
+            self.drop_deleted_group(new_name)
+            cursor = self.conn.execute("UPDATE groups SET name = ? WHERE name = ? AND deleted = 0",
+                                       (new_name, old_name))
+            if cursor.rowcount > 0:
+                self.log_change('group_rename', 'group:' + old_name, {'old': old_name, 'new': new_name})
+            self.conn.commit()
+            return cursor.rowcount > 0
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
+            return False  # 新组名已存在
+
+    def delete_group(self, group_name):
+        """删除一个组及其所有记录：只标记组（记录随组隐藏），可撤销，返回删除批次 ID"""
+        self.changed()
+        with self.conn:
+            deletion = self.new_deletion(f"删除组“{group_name}”")
+            cursor = self.conn.execute("UPDATE groups SET deleted = ? WHERE name = ? AND deleted = 0",
+                                       (deletion, group_name))
+            if cursor.rowcount > 0:
+                self.log_change('group_delete', 'group:' + group_name, {'name': group_name})
+            return self.finish_deletion(deletion, cursor.rowcount)
+
+    def revive_deleted_group(self, group_name):
+        """组名被已删除、尚未清理的组占用时，恢复该组但不恢复组内原有记录，返回组 ID（没有这样的组时返回 None）
+
+        原有记录改为逐条标记为同一删除批次，仍可随该批次撤销，过期后照常清理（不提交）。
+        """
+        row = self.conn.execute("SELECT id, deleted FROM groups WHERE name = ? AND deleted <> 0",
+                                (group_name,)).fetchone()
+        if row is None:
+            return None
+        group_id, deletion = row
+        self.conn.execute("UPDATE records SET deleted = ? WHERE group_id = ? AND deleted = 0", (deletion, group_id))
+        self.conn.execute("UPDATE groups SET deleted = 0 WHERE id = ?", (group_id,))
+        return group_id
+
+    def drop_deleted_group(self, group_name):
+        """组名被已删除、尚未清理的组占用时，立即彻底删除该组（外键级联删除记录），让出组名"""
+        self.conn.execute("DELETE FROM groups WHERE name = ? AND deleted <> 0", (group_name,))
+
+class ReuseSync:
+    """通过共享目录在多台机器之间增量同步历史
+
+    每台设备把本机变更日志按序号区间导出为 <sync_dir>/<device_id>/<起始序号>-<结束序号>.jsonl，
+    导入时只读取结束序号大于已导入进度的文件，因此同步耗时只与变更量有关。
+    同一实体的冲突按 (时间戳, 设备 ID) 后写者胜，各设备结果一致。
+    """
+    SEGMENT_RE = re.compile(r'^(\d+)-(\d+)\.jsonl$')
+
+    def __init__(self, db):
+        self.db = db
+
+    def enable(self, sync_dir):
+        """设置同步目录；首次开启时把现有数据作为快照写入变更日志"""
+        first_time = not self.db.sync_enabled and self.db.sync_seq == 0
+        self.db.set_setting('sync_dir', sync_dir)
+        if first_time:
+            self.snapshot()
+
+    def snapshot(self):
+        with self.db.conn:
+            for name in self.db.get_group_names():
+                self.db.log_change('group_add', 'group:' + name, {'name': name})
+            record_ids = [row[0] for row in self.db.conn.execute(
+                "SELECT r.id FROM records r JOIN groups g ON g.id = r.group_id "
+                "WHERE r.deleted = 0 AND g.deleted = 0 ORDER BY r.id")]
+            self.db.log_record_changes('record_put', record_ids)
+            for (clip_id,) in self.db.conn.execute(
+                    f"SELECT id FROM clips WHERE {live_clip_condition()} ORDER BY id").fetchall():
+                self.db.log_clip_changes('clip_put', [clip_id])
+
+    def sync(self):
+        """先导入其他设备的变更，再导出本机变更，返回 (导入条数, 导出条数)"""
+        if not self.db.sync_enabled:
+            return 0, 0
+        return self.import_changes(), self.export_changes()
+
+    def export_changes(self):
+        """把尚未导出的本机变更写成一个新的分段文件，然后清理本地日志"""
+        sync_dir = self.db.get_setting('sync_dir')
+        exported = self.db.conn.execute(
+            "SELECT exported_seq FROM sync_state WHERE device_id = ?", (self.db.device_id,)).fetchone()[0]
+        rows = self.db.conn.execute(
+            "SELECT seq, ts, op, entity, payload FROM change_log "
+            "WHERE device_id = ? AND seq > ? ORDER BY seq", (self.db.device_id, exported)).fetchall()
+        if not rows:
+            return 0
+
+        device_dir = os.path.join(sync_dir, self.db.device_id)
+        os.makedirs(device_dir, exist_ok=True)
+        path = os.path.join(device_dir, f"{rows[0][0]:012d}-{rows[-1][0]:012d}.jsonl")
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            for seq, ts, op, entity, payload in rows:
+                f.write(json.dumps({'seq': seq, 'ts': ts, 'op': op, 'entity': entity,
+                                    'payload': json.loads(payload)}, ensure_ascii=False) + '\n')
+        os.replace(path + '.tmp', path)  # 其他设备只会看到完整的文件
+
+        last_seq = rows[-1][0]
+        with self.db.conn:
+            self.db.conn.execute("UPDATE sync_state SET exported_seq = ? WHERE device_id = ?",
+                                 (last_seq, self.db.device_id))
+            self.db.conn.execute("DELETE FROM change_log WHERE device_id = ? AND seq <= ?",
+                                 (self.db.device_id, last_seq))
+        print(f"同步：导出 {len(rows)} 条变更")
+        return len(rows)
+
+    def import_changes(self):
+        """读取其他设备新增的分段文件并按序应用"""
+        sync_dir = self.db.get_setting('sync_dir')
+        if not os.path.isdir(sync_dir):
+            return 0
+
+        total = 0
+        for device in sorted(os.scandir(sync_dir), key=lambda entry: entry.name):
+            if not device.is_dir() or device.name == self.db.device_id:
+                continue
+            row = self.db.conn.execute("SELECT last_seq FROM sync_state WHERE device_id = ?",
+                                       (device.name,)).fetchone()
+            imported = row[0] if row else 0
+
+            segments = []
+            for entry in os.scandir(device.path):
+                match = self.SEGMENT_RE.match(entry.name)
+                if match and int(match.group(2)) > imported:
+                    segments.append((int(match.group(1)), entry.path))
+            if not segments:
+                continue
+
+            self.db.changed()
+            with self.db.conn:
+                for _, path in sorted(segments):
+                    with open(path, encoding='utf-8') as f:
+                        for line in f:
+                            change = json.loads(line)
+                            if change['seq'] <= imported:
+                                continue
+                            self.apply_change(device.name, change)
+                            imported = change['seq']
+                            total += 1
+                self.db.conn.execute("INSERT OR REPLACE INTO sync_state (device_id, last_seq) VALUES (?, ?)",
+                                     (device.name, imported))
+        if total:
+            print(f"同步：导入 {total} 条变更")
+        return total
+
+    def apply_change(self, device_id, change):
+        """应用一条远端变更；本地版本更新时跳过（后写者胜）"""
+        ts, entity = change['ts'], change['entity']
+        self.db.tick(ts)
+        row = self.db.conn.execute("SELECT ts, device_id FROM entity_versions WHERE entity = ?",
+                                   (entity,)).fetchone()
+        if row and tuple(row) >= (ts, device_id):
+            return False
+        handler = getattr(self, 'apply_' + change['op'], None)
+        if handler is None:
+            print(f"同步：忽略未知操作 {change['op']}")
+            return False
+        handler(change['payload'])
+        self.db.set_entity_version(entity, ts, device_id)
+        return True
+
+    def find_clip_ids(self, digest, norm_hash):
+        rows = self.db.conn.execute("SELECT id, content FROM clips WHERE norm_hash = ? OR norm_hash IS NULL",
+                                    (norm_hash,))
+        return [clip_id for clip_id, content in rows if content_digest(content) == digest]
+
+    def apply_clip_put(self, payload):
+        content = payload['content']
+        normalized = normalize_content(content)
+        digest, fingerprint = content_digest(normalized), simhash(normalized)
+        # 与本机采集相同的去重规则（完全相同 → 规范化后相同 → 近似重复），重复时把已有的行移到最新
+        clip_id = self.db.find_duplicate(content, normalized, digest, fingerprint)
+        if clip_id is not None:
+            self.db.move_clip_to_latest(clip_id)
+        else:
+            self.db.insert_clip(content, digest, fingerprint, vector=ngram_vector(normalized))
+
+    def apply_clip_delete(self, payload):
+        self.db.conn.executemany("DELETE FROM clips WHERE id = ?",
+                                 [(i,) for i in self.find_clip_ids(payload['digest'], payload['norm_hash'])])
+
+    def apply_clip_pin(self, payload):
+        self.db.conn.executemany("UPDATE clips SET pinned = ? WHERE id = ?",
+                                 [(int(payload['pinned']), i)
+                                  for i in self.find_clip_ids(payload['digest'], payload['norm_hash'])])
+
+    def apply_record_put(self, payload):
+        group_id = self.db.get_group_id(payload['group'], create=True)
+        # 旧版本的变更没有排序键，排到组末尾
+        sort_key = payload.get('sort_key') or self.db.sort_keys_at_end(group_id, 1)[0]
+        if len(sort_key) > SORT_KEY_MAX_LENGTH:
+            self.db.unbalanced_groups.add(group_id)
+        # 本机已软删除的记录被远端更新的修改复活（后写者胜）；先单独清除标记，触发器在原组中计数，再移动到新组
+        self.db.conn.execute("UPDATE records SET deleted = 0 WHERE uid = ? AND deleted <> 0", (payload['uid'],))
+        cursor = self.db.conn.execute("UPDATE records SET content = ?, group_id = ?, sort_key = ? WHERE uid = ?",
+                                      (payload['content'], group_id, sort_key, payload['uid']))
+        if cursor.rowcount == 0:
+            self.db.conn.execute("INSERT INTO records (group_id, content, uid, created, sort_key) "
+                                 "VALUES (?, ?, ?, ?, ?)",
+                                 (group_id, payload['content'], payload['uid'], int(time.time()), sort_key))
+
+    def apply_record_delete(self, payload):
+        self.db.conn.execute("DELETE FROM records WHERE uid = ?", (payload['uid'],))
+
+    def apply_group_add(self, payload):
+        self.db.get_group_id(payload['name'], create=True)
+
+    def apply_group_rename(self, payload):
+        old_id = self.db.get_group_id(payload['old'])
+        if old_id is None:
+            return
+        new_id = self.db.get_group_id(payload['new'])
+        if new_id is None:
+            self.db.conn.execute("UPDATE groups SET name = ? WHERE id = ?", (payload['new'], old_id))
+        else:
+            # 目标组在本机已存在：合并两个组
+            self.db.conn.execute("UPDATE records SET group_id = ? WHERE group_id = ?", (new_id, old_id))
+            self.db.conn.execute("DELETE FROM groups WHERE id = ?", (old_id,))
+
+    def apply_group_delete(self, payload):
+        self.db.conn.execute("DELETE FROM groups WHERE name = ?", (payload['name'],))
+
+class BackupCancelled(Exception):
+    pass
+
+class ReuseBackup:
+    """在线增量备份：后台线程用独立连接，按小批页复制，期间不阻塞采集和搜索
+
+    备份先写入临时文件，通过完整性检查后才改名为正式备份，并只保留最近若干份。
+    """
+    PAGES_PER_STEP = 64
+    STEP_PAUSE = 0.005  # 每批之间让出一点时间给写入方
+    FILE_PREFIX = 'reuse_history-'
+
+    def __init__(self, db, on_finished=None):
+        self.db = db
+        self.on_finished = on_finished  # 在后台线程中调用 on_finished(ok, message)
+        self.thread = None
+        self.cancel_event = threading.Event()
+
+    def backup_dir(self):
+        return self.db.get_setting('backup_dir') or os.path.join(
+            os.path.dirname(os.path.abspath(self.db.db_path)), 'backups')
+
+    def list_backups(self):
+        """按时间从新到旧列出已有备份"""
+        backup_dir = self.backup_dir()
+        if not os.path.isdir(backup_dir):
+            return []
+        names = [name for name in os.listdir(backup_dir)
+                 if name.startswith(self.FILE_PREFIX) and name.endswith('.db')]
+        return [os.path.join(backup_dir, name) for name in sorted(names, reverse=True)]
+
+    def is_due(self):
+        """距上次备份是否已超过设定的间隔"""
+        backups = self.list_backups()
+        if not backups:
+            return True
+        interval = self.db.get_setting('backup_interval_hours') * 3600
+        return time.time() - os.path.getmtime(backups[0]) >= interval
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        """在后台线程中开始一次备份，已有备份在进行时返回 False"""
+        if self.is_running():
+            return False
+        self.cancel_event.clear()
+        self.thread = threading.Thread(target=self.run, name='reuse-backup', daemon=True)
+        self.thread.start()
+        return True
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            path = self.backup_to(self.backup_dir())
+            self.rotate()
+            ok, message = True, path
+        except BackupCancelled:
+            ok, message = False, "备份已取消"
+        except (sqlite3.Error, OSError) as e:
+            ok, message = False, str(e)
+        print(f"备份{'完成' if ok else '失败'}: {message}")
+        if self.on_finished:
+            self.on_finished(ok, message)
+
+    def backup_to(self, backup_dir):
+        """执行备份并做完整性检查，返回备份文件路径"""
+        os.makedirs(backup_dir, exist_ok=True)
+        path = os.path.join(backup_dir, f"{self.FILE_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}.db")
+        tmp_path = path + '.tmp'
+        started = time.perf_counter()
+
+        def progress(status, remaining, total):
+            if self.cancel_event.is_set():
+                raise BackupCancelled()
+            time.sleep(self.STEP_PAUSE)
+
+        # 后台线程不能使用主连接，单独打开只读连接作为备份源
+        source = sqlite3.connect(f"file:{os.path.abspath(self.db.db_path)}?mode=ro", uri=True)
+        target = sqlite3.connect(tmp_path)
+        try:
+            # 在源连接上保持一个读事务：WAL 模式下备份始终读取同一快照，
+            # 其他连接的写入不会让备份从头重新开始，也不会被备份阻塞
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            source.backup(target, pages=self.PAGES_PER_STEP, progress=progress)
+            result = target.execute("PRAGMA integrity_check").fetchone()[0]
+            if result != 'ok':
+                raise sqlite3.DatabaseError(f"备份完整性检查失败: {result}")
+            # 备份文件改回普通日志模式，成为不带 -wal/-shm 的单个文件
+            target.execute("PRAGMA journal_mode = DELETE")
+        except BaseException:
+            target.close()
+            os.remove(tmp_path)
+            raise
+        finally:
+            source.close()
+        target.close()
+        os.replace(tmp_path, path)
+        print(f"备份耗时 {time.perf_counter() - started:.2f}s: {path}")
+        return path
+
+    def rotate(self):
+        """只保留最近 backup_keep 份备份"""
+        for path in self.list_backups()[max(self.db.get_setting('backup_keep'), 1):]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"删除旧备份失败: {e}")
+
+    def restore(self, backup_path):
+        """用备份覆盖当前数据库（在主线程中调用，直接写入主连接，无需替换文件）"""
+        source = sqlite3.connect(f"file:{os.path.abspath(backup_path)}?mode=ro", uri=True)
+        try:
+            result = source.execute("PRAGMA integrity_check").fetchone()[0]
+            if result != 'ok':
+                raise sqlite3.DatabaseError(f"备份文件已损坏: {result}")
+            self.db.conn.commit()
+            source.backup(self.db.conn)
+        finally:
+            source.close()
+        self.db.reload()
+
+class ReuseArchive:
+    """冷数据归档：旧的剪贴板内容按创建月份移入 archives/reuse_archive_YYYY-MM.db
+
+    主库只保留近期内容，采集和默认视图不受历史总量影响。移动由空闲维护分批完成：
+    每批先 ATTACH 对应月份的归档库并复制，再从主库删除，中途中断最多留下可重复执行的复制。
+    搜索归档只在用户要求时进行，各月份的归档库在线程池中用各自的只读连接并行查询。
+    """
+    FILE_PREFIX = 'reuse_archive_'
+    BATCH_SIZE = 500
+    MAX_SEARCH_WORKERS = 4
+
+    def __init__(self, db):
+        self.db = db
+
+    def archive_dir(self):
+        return self.db.get_setting('archive_dir') or os.path.join(
+            os.path.dirname(os.path.abspath(self.db.db_path)), 'archives')
+
+    def month_path(self, month):
+        return os.path.join(self.archive_dir(), f"{self.FILE_PREFIX}{month}.db")
+
+    def list_months(self):
+        """按时间从新到旧列出已有归档的月份（YYYY-MM）"""
+        archive_dir = self.archive_dir()
+        if not os.path.isdir(archive_dir):
+            return []
+        months = [name[len(self.FILE_PREFIX):-3] for name in os.listdir(archive_dir)
+                  if name.startswith(self.FILE_PREFIX) and name.endswith('.db')]
+        return sorted(months, reverse=True)
+
+    @staticmethod
+    def month_range(month):
+        """该月份覆盖的 [起, 止) 时间戳（本地时间）"""
+        year, mon = map(int, month.split('-'))
+        start = datetime(year, mon, 1)
+        end = datetime(year + mon // 12, mon % 12 + 1, 1)
+        return int(start.timestamp()), int(end.timestamp())
+
+    @staticmethod
+    def create_schema(conn, schema='main'):
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS {schema}.clips (
+                        id INTEGER PRIMARY KEY,
+                        source_id INTEGER NOT NULL,
+                        content TEXT NOT NULL,
+                        timestamp DATETIME,
+                        created INTEGER NOT NULL,
+                        norm_hash TEXT,
+                        kind TEXT,
+                        UNIQUE (source_id, created))''')
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_clips_created ON clips(created)")
+
+    def move_batch(self, conn, cutoff):
+        """把一批早于 cutoff 的非置顶内容移入归档库（conn 为自动提交模式的读写连接），返回本批的 ID 列表"""
+        rows = conn.execute(
+            "SELECT id, strftime('%Y-%m', created, 'unixepoch', 'localtime') FROM clips "
+            f"WHERE created < ? AND pinned = 0 AND {live_clip_condition()} ORDER BY created LIMIT ?",
+            (cutoff, self.BATCH_SIZE)).fetchall()
+        by_month = OrderedDict()
+        for clip_id, month in rows:
+            by_month.setdefault(month, []).append(clip_id)
+
+        os.makedirs(self.archive_dir(), exist_ok=True)
+        for month, ids in by_month.items():
+            placeholders = ','.join('?' * len(ids))
+            conn.execute("ATTACH DATABASE ? AS archive", (self.month_path(month),))
+            try:
+                self.create_schema(conn, 'archive')
+                conn.execute(
+                    "INSERT OR IGNORE INTO archive.clips (source_id, content, timestamp, created, norm_hash, kind) "
+                    f"SELECT id, content, timestamp, created, norm_hash, kind FROM main.clips WHERE id IN ({placeholders})",
+                    ids)
+            finally:
+                conn.execute("DETACH DATABASE archive")
+            # 归档库已提交后才删除，两步之间中断时下次会重新复制（被 UNIQUE 约束忽略）再删除
+            conn.execute(f"DELETE FROM main.clips WHERE id IN ({placeholders}) AND pinned = 0 "
+                         f"AND {live_clip_condition()}", ids)
+        return [clip_id for clip_id, _ in rows]
+
+    def search(self, keyword, limit=100):
+        """按查询语法搜索归档，返回 [(月份, (id, content, timestamp, pinned)), ...]，从新到旧排列
+
+        after:/before: 条件先按文件名排除不相关的月份，其余月份并行查询后按月份顺序合并。
+        """
+        query = SearchQuery(keyword)
+        months = []
+        for month in self.list_months():
+            start, end = self.month_range(month)
+            if query.before is not None and start >= query.before:
+                continue
+            if query.after is not None and end <= query.after:
+                continue
+            months.append(month)
+        if not months:
+            return []
+
+        clauses, params = query.conditions('content', 'created', 'kind')
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+        sql = f"SELECT source_id, content, timestamp, 0 FROM clips {where}ORDER BY created DESC LIMIT ?"
+        workers = min(len(months), self.MAX_SEARCH_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reuse-archive') as executor:
+            results = list(executor.map(lambda month: self.search_month(month, sql, params + [limit]), months))
+
+        merged = []
+        for month, rows in zip(months, results):
+            merged.extend((month, row) for row in rows[:limit - len(merged)])
+            if len(merged) >= limit:
+                break
+        return merged
+
+    def search_month(self, month, sql, params):
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.month_path(month))}?mode=ro", uri=True)
+        conn.create_function('REGEXP', 2, sqlite_regexp, deterministic=True)
+        try:
+            return conn.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            print(f"搜索归档 {month} 出错: {e}")
+            return []
+        finally:
+            conn.close()
+
+class MaintenancePaused(Exception):
+    pass
+
+class ReuseMaintenance:
+    """空闲时的数据库维护：ANALYZE、PRAGMA optimize、增量 VACUUM、完整性检查
+
+    各项任务按小步在后台线程中执行，每一步都是独立的短事务；有采集或搜索时调用 pause()，
+    正在执行的语句立即中断回滚，下次空闲时从中断的任务继续。
+    唯一的例外是首次切换增量 VACUUM 模式：它需要一次完整 VACUUM，无法分步，被中断后只能从头再来，
+    因此只在数据库较小时执行。
+    """
+    VACUUM_PAGES_PER_STEP = 256
+    FULL_VACUUM_MAX_BYTES = 64 * 1024 * 1024  # 超过该大小不做完整 VACUUM，保持原有模式
+    STEP_PAUSE = 0.01
+
+    def __init__(self, db, archive=None, on_finished=None, on_archived=None):
+        self.db = db
+        self.archive = archive
+        self.on_finished = on_finished  # 在后台线程中调用 on_finished(completed, message)
+        self.on_archived = on_archived  # 每批归档提交后在后台线程中调用 on_archived(clip_ids)
+        self.archived = 0  # 本次（含被打断的部分）移入归档的行数，由主线程读取后清零
+        self.thread = None
+        self.conn = None
+        self.pause_event = threading.Event()
+        self.next_task = 0  # 被打断时记下进度，下次从这里继续
+        self.stats = None
+
+    def tasks(self):
+        return [
+            ('归档旧内容', self.archive_old_clips),
+            ('增量 VACUUM 模式', self.enable_incremental_vacuum),
+            ('ANALYZE', self.analyze),
+            ('PRAGMA optimize', lambda conn: conn.execute("PRAGMA optimize")),
+            ('增量 VACUUM', self.incremental_vacuum),
+            ('WAL 检查点', lambda conn: conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()),
+            ('完整性检查', self.integrity_check),
+        ]
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        if self.is_running():
+            return False
+        self.pause_event.clear()
+        self.thread = threading.Thread(target=self.run, name='reuse-maintenance', daemon=True)
+        self.thread.start()
+        return True
+
+    def pause(self):
+        """有用户活动时调用（主线程）：中断正在执行的语句"""
+        if not self.is_running():
+            return
+        self.pause_event.set()
+        conn = self.conn
+        if conn is not None:
+            try:
+                conn.interrupt()
+            except sqlite3.ProgrammingError:
+                pass  # 连接刚好已关闭
+
+    def file_size(self):
+        path = os.path.abspath(self.db.db_path)
+        return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+    def run(self):
+        if self.next_task == 0:
+            self.stats = {'started': time.perf_counter(), 'size_before': self.file_size(), 'problems': []}
+        tasks = self.tasks()
+        # 独立的读写连接；忙等待时间很短，遇到主连接写入时宁可推迟到下次
+        conn = sqlite3.connect(os.path.abspath(self.db.db_path), timeout=1, isolation_level=None)
+        self.conn = conn
+        try:
+            while self.next_task < len(tasks):
+                if self.pause_event.is_set():
+                    raise MaintenancePaused()
+                name, task = tasks[self.next_task]
+                started = time.perf_counter()
+                task(conn)
+                print(f"数据库维护 - {name}: {time.perf_counter() - started:.2f}s")
+                self.next_task += 1
+            completed, message = True, self.summary()
+            self.next_task = 0
+        except (MaintenancePaused, sqlite3.OperationalError) as e:
+            if not self.pause_event.is_set() and not isinstance(e, MaintenancePaused):
+                print(f"数据库维护步骤失败，稍后重试: {e}")
+            completed, message = False, f"数据库维护已暂停（{tasks[self.next_task][0]}）"
+        except sqlite3.Error as e:
+            completed, message = False, f"数据库维护失败: {e}"
+            self.next_task = 0
+        finally:
+            self.conn = None
+            conn.close()
+        print(message)
+        if self.on_finished:
+            self.on_finished(completed, message)
+
+    def summary(self):
+        stats = self.stats
+        reclaimed = stats['size_before'] - self.file_size()
+        message = (f"数据库维护完成: 耗时 {time.perf_counter() - stats['started']:.1f}s，"
+                   f"回收空间 {max(reclaimed, 0) / 1024:.0f} KB")
+        if self.archived:
+            message += f"，归档 {self.archived} 条"
+        if stats['problems']:
+            message += f"，完整性检查发现问题: {'; '.join(stats['problems'][:3])}"
+        return message
+
+    def archive_old_clips(self, conn):
+        """按批把超过设定天数的剪贴板内容移入归档库，每批之间可以暂停"""
+        days = self.db.get_setting('archive_after_days')
+        if self.archive is None or days <= 0:
+            return
+        conn.execute("PRAGMA foreign_keys = ON")  # 删除时级联清理指纹索引
+        cutoff = int(time.time()) - days * 86400
+        while True:
+            if self.pause_event.is_set():
+                raise MaintenancePaused()
+            moved = self.archive.move_batch(conn, cutoff)
+            if not moved:
+                return
+            self.archived += len(moved)
+            if self.on_archived:
+                self.on_archived(moved)  # 主库已删除这批行，查询缓存需要立即失效，不能等整轮维护结束
+            time.sleep(self.STEP_PAUSE)
+
+    def enable_incremental_vacuum(self, conn):
+        """auto_vacuum 默认关闭，切换为增量模式需要做一次完整 VACUUM
+
+        完整 VACUUM 是单条语句，耗时与数据库大小成正比；中断后已完成的部分全部作废，
+        大数据库在空闲期内可能永远做不完，所以超过 FULL_VACUUM_MAX_BYTES 时跳过，以后也只做其余维护。
+        """
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return
+        size = self.file_size()
+        if size > self.FULL_VACUUM_MAX_BYTES:
+            print(f"数据库较大（{size / 1024 / 1024:.0f} MB），跳过切换增量 VACUUM 模式")
+            return
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+    def analyze(self, conn):
+        """逐个表 ANALYZE，每张表是一个可中断的小步骤"""
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        for table in tables:
+            if self.pause_event.is_set():
+                raise MaintenancePaused()
+            conn.execute(f'ANALYZE "{table}"')
+            time.sleep(self.STEP_PAUSE)
+
+    def incremental_vacuum(self, conn):
+        """每次只释放少量空闲页，避免长时间占用写锁（未切换为增量模式时该 PRAGMA 不起作用，直接跳过）"""
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return
+        while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+            if self.pause_event.is_set():
+                raise MaintenancePaused()
+            conn.execute(f"PRAGMA incremental_vacuum({self.VACUUM_PAGES_PER_STEP})").fetchall()
+            time.sleep(self.STEP_PAUSE)
+
+    def integrity_check(self, conn):
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+        if problems != ['ok']:
+            self.stats['problems'] = problems
+            print(f"完整性检查发现问题: {problems[:10]}")
+
+class ReusePurger:
+    """后台清理：删除批次超过可撤销时间后，分批彻底删除被标记的行（指纹索引随外键级联删除，向量在行内）
+
+    被标记的行对所有查询都已不可见，清理不改变查询结果；只有清空历史的批次清理完后通知主线程，
+    把水位线以下的向量从相似内容索引中去掉（可撤销期间它们仍留在索引中）。
+    与空闲维护一样使用独立的读写连接，每批是一个很短的事务，遇到主连接正在写入时推迟到下一轮。
+    """
+    BATCH_SIZE = 500
+    GRACE_SECONDS = 60   # 在可撤销时间之外再多等一会儿，不与正在进行的撤销冲突
+    CHECK_INTERVAL = 60  # 秒
+    STEP_PAUSE = 0.01
+    # 每条语句删除某个批次的至多 BATCH_SIZE 行；已删除的组先分批删掉组内记录，再删除组本身。
+    # deleted <> 0 与部分索引的条件相同，按批次查找时走索引而不是扫描整表
+    PURGE_STEPS = [
+        "DELETE FROM clips WHERE id IN (SELECT id FROM clips WHERE deleted = ? AND deleted <> 0 LIMIT ?)",
+        "DELETE FROM records WHERE id IN (SELECT id FROM records WHERE deleted = ? AND deleted <> 0 LIMIT ?)",
+        "DELETE FROM records WHERE id IN (SELECT r.id FROM records r JOIN groups g ON g.id = r.group_id "
+        "WHERE g.deleted = ? LIMIT ?)",
+        "DELETE FROM groups WHERE id IN (SELECT id FROM groups WHERE deleted = ? LIMIT ?)",
+    ]
+    # 清空历史的批次：删除水位线以下未被其他批次标记的行
+    CLEAR_STEP = "DELETE FROM clips WHERE id IN (SELECT id FROM clips WHERE id <= ? AND deleted = 0 LIMIT ?)"
+
+    def __init__(self, db, on_cleared=None):
+        self.db = db
+        self.on_cleared = on_cleared  # 在清理线程中调用 on_cleared(水位线)
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='reuse-purger', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+
+    def run(self):
+        conn = sqlite3.connect(os.path.abspath(self.db.db_path), timeout=1, isolation_level=None)
+        conn.execute("PRAGMA foreign_keys = ON")
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self.purge(conn)
+                except sqlite3.OperationalError as e:
+                    print(f"后台清理推迟到下一轮: {e}")
+                self.wake_event.wait(self.CHECK_INTERVAL)
+                self.wake_event.clear()
+        finally:
+            conn.close()
+
+    def purge(self, conn):
+        """清理所有已过可撤销时间的删除批次"""
+        cutoff = int(time.time()) - self.db.get_setting('undo_minutes') * 60 - self.GRACE_SECONDS
+        for deletion, clear_upto in conn.execute("SELECT id, clear_upto FROM deletions WHERE created < ? ORDER BY id",
+                                                 (cutoff,)).fetchall():
+            started, count = time.perf_counter(), 0
+            steps = [(sql, deletion) for sql in self.PURGE_STEPS]
+            if clear_upto:
+                steps.append((self.CLEAR_STEP, clear_upto))
+            for sql, key in steps:
+                while True:
+                    if self.stop_event.is_set():
+                        return
+                    removed = conn.execute(sql, (key, self.BATCH_SIZE)).rowcount
+                    count += removed
+                    if removed < self.BATCH_SIZE:
+                        break
+                    time.sleep(self.STEP_PAUSE)
+            conn.execute("DELETE FROM deletions WHERE id = ?", (deletion,))
+            if clear_upto and self.on_cleared:
+                self.on_cleared(clear_upto)
+            print(f"后台清理: 删除批次 {deletion} 共 {count} 行，耗时 {time.perf_counter() - started:.2f}s")
+
+@lru_cache(maxsize=None)
+def sqlite_library():
+    """通过 ctypes 加载 sqlite3 模块所用的 SQLite 库，用于读取内存统计；找不到时返回 None"""
+    import _sqlite3
+    module_dir = os.path.dirname(_sqlite3.__file__)
+    for path in (os.path.join(module_dir, 'sqlite3.dll'), _sqlite3.__file__):
+        if not os.path.exists(path):
+            continue
+        try:
+            lib = ctypes.CDLL(path)
+            lib.sqlite3_memory_used.restype = ctypes.c_int64
+            lib.sqlite3_memory_highwater.restype = ctypes.c_int64
+            lib.sqlite3_memory_highwater.argtypes = [ctypes.c_int]
+            return lib
+        except (OSError, AttributeError):
+            continue
+    return None
+
+class ReuseMemoryMonitor:
+    """内存统计：各子系统登记自己的字节计数，可选用 tracemalloc 跟踪 Python 分配
+
+    不开启跟踪时只在生成报告时读取各计数，平时没有额外开销。
+    """
+    TOP_LINES = 10
+
+    def __init__(self, snapshot_dir):
+        self.snapshot_dir = snapshot_dir
+        self.providers = OrderedDict()  # 名称 -> 返回 (字节数, 说明) 的函数
+        self.last_snapshot = None
+
+    def register(self, name, provider):
+        self.providers[name] = provider
+
+    def is_tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start_tracing(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            print("已开始跟踪内存分配")
+
+    def stop_tracing(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self.last_snapshot = None
+            print("已停止跟踪内存分配")
+
+    def breakdown(self):
+        """[(名称, 字节数, 说明), ...]"""
+        rows = []
+        for name, provider in self.providers.items():
+            try:
+                size, detail = provider()
+            except Exception as e:
+                size, detail = 0, f"统计失败: {e}"
+            rows.append((name, size, detail))
+        lib = sqlite_library()
+        if lib is not None:
+            rows.append(("SQLite（全部连接）", lib.sqlite3_memory_used(),
+                         f"峰值 {lib.sqlite3_memory_highwater(0) / 1024:.0f} KB"))
+        return rows
+
+    def report(self):
+        lines = [f"{name}: {size / 1024:.0f} KB（{detail}）" for name, size, detail in self.breakdown()]
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            lines.append(f"Python 分配（tracemalloc）: 当前 {current / 1024:.0f} KB，峰值 {peak / 1024:.0f} KB")
+            stats = tracemalloc.take_snapshot().filter_traces(self.snapshot_filters()).statistics('lineno')
+            lines.append("分配最多的代码行:")
+            lines.extend(f"  {stat}" for stat in stats[:self.TOP_LINES])
+        else:
+            lines.append("未开启 tracemalloc 跟踪，Python 分配明细不可用")
+        return "\n".join(lines)
+
+    @staticmethod
+    def snapshot_filters():
+        return [tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+
+    def save_snapshot(self):
+        """把当前 tracemalloc 快照写入磁盘，返回 (文件路径, 与上一份快照的差异行)"""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("需要先开启内存分配跟踪")
+        snapshot = tracemalloc.take_snapshot().filter_traces(self.snapshot_filters())
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        path = os.path.join(self.snapshot_dir, f"memory-{datetime.now().strftime('%Y%m%d-%H%M%S')}.snapshot")
+        snapshot.dump(path)
+        diff = []
+        if self.last_snapshot is not None:
+            diff = [str(stat) for stat in snapshot.compare_to(self.last_snapshot, 'lineno')[:self.TOP_LINES]]
+        self.last_snapshot = snapshot
+        return path, diff
+
+class ReuseProfiler:
+    """托盘菜单开启的性能分析
+
+    - 采样：后台线程定时读取所有线程的调用栈（GUI、快捷键监听、备份/分类/维护等），
+      写成 flamegraph 工具可用的 collapsed 格式；
+    - cProfile：对 GUI 线程做精确的函数级统计，写成 pstats 文件。
+    未开启时不安装任何钩子，没有开销。并行扫描的工作进程不在统计范围内。
+    """
+    SAMPLE_INTERVAL = 0.005
+    TOP_N = 15
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.profile = None
+        self.sampler = None
+        self.stop_event = threading.Event()
+        self.stacks = Counter()
+        self.sample_count = 0
+        self.started = None
+
+    def is_running(self):
+        return self.profile is not None
+
+    def start(self):
+        """在 GUI 线程中调用"""
+        if self.is_running():
+            return
+        self.stacks = Counter()
+        self.sample_count = 0
+        self.stop_event.clear()
+        self.started = time.perf_counter()
+        self.sampler = threading.Thread(target=self.sample_loop, name='reuse-profiler', daemon=True)
+        self.sampler.start()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        print("性能分析已开始")
+
+    def sample_loop(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.SAMPLE_INTERVAL):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def stop(self):
+        """停止并写出结果，返回 (文件列表, 摘要文字)"""
+        if not self.is_running():
+            return [], ""
+        self.profile.disable()
+        profile, self.profile = self.profile, None
+        self.stop_event.set()
+        self.sampler.join()
+        duration = time.perf_counter() - self.started
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+        profile.dump_stats(prefix + '.pstats')
+        with open(prefix + '.collapsed', 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"性能分析已停止，结果写入 {prefix}.*")
+        return [prefix + '.pstats', prefix + '.collapsed'], self.summary(profile, duration)
+
+    def summary(self, profile, duration):
+        lines = [f"时长 {duration:.1f}s，采样 {self.sample_count} 次（每 {self.SAMPLE_INTERVAL * 1000:.0f}ms）"]
+        # 采样：按线程和栈顶函数统计
+        by_thread, self_samples = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            by_thread[frames[0]] += count
+            self_samples[f"[{frames[0]}] {frames[-1]}"] += count
+        lines.append("各线程采样数: " + "，".join(f"{name} {count}" for name, count in by_thread.most_common()))
+        lines.append(f"栈顶函数（采样，前 {self.TOP_N}）:")
+        lines.extend(f"  {count:>6}  {name}" for name, count in self_samples.most_common(self.TOP_N))
+        # cProfile：GUI 线程累计耗时
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(self.TOP_N)
+        lines.append(f"GUI 线程累计耗时（cProfile，前 {self.TOP_N}）:")
+        lines.extend("  " + line for line in stream.getvalue().splitlines()
+                     if line.strip() and not line.lstrip().startswith(('Ordered by', 'List reduced')))
+        return "\n".join(lines)
+
+class ReuseClassifier:
+    """后台内容分类：新采集的内容优先，旧数据按批回填
+
+    工作线程用只读连接读取未分类的行并分类，结果通过 on_classified 交给主线程写入，
+    数据库始终只有主连接一个写入者，查询缓存也能准确失效。
+    """
+    BATCH_SIZE = 200
+    IDLE_RECHECK = 60  # 秒；同步、恢复等途径新增的行由定期检查补上
+
+    def __init__(self, db, on_classified):
+        self.db = db
+        self.on_classified = on_classified  # 在工作线程中调用 on_classified([(clip_id, kind), ...])
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='reuse-classifier', daemon=True)
+        self.thread.start()
+        self.wake()
+
+    def wake(self):
+        """有新内容需要分类时调用"""
+        self.wake_event.set()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+
+    def run(self):
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.db.db_path)}?mode=ro", uri=True)
+        try:
+            while not self.stop_event.is_set():
+                self.wake_event.wait(self.IDLE_RECHECK)
+                self.wake_event.clear()
+                self.sweep(conn)
+        except sqlite3.Error as e:
+            print(f"内容分类线程出错: {e}")
+        finally:
+            conn.close()
+
+    def sweep(self, conn):
+        """从最新的行开始，按批处理所有未分类的行"""
+        cursor = None
+        while not self.stop_event.is_set():
+            if cursor is None:
+                rows = conn.execute("SELECT id, content FROM clips WHERE kind IS NULL "
+                                    "ORDER BY id DESC LIMIT ?", (self.BATCH_SIZE,)).fetchall()
+            else:
+                rows = conn.execute("SELECT id, content FROM clips WHERE kind IS NULL AND id < ? "
+                                    "ORDER BY id DESC LIMIT ?", (cursor, self.BATCH_SIZE)).fetchall()
+            if not rows:
+                return
+            self.on_classified([(clip_id, classify_content(content)) for clip_id, content in rows])
+            cursor = rows[-1][0]
+            if self.wake_event.is_set():
+                return  # 有新采集的内容，重新从最新的行开始
+
+class ReuseVectorIndexer:
+    """后台加载相似内容索引：先读出已有的向量，再为旧记录按批计算缺少的向量
+
+    与内容分类相同，工作线程只用只读连接，结果通过 on_vectors 交给主线程加入索引并写回。
+    新采集的内容在插入时直接计算，不经过这里。
+    """
+    BATCH_SIZE = 2000
+    BACKFILL_BATCH_SIZE = 200
+
+    def __init__(self, db, on_vectors):
+        self.db = db
+        self.on_vectors = on_vectors  # 在工作线程中调用 on_vectors(索引代数, [(clip_id, 向量), ...], 是否新计算)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """开始（或在数据库被整体替换后重新开始）加载"""
+        self.stop()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(self.db.vector_index.generation, self.stop_event),
+                                       name='reuse-vector-indexer', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self, generation, stop_event):
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.db.db_path)}?mode=ro", uri=True)
+        try:
+            start = time.perf_counter()
+            loaded = self.load(conn, generation, stop_event)
+            print(f"相似内容索引已加载 {loaded} 条，用时 {time.perf_counter() - start:.2f} 秒")
+            self.backfill(conn, generation, stop_event)
+        except sqlite3.Error as e:
+            print(f"相似内容索引线程出错: {e}")
+        finally:
+            conn.close()
+
+    def load(self, conn, generation, stop_event):
+        count, cursor = 0, 0
+        while not stop_event.is_set():
+            rows = conn.execute("SELECT id, ngram FROM clips WHERE id > ? AND ngram IS NOT NULL "
+                                "ORDER BY id LIMIT ?", (cursor, self.BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            self.on_vectors(generation, rows, False)
+            count += len(rows)
+            cursor = rows[-1][0]
+        return count
+
+    def backfill(self, conn, generation, stop_event):
+        """从最新的行开始，为没有向量的旧记录计算向量（过短的内容写入空串，不再重复计算）"""
+        cursor = None
+        while not stop_event.is_set():
+            if cursor is None:
+                rows = conn.execute("SELECT id, content FROM clips WHERE ngram IS NULL "
+                                    "ORDER BY id DESC LIMIT ?", (self.BACKFILL_BATCH_SIZE,)).fetchall()
+            else:
+                rows = conn.execute("SELECT id, content FROM clips WHERE ngram IS NULL AND id < ? "
+                                    "ORDER BY id DESC LIMIT ?", (cursor, self.BACKFILL_BATCH_SIZE)).fetchall()
+            if not rows:
+                return
+            self.on_vectors(generation, [(clip_id, ngram_vector(normalize_content(content)) or b'')
+                                         for clip_id, content in rows], True)
+            cursor = rows[-1][0]
+
+class ReuseFingerprinter:
+    """后台回填旧记录的规范化摘要和 SimHash 指纹（从旧版本升级后只需执行一次）
+
+    与内容分类相同，工作线程只用只读连接，结果通过 on_fingerprints 交给主线程写入。
+    回填完成前，缺少指纹的行只参与完全相同的去重判断。
+    """
+    BATCH_SIZE = 500
+
+    def __init__(self, db, on_fingerprints):
+        self.db = db
+        self.on_fingerprints = on_fingerprints  # 在工作线程中调用 on_fingerprints([(clip_id, 摘要, 指纹), ...])
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """开始（或在数据库被整体替换后重新开始）回填"""
+        self.stop()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(self.stop_event,),
+                                       name='reuse-fingerprinter', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self, stop_event):
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.db.db_path)}?mode=ro", uri=True)
+        try:
+            start, count, cursor = time.perf_counter(), 0, None
+            while not stop_event.is_set():
+                # norm_hash 为 NULL 的行直接从 idx_clips_norm_hash 中找到，从最新的行开始
+                if cursor is None:
+                    rows = conn.execute("SELECT id, content FROM clips WHERE norm_hash IS NULL "
+                                        "ORDER BY id DESC LIMIT ?", (self.BATCH_SIZE,)).fetchall()
+                else:
+                    rows = conn.execute("SELECT id, content FROM clips WHERE norm_hash IS NULL AND id < ? "
+                                        "ORDER BY id DESC LIMIT ?", (cursor, self.BATCH_SIZE)).fetchall()
+                if not rows:
+                    break
+                batch = []
+                for clip_id, content in rows:
+                    normalized = normalize_content(content)
+                    batch.append((clip_id, content_digest(normalized), simhash(normalized)))
+                self.on_fingerprints(batch)
+                count += len(rows)
+                cursor = rows[-1][0]
+            if count:
+                print(f"已回填 {count} 条记录的指纹，用时 {time.perf_counter() - start:.2f} 秒")
+        except sqlite3.Error as e:
+            print(f"指纹回填线程出错: {e}")
+        finally:
+            conn.close()
+
+# ---- 并行扫描：以下函数在工作进程中运行 ----
+_scan_state = {}
+
+def _scan_worker_init(db_path, current_generation):
+    _scan_state['db_path'] = db_path
+    _scan_state['generation'] = current_generation  # 共享内存中的当前扫描代数
+
+def _scan_partition(generation, query, pinned, lo, hi, limit):
+    """在 [lo, hi] 区间内按查询条件扫描，返回按 ID 从新到旧排列的结果；扫描代数变化时中止"""
+    current = _scan_state['generation']
+    if current.value != generation:
+        return None
+    conn = _scan_state.get('conn')
+    if conn is None:
+        conn = sqlite3.connect(f"file:{_scan_state['db_path']}?mode=ro", uri=True)
+        conn.create_function('REGEXP', 2, sqlite_regexp, deterministic=True)
+        _scan_state['conn'] = conn
+    # 每执行若干条虚拟机指令检查一次是否已取消，返回非零值会中断查询
+    conn.set_progress_handler(lambda: current.value != generation, 20000)
+    clauses, params = query.conditions('content', 'created', 'kind')
+    where = ''.join(f" AND {clause}" for clause in clauses)
+    try:
+        return conn.execute(
+            "SELECT id, content, timestamp, pinned FROM clips "
+            f"WHERE pinned = ? AND id BETWEEN ? AND ? AND {live_clip_condition()}{where} ORDER BY id DESC LIMIT ?",
+            [pinned, lo, hi] + params + [limit]).fetchall()
+    except sqlite3.OperationalError:
+        if current.value != generation:
+            return None  # 已取消
+        raise
+
+class ReuseScanEngine:
+    """超大历史的并行扫描：把剪贴板 ID 区间切分给进程池，按排序先后流式返回结果
 
-    def update_clip_as_latest(self, clip_id):
-        """将指定ID的内容更新为最新记录（删除后重新插入）"""
-        cursor = self.conn.execute("SELECT content FROM clips WHERE id = ?", (clip_id,))
-        result = cursor.fetchone()
-        if not result:
-            return False
+    排序与普通搜索一致（置顶在前，其余按 ID 从新到旧）：置顶行单独作为第一个分区，
+    其余分区按 ID 从大到小排列，只有更靠前的分区都完成后才交出结果，因此结果顺序确定，
+    而最新的分区通常最先完成，首批结果几乎立即出现。查询变化时调用 cancel() 即可中止。
+    """
+    PARTITIONS_PER_WORKER = 4
 
-        content = result[0]
-        self.conn.execute("DELETE FROM clips WHERE id = ?", (clip_id,))
-        self.conn.execute("INSERT INTO clips (content) VALUES (?)", (content,))
-        self.conn.commit()
-        return True
-    def add_record(self, content, group="默认"):
-        """添加一条记录"""
-        self.conn.execute("INSERT INTO records (group_name, content) VALUES (?, ?)", (group, content))
-        self.conn.commit()
+    def __init__(self, db, on_rows, on_finished, workers=None):
+        self.db = db
+        self.on_rows = on_rows            # 在回调线程中调用 on_rows(generation, rows)
+        self.on_finished = on_finished    # 在回调线程中调用 on_finished(generation)
+        self.workers = workers or os.cpu_count() or 2
+        self.executor = None
+        self.shared_generation = None
+        self.generation = 0
+        self.state = None
+        self.lock = threading.RLock()  # future.cancel() 会在当前线程中同步调用完成回调
 
-    def get_records(self, group=None, keyword=""):
-        query = "SELECT id, group_name, content FROM records WHERE content LIKE ?"
-        params = ['%' + keyword + '%']
-        if group:
-            query += " AND group_name=?"
-            params.append(group)
-        cursor = self.conn.execute(query, params)
-        return cursor.fetchall()
+    def ensure_pool(self):
+        if self.executor is None:
+            context = multiprocessing.get_context('spawn')
+            self.shared_generation = context.RawValue('i', 0)
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=context,
+                initializer=_scan_worker_init,
+                initargs=(os.path.abspath(self.db.db_path), self.shared_generation))
 
-    def delete_record(self, record_id):
-        """删除指定记录"""
-        self.conn.execute("DELETE FROM records WHERE id=?", (record_id,))
-        self.conn.commit()
+    def partitions(self):
+        lo, hi = self.db.clip_id_range()
+        if lo is None:
+            return []
+        parts = [(1, lo, hi)]  # 置顶行
+        count = self.workers * self.PARTITIONS_PER_WORKER
+        size = max((hi - lo + 1 + count - 1) // count, 1)
+        upper = hi
+        while upper >= lo:
+            parts.append((0, max(upper - size + 1, lo), upper))
+            upper -= size
+        return parts
 
-    def update_record(self, record_id, new_content, new_group="默认"):
-        """修改记录内容与组"""
-        self.conn.execute("UPDATE records SET content=?, group_name=? WHERE id=?", (new_content, new_group, record_id))
-        self.conn.commit()
-    def add_group(self, group_name):
-        """新建一个组"""
-        try:
-            self.conn.execute("INSERT INTO groups (name) VALUES (?)", (group_name,))
-            self.conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            return False  # 组名已存在
+    def start(self, query, limit):
+        """开始一次新的扫描（自动取消上一次），返回本次扫描代数"""
+        self.ensure_pool()
+        self.cancel()
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+            self.shared_generation.value = generation
+            parts = self.partitions()
+            self.state = {'generation': generation, 'results': {}, 'next': 0,
+                          'count': len(parts), 'remaining': limit, 'futures': []}
+            state = self.state
+        if not parts:
+            self.on_finished(generation)
+            return generation
+        for index, (pinned, lo, hi) in enumerate(parts):
+            future = self.executor.submit(_scan_partition, generation, query, pinned, lo, hi, limit)
+            state['futures'].append(future)
+            future.add_done_callback(lambda f, index=index: self.partition_done(state, index, f))
+        return generation
 
-    def delete_group(self, group_name):
-        """删除一个组及其所有记录"""
-        self.conn.execute("DELETE FROM records WHERE group_name = ?", (group_name,))
-        self.conn.execute("DELETE FROM groups WHERE name = ?", (group_name,))
-        self.conn.commit()
+    def partition_done(self, state, index, future):
+        with self.lock:
+            if state is not self.state:
+                return  # 已被新的扫描取代
+            try:
+                rows = None if future.cancelled() else future.result()
+            except Exception as e:
+                print(f"并行扫描分区出错: {e}")
+                rows = []
+            state['results'][index] = rows or []
+            # 按顺序交出已完成的连续分区
+            while state['next'] in state['results'] and state['remaining'] > 0:
+                rows = state['results'].pop(state['next'])[:state['remaining']]
+                state['next'] += 1
+                state['remaining'] -= len(rows)
+                if rows:
+                    self.on_rows(state['generation'], rows)
+            if state['remaining'] <= 0 or state['next'] >= state['count']:
+                self.finish_locked(state)
+
+    def finish_locked(self, state):
+        self.state = None
+        self.shared_generation.value = -state['generation']  # 让仍在运行的分区尽快中止
+        for future in state['futures']:
+            future.cancel()
+        self.on_finished(state['generation'])
+
+    def cancel(self):
+        with self.lock:
+            state, self.state = self.state, None
+            if state:
+                for future in state['futures']:
+                    future.cancel()
+            if self.shared_generation is not None:
+                self.shared_generation.value = 0
+
+    def shutdown(self):
+        self.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
 
 class ReuseHistoryWindow(QWidget):
     """剪贴板历史记录主窗口 - 使用悬浮窗预览"""
+    REBALANCE_DELAY_MS = 30 * 1000  # 排序键过长时，延迟一段时间再重排，不影响拖动操作
+    SIMILAR_LIMIT = 20              # “相似内容”最多列出的条数
+
     def __init__(self, db):
         super().__init__()
         self.current_mode = 'clip'
         self.db = db
+        self.sync = ReuseSync(db)
+        self.archive = ReuseArchive(db)
         self.current_limit = 200  # 默认记录数
         self.current_preview_row = -1  # 当前预览的行
+        self.displayed_rows = None  # 当前表格展示的查询结果（来自查询缓存，相同结果无需重建表格）
+        self.clipboard_writer = None  # 由 ReuseManager 设置，用于抑制自身写入触发的采集
+
+        # 超大历史的并行扫描，结果通过信号回到主线程逐批追加
+        self.scan_signals = WorkerSignals()
+        self.scan_signals.scan_rows.connect(self.append_scan_rows)
+        self.scan_signals.scan_finished.connect(self.finish_scan)
+        self.scan_engine = ReuseScanEngine(db, on_rows=self.scan_signals.scan_rows.emit,
+                                           on_finished=self.scan_signals.scan_finished.emit,
+                                           workers=db.get_setting('scan_workers'))
+        self.scan_generation = None
+        self.scan_rows = []
+        # 搜索归档在后台线程中进行，只显示最后一次搜索的结果
+        self.scan_signals.archive_results.connect(self.show_archive_results)
+        self.archive_search_id = 0
+
+        # 记录排序键的重排（很少需要）推迟执行
+        self.rebalance_timer = QTimer(self)
+        self.rebalance_timer.setSingleShot(True)
+        self.rebalance_timer.timeout.connect(self.db.rebalance_sort_keys)
         self.preview_dialog = None  # 预览悬浮窗
         self.hide_timer = QTimer(self)  # 用于延迟隐藏预览框
         self.hide_timer.setSingleShot(True)
@@ -237,6 +2964,10 @@ class ReuseHistoryWindow(QWidget):
         self.shortcut_esc = QShortcut(QKeySequence("Esc"), self)
         self.shortcut_esc.activated.connect(self.close_window)
 
+        # Ctrl+Z 撤销最近一次删除（搜索框有可撤销的输入时先撤销输入，见 eventFilter）
+        self.shortcut_undo = QShortcut(QKeySequence.Undo, self)
+        self.shortcut_undo.activated.connect(lambda: self.undo_delete())
+
         self.init_ui()
         self.switch_mode('clip')
         self.refresh_clips()
@@ -258,16 +2989,24 @@ class ReuseHistoryWindow(QWidget):
 
         # 创建搜索区域
         self.search_box = QLineEdit()
-        self.search_box.setPlaceholderText("搜索剪贴板历史...")
+        self.search_box.setPlaceholderText("搜索… 支持 group:组 after:2026-09-01 len>500 /正则/ -排除")
         self.search_box.textChanged.connect(self.search_clips)
         self.search_box.setFixedWidth(300)
+        self.search_box.installEventFilter(self)
 
         # 新增：组筛选下拉框
         self.group_filter_combo = QComboBox()
         self.group_filter_combo.addItem("全部组")
-        self.group_filter_combo.currentTextChanged.connect(self.load_records)
+        self.group_filter_combo.currentIndexChanged.connect(lambda _: self.load_records())
         self.group_filter_combo.hide()  # 初始隐藏
 
+        # 内容类型筛选框（剪贴板模式）
+        self.kind_filter_combo = QComboBox()
+        self.kind_filter_combo.addItem("全部类型")
+        for kind, label in CONTENT_KINDS.items():
+            self.kind_filter_combo.addItem(label, kind)
+        self.kind_filter_combo.currentIndexChanged.connect(lambda _: self.search_clips(self.search_box.text()))
+
         # 创建设置按钮
         btn_settings = QPushButton("设置")
         btn_settings.setFixedWidth(60)
@@ -277,14 +3016,39 @@ class ReuseHistoryWindow(QWidget):
         action_set_limit = settings_menu.addAction("设置最大记录")
         group_menu = settings_menu.addMenu("组管理")
         action_create_group = group_menu.addAction("新建组")
+        action_rename_group = group_menu.addAction("重命名组")
         action_delete_group = group_menu.addAction("删除组")
+        dedup_menu = settings_menu.addMenu("去重")
+        action_dedup_normalized = dedup_menu.addAction("忽略换行符和首尾空白差异")
+        action_dedup_normalized.setCheckable(True)
+        action_dedup_normalized.setChecked(self.db.get_setting('dedup_normalized'))
+        action_dedup_near = dedup_menu.addAction("合并近似重复内容")
+        action_dedup_near.setCheckable(True)
+        action_dedup_near.setChecked(self.db.get_setting('dedup_near'))
+        action_near_distance = dedup_menu.addAction("近似程度...")
+        sync_menu = settings_menu.addMenu("多机同步")
+        action_sync_dir = sync_menu.addAction("设置同步目录...")
+        action_sync_now = sync_menu.addAction("立即同步")
+        self.undo_menu = settings_menu.addMenu("撤销删除")
+        self.undo_menu.aboutToShow.connect(self.populate_undo_menu)
+        archive_menu = settings_menu.addMenu("归档")
+        action_search_archive = archive_menu.addAction("按搜索框条件搜索归档")
+        action_archive_settings = archive_menu.addAction("自动归档...")
         exit_action = settings_menu.addAction("退出")
         exit_action.triggered.connect(QApplication.quit)
 
         # 绑定事件
         action_create_group.triggered.connect(self.create_new_group)
+        action_rename_group.triggered.connect(self.rename_group)
         action_delete_group.triggered.connect(self.delete_group)
         action_set_limit.triggered.connect(self.open_settings)
+        action_dedup_normalized.toggled.connect(lambda checked: self.db.set_setting('dedup_normalized', checked))
+        action_dedup_near.toggled.connect(lambda checked: self.db.set_setting('dedup_near', checked))
+        action_near_distance.triggered.connect(self.open_near_dup_settings)
+        action_sync_dir.triggered.connect(self.choose_sync_dir)
+        action_sync_now.triggered.connect(self.sync_now)
+        action_search_archive.triggered.connect(self.search_archive)
+        action_archive_settings.triggered.connect(self.open_archive_settings)
 
         # 设置按钮点击时弹出菜单
         btn_settings.clicked.connect(lambda: settings_menu.exec_(btn_settings.mapToGlobal(btn_settings.rect().bottomLeft())))
@@ -309,6 +3073,7 @@ class ReuseHistoryWindow(QWidget):
         mid_row_layout.addWidget(self.record_button)
         mid_row_layout.addStretch()
         mid_row_layout.addWidget(self.group_filter_combo)
+        mid_row_layout.addWidget(self.kind_filter_combo)
 
         # 创建表格控件
         self.table_widget = QTableWidget()
@@ -333,9 +3098,14 @@ class ReuseHistoryWindow(QWidget):
         self.table_widget.setShowGrid(False)
         self.table_widget.verticalHeader().setVisible(False)
         self.table_widget.setSelectionBehavior(QAbstractItemView.SelectRows)
-        self.table_widget.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table_widget.setSelectionMode(QAbstractItemView.ExtendedSelection)  # 支持 Ctrl/Shift 多选
         self.table_widget.setEditTriggers(QAbstractItemView.NoEditTriggers)
 
+        # 搜索时内容列显示匹配处的片段并高亮（只为绘制到的行计算）
+        self.snippet_delegate = SnippetDelegate(self.table_widget, self.db, self.search_box.text,
+                                                lambda: self.current_mode)
+        self.table_widget.setItemDelegateForColumn(1, self.snippet_delegate)
+
         # 设置列宽策略
         self.table_widget.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeToContents)
         self.table_widget.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
@@ -381,6 +3151,11 @@ class ReuseHistoryWindow(QWidget):
         self.current_mode = mode
         self.set_table_headers()  # 更新表头
 
+        # 记录模式下可拖动调整顺序
+        self.table_widget.setDragEnabled(mode == 'record')
+        self.table_widget.setDragDropMode(
+            QAbstractItemView.InternalMove if mode == 'record' else QAbstractItemView.NoDragDrop)
+
         if mode == 'clip':
             self.clip_button.setStyleSheet("font-weight:bold;")
             self.record_button.setStyleSheet("")
@@ -388,6 +3163,7 @@ class ReuseHistoryWindow(QWidget):
 
             # 隐藏组筛选框
             self.group_filter_combo.hide()
+            self.kind_filter_combo.show()
 
         else:
             self.record_button.setStyleSheet("font-weight:bold;")
@@ -396,6 +3172,7 @@ class ReuseHistoryWindow(QWidget):
 
             # 显示组筛选框
             self.group_filter_combo.show()
+            self.kind_filter_combo.hide()
 
     def toggle_mode(self):
         """切换剪贴板与记录模式"""
@@ -404,20 +3181,31 @@ class ReuseHistoryWindow(QWidget):
         else:
             self.switch_mode('clip')
     def load_group_filters(self):
-        """加载所有组名到筛选下拉框"""
+        """加载所有组名到筛选下拉框（显示组内记录数，组名存放在 itemData 中）"""
+        selected_group = self.group_filter_combo.currentData()
         self.group_filter_combo.blockSignals(True)  # 防止触发 load_records
         self.group_filter_combo.clear()
         self.group_filter_combo.addItem("全部组")
 
-        groups = [row[0] for row in self.db.conn.execute("SELECT name FROM groups").fetchall()]
-        self.group_filter_combo.addItems(groups)
-        
+        for name, count in self.db.get_groups():
+            self.group_filter_combo.addItem(f"{name} ({count})", name)
+
+        index = self.group_filter_combo.findData(selected_group) if selected_group else 0
+        self.group_filter_combo.setCurrentIndex(max(index, 0))
         self.group_filter_combo.blockSignals(False)
 
         # 手动触发一次 load_records
-        if self.group_filter_combo.currentText().strip() == "全部组":
+        if self.current_mode == 'record':
             self.load_records()
 
+    def update_group_counts(self):
+        """刷新下拉框中的组内记录数（读取触发器维护的计数，无需扫描记录表）"""
+        counts = dict(self.db.get_groups())
+        for index in range(1, self.group_filter_combo.count()):
+            name = self.group_filter_combo.itemData(index)
+            if name in counts:
+                self.group_filter_combo.setItemText(index, f"{name} ({counts[name]})")
+
     def set_table_headers(self):
         """根据当前模式设置表格列标题"""
         if self.current_mode == 'clip':
@@ -428,6 +3216,12 @@ class ReuseHistoryWindow(QWidget):
     def eventFilter(self, source, event):
         """事件过滤器用于检测鼠标离开表格和预览框事件"""
 
+        # 搜索框没有可撤销的输入时，Ctrl+Z 撤销删除
+        if source is self.search_box and event.type() == QEvent.KeyPress and event.matches(QKeySequence.Undo):
+            if not self.search_box.isUndoAvailable():
+                self.undo_delete()
+                return True
+
         # 处理预览窗口相关事件
         if self.preview_dialog and source is self.preview_dialog:
             if event.type() == QEvent.Enter:
@@ -441,6 +3235,16 @@ class ReuseHistoryWindow(QWidget):
         if source is self.table_widget.viewport():
             if event.type() == QEvent.Leave:
                 self.hide_timer.start(300)
+            elif event.type() == QEvent.Drop and self.current_mode == 'record':
+                # 拖放调整记录顺序：放在目标行的上半部分表示插到它之前，下半部分表示之后
+                index = self.table_widget.indexAt(event.pos())
+                target = index.row() if index.isValid() else self.table_widget.rowCount()
+                if index.isValid() and event.pos().y() > self.table_widget.visualRect(index).center().y():
+                    target += 1
+                event.setDropAction(Qt.IgnoreAction)  # 顺序由数据库决定，阻止表格自己移动单元格
+                event.accept()
+                self.reorder_records(self.selected_rows(), target)
+                return True
 
         # 其他情况交给父类处理
         return super().eventFilter(source, event)
@@ -472,6 +3276,9 @@ class ReuseHistoryWindow(QWidget):
             return
         
         content = clip_data.get("full_content", "")
+        limit = self.db.get_setting('preview_budget_kb') * 512  # 文档按每字 2 字节计
+        if len(content) > limit:
+            content = content[:limit] + f"\n\n……（共 {len(content)} 字，预览只显示前 {limit} 字）"
         
         # 创建或更新预览窗口
         if not self.preview_dialog:
@@ -537,7 +3344,11 @@ class ReuseHistoryWindow(QWidget):
         self.search_box.setFocus()
 
     def refresh_clips(self):
-        clips = self.db.get_all_clips(self.current_limit)
+        kind = self.kind_filter_combo.currentData()
+        if kind:
+            clips = self.db.search_clips("", self.current_limit, kind=kind)
+        else:
+            clips = self.db.get_all_clips(self.current_limit)
         self.load_clips(clips)
         self.hide_preview()
 
@@ -549,6 +3360,10 @@ class ReuseHistoryWindow(QWidget):
     
     def load_clips(self, clips):
         """加载剪贴板记录到表格"""
+        self.cancel_scan()
+        if clips and clips is self.displayed_rows:
+            return  # 与当前展示的是同一份缓存结果
+        self.displayed_rows = clips
         self.set_table_headers()
         self.table_widget.setRowCount(0)  # 清空表格
 
@@ -562,48 +3377,105 @@ class ReuseHistoryWindow(QWidget):
 
         # 设置行数
         self.table_widget.setRowCount(len(clips))
+        for row, clip in enumerate(clips):
+            self.fill_clip_row(row, clip)
+
+    def fill_clip_row(self, row, clip):
+        """填充剪贴板表格的一行"""
+        clip_id, content, timestamp, pinned = clip
 
         # 斑马纹颜色
         color1 = QColor(255, 255, 255)  # 白色
         color2 = QColor(245, 245, 245)  # 浅灰色
 
-        for row, (clip_id, content, timestamp) in enumerate(clips):
-            # 设置行背景色（斑马纹效果）
-            bg_color = color1 if row % 2 == 0 else color2
-            text_color = QColor(0, 0, 0)  # 黑色文字
+        # 设置行背景色（斑马纹效果）
+        bg_color = color1 if row % 2 == 0 else color2
+        text_color = QColor(0, 0, 0)  # 黑色文字
 
-            # 创建行项
-            for col in range(3):
-                item = QTableWidgetItem()
-                item.setBackground(QBrush(bg_color))
-                item.setForeground(QBrush(text_color))
-                self.table_widget.setItem(row, col, item)
+        # 创建行项
+        for col in range(3):
+            item = QTableWidgetItem()
+            item.setBackground(QBrush(bg_color))
+            item.setForeground(QBrush(text_color))
+            self.table_widget.setItem(row, col, item)
 
-            # 序号列
-            seq_item = self.table_widget.item(row, 0)
-            seq_item.setText(f"{row + 1}")
-            seq_item.setData(Qt.UserRole, clip_id)
-            seq_item.setTextAlignment(Qt.AlignCenter)
+        # 序号列
+        seq_item = self.table_widget.item(row, 0)
+        seq_item.setData(Qt.UserRole, clip_id)
+        seq_item.setTextAlignment(Qt.AlignCenter)
 
-            # 内容列
-            display_text = content if len(content) <= 80 else content[:80] + "..."
+        # 内容列
+        display_text = content if len(content) <= 80 else content[:80] + "..."
 
-            content_item = self.table_widget.item(row, 1)
-            content_item.setText(display_text)
-            content_item.setData(Qt.UserRole, {
-                "id": clip_id,
-                "content": content,
-                "full_content": content
-            })
+        content_item = self.table_widget.item(row, 1)
+        content_item.setText(display_text)
+        content_item.setData(Qt.UserRole, {
+            "id": clip_id,
+            "content": content,
+            "full_content": content,
+            "pinned": bool(pinned)
+        })
+        self.set_row_seq_text(row)
 
-            # 时间列
-            time_item = self.table_widget.item(row, 2)
-            time_item.setText(timestamp)
+        # 时间列
+        time_item = self.table_widget.item(row, 2)
+        time_item.setText(timestamp)
     
+    def table_memory(self):
+        """表格条目占用的内存估算：单元格文字和 UserRole 数据都以 UTF-16 保存在 Qt 中"""
+        chars = 0
+        rows = self.table_widget.rowCount()
+        for row in range(rows):
+            for col in range(3):
+                item = self.table_widget.item(row, col)
+                if item:
+                    chars += len(item.text())
+            data = self.table_widget.item(row, 1).data(Qt.UserRole) if self.table_widget.item(row, 1) else None
+            if data:
+                chars += sum(len(value) for value in data.values() if isinstance(value, str))
+        return chars * 2, f"{rows} 行"
+
+    def preview_memory(self):
+        if not self.preview_dialog:
+            return 0, "未创建"
+        chars = self.preview_dialog.preview_area.document().characterCount()
+        return chars * 2, f"{chars} 字，上限 {self.db.get_setting('preview_budget_kb')} KB"
+
+    def set_row_seq_text(self, row):
+        """设置序号列文字，置顶记录带 📌 标记"""
+        seq_item = self.table_widget.item(row, 0)
+        content_item = self.table_widget.item(row, 1)
+        if not seq_item or not content_item:
+            return
+        clip_data = content_item.data(Qt.UserRole) or {}
+        seq_item.setText(f"📌{row + 1}" if clip_data.get("pinned") else f"{row + 1}")
+
+    def selected_rows(self):
+        """返回当前选中的行号（升序），忽略“没有找到记录”之类的占位行"""
+        rows = sorted({index.row() for index in self.table_widget.selectionModel().selectedRows()})
+        return [row for row in rows
+                if self.table_widget.item(row, 1) and self.table_widget.item(row, 1).data(Qt.UserRole)]
+
+    def selected_items_data(self):
+        """返回选中行的 UserRole 数据列表"""
+        return [self.table_widget.item(row, 1).data(Qt.UserRole) for row in self.selected_rows()]
+
+    def remove_rows(self, rows):
+        """从表格中移除指定行（不重新查询数据库），并更新序号"""
+        self.displayed_rows = None
+        for row in sorted(rows, reverse=True):
+            self.table_widget.removeRow(row)
+        for row in range(min(rows, default=0), self.table_widget.rowCount()):
+            self.set_row_seq_text(row)
+        self.hide_preview()
+
     def search_clips(self, keyword):
         if self.current_mode == 'clip':
             if keyword:
-                clips = self.db.search_clips(keyword, self.current_limit)
+                if self.start_scan(keyword):
+                    return
+                clips = self.db.search_clips(keyword, self.current_limit,
+                                             kind=self.kind_filter_combo.currentData())
                 self.load_clips(clips)
                 if self.table_widget.rowCount() > 0:
                     self.table_widget.selectRow(0)
@@ -617,6 +3489,63 @@ class ReuseHistoryWindow(QWidget):
             else:
                 self.load_records()
     
+    def start_scan(self, keyword):
+        """历史很大且需要逐行检查内容时，改用并行扫描并流式显示结果；返回是否已开始扫描"""
+        query = SearchQuery(keyword)
+        kind = self.kind_filter_combo.currentData()
+        if kind:
+            query.kind = kind
+        if not query.needs_scan() or self.db.clip_range_index(query):
+            return False  # 范围条件已把候选行缩小到很少，普通搜索更快
+        key = self.db.clip_search_key(query, self.current_limit)
+        if self.db.query_cache.get(key, self.db.write_generation) is not None:
+            return False  # 已有缓存结果，直接走普通搜索
+        lo, hi = self.db.clip_id_range()
+        if lo is None or hi - lo + 1 < self.db.get_setting('parallel_scan_min_rows'):
+            return False
+
+        self.cancel_scan()
+        self.displayed_rows = None
+        self.set_table_headers()
+        self.table_widget.setRowCount(0)
+        self.hide_preview()
+        self.scan_rows = []
+        self.scan_key = (key, self.db.write_generation)
+        self.scan_started = time.perf_counter()
+        self.scan_generation = self.scan_engine.start(query, self.current_limit)
+        return True
+
+    def append_scan_rows(self, generation, rows):
+        """追加一批并行扫描结果（主线程）"""
+        if generation != self.scan_generation:
+            return  # 旧查询的迟到结果
+        first_batch = not self.scan_rows
+        start = self.table_widget.rowCount()
+        self.scan_rows.extend(rows)
+        self.table_widget.setRowCount(start + len(rows))
+        for offset, clip in enumerate(rows):
+            self.fill_clip_row(start + offset, clip)
+        if first_batch:
+            self.table_widget.selectRow(0)
+
+    def finish_scan(self, generation):
+        if generation != self.scan_generation:
+            return
+        self.scan_generation = None
+        clips = tuple(self.scan_rows)
+        key, write_generation = self.scan_key
+        self.db.query_cache.put(key, write_generation, clips)  # 期间有写入时缓存会自动失效
+        print(f"并行扫描完成: {len(clips)} 条结果，耗时 {time.perf_counter() - self.scan_started:.2f} 秒")
+        if not clips:
+            self.load_clips(clips)
+        else:
+            self.displayed_rows = clips
+
+    def cancel_scan(self):
+        if self.scan_generation is not None:
+            self.scan_generation = None
+            self.scan_engine.cancel()
+
     def copy_to_clipboard(self, row, column):
         """将选中项复制回剪贴板，并刷新为最新记录"""
         if row < 0 or row >= self.table_widget.rowCount():
@@ -628,28 +3557,28 @@ class ReuseHistoryWindow(QWidget):
             if clip_data:
                 content = clip_data["content"]
 
-                # 根据当前模式决定是否更新为最新记录
-                if self.current_mode == 'clip' and "id" in clip_data:
-                    clip_id = clip_data["id"]
-                    self.db.update_clip_as_latest(clip_id)
-
-                # 设置剪贴板内容
-                clipboard = QApplication.clipboard()
-                clipboard.setText(content)
+                # 剪贴板模式下更新为最新记录
+                self.touch_clip(clip_data)
 
                 # 关闭窗口
                 self.close_window()
                 self.search_box.clear()
 
-                # 粘贴内容到之前焦点位置
+                # 设置剪贴板并粘贴内容到之前焦点位置
                 QTimer.singleShot(100, lambda: self.paste_to_focus(content))
+
+    def write_clipboard(self, content):
+        """写入剪贴板；由 ReuseManager 接管时会标记为自身写入，不再被重新采集"""
+        if self.clipboard_writer:
+            self.clipboard_writer(content)
+        else:
+            QApplication.clipboard().setText(content)
     
     def paste_to_focus(self, content):
 
         try:
-            # 使用 PyQt 设置剪贴板内容（更安全）
-            clipboard = QApplication.clipboard()
-            clipboard.setText(content)
+            # 使用 PyQt 设置剪贴板内容（更安全），每次粘贴只写一次剪贴板
+            self.write_clipboard(content)
 
             # 延迟一点让系统准备就绪
             time.sleep(0.1)
@@ -666,7 +3595,7 @@ class ReuseHistoryWindow(QWidget):
             self.show_notification("粘贴失败", str(e))
     
     def show_context_menu(self, position):
-        """显示右键菜单"""
+        """显示右键菜单（多选时对所有选中行批量操作）"""
         index = self.table_widget.indexAt(position)
         if not index.isValid():
             return
@@ -680,54 +3609,111 @@ class ReuseHistoryWindow(QWidget):
         if not clip_data:
             return
 
+        # 右键未选中的行时，改为只选中该行
+        if row not in self.selected_rows():
+            self.table_widget.selectRow(row)
+        rows = self.selected_rows()
+        count = len(rows)
+        suffix = f" ({count} 条)" if count > 1 else ""
+        archived = any("archive" in self.table_widget.item(r, 1).data(Qt.UserRole) for r in rows)
+
         menu = QMenu()
 
-        # 如果是记录模式，添加【编辑】和【删除】选项
+        # 如果是记录模式，添加【编辑】、【移动到组】和【删除】选项
         if self.current_mode == 'record':
-            edit_action = menu.addAction("编辑")
-            edit_action.triggered.connect(lambda: self.edit_record(clip_data))
+            if count == 1:
+                edit_action = menu.addAction("编辑")
+                edit_action.triggered.connect(lambda: self.edit_record(clip_data))
+
+            top_action = menu.addAction("移到最前" + suffix)
+            top_action.triggered.connect(lambda: self.move_selected_records_to_top(rows))
+
+            move_action = menu.addAction("移动到组" + suffix)
+            move_action.triggered.connect(lambda: self.move_selected_records(rows))
+
+            delete_action = menu.addAction("删除" + suffix)
+            delete_action.triggered.connect(lambda: self.delete_selected_records(rows))
 
-            delete_action = menu.addAction("删除")
-            delete_action.triggered.connect(lambda: self.delete_record(clip_data["id"], row))
+        # 归档中的内容只能粘贴或添加为记录
+        elif archived:
+            add_to_record_action = menu.addAction("添加为记录" + suffix)
+            add_to_record_action.triggered.connect(lambda: self.add_selected_to_records(rows))
 
-        # 剪贴板模式下才支持“添加为记录”
+        # 剪贴板模式下才支持“添加为记录”和“置顶”
         else:
-            add_to_record_action = menu.addAction("添加为记录")
-            add_to_record_action.triggered.connect(lambda: self.add_to_records(clip_data["content"]))
+            add_to_record_action = menu.addAction("添加为记录" + suffix)
+            add_to_record_action.triggered.connect(lambda: self.add_selected_to_records(rows))
+
+            selected = [self.table_widget.item(r, 1).data(Qt.UserRole) for r in rows]
+            pin = not all(data.get("pinned") for data in selected)
+            pin_action = menu.addAction(("置顶" if pin else "取消置顶") + suffix)
+            pin_action.triggered.connect(lambda: self.pin_selected_clips(rows, pin))
+
+            if count == 1:
+                similar_action = menu.addAction("相似内容")
+                similar_action.triggered.connect(lambda: self.show_similar_clips(row))
 
         # 所有模式都有的功能
-        copy_action = menu.addAction("strip粘贴")
-        copy_action.triggered.connect(lambda: self.strip_paste(clip_data))
+        if count == 1:
+            copy_action = menu.addAction("strip粘贴")
+            copy_action.triggered.connect(lambda: self.strip_paste(clip_data))
 
-        if self.current_mode == 'clip':
-            delete_action = menu.addAction("删除")
-            delete_action.triggered.connect(lambda: self.delete_clip(clip_data["id"], row))
+        if self.current_mode == 'clip' and not archived:
+            delete_action = menu.addAction("删除" + suffix)
+            delete_action.triggered.connect(lambda: self.delete_selected_clips(rows))
 
         # 使用 mapToGlobal 确保菜单在正确位置弹出
         menu.exec_(self.table_widget.viewport().mapToGlobal(position))
 
-    def delete_clip(self, clip_id, row):
-        """删除单个记录"""
-        self.db.delete_clip(clip_id)
-        self.table_widget.removeRow(row)
-        self.hide_preview()
-        self.show_notification("已删除", "记录已移除")
+    def show_similar_clips(self, row):
+        """在表格中列出与该行内容最相似的记录（原记录排在第一行）"""
+        clip_data = self.table_widget.item(row, 1).data(Qt.UserRole)
+        start = time.perf_counter()
+        similar = self.db.similar_clips(clip_data["id"], self.SIMILAR_LIMIT)
+        elapsed = (time.perf_counter() - start) * 1000
+        if not similar:
+            self.show_notification("相似内容", "没有找到相似的内容")
+            return
+        source = (clip_data["id"], clip_data["full_content"], self.table_widget.item(row, 2).text(),
+                  clip_data["pinned"])
+        self.load_clips([source] + [row for row, _ in similar])
+        self.table_widget.selectRow(0)
+        print(f"相似内容: {len(similar)} 条，最高相似度 {similar[0][1]:.2f}，用时 {elapsed:.1f} ms")
+
+    def row_ids(self, rows):
+        return [self.table_widget.item(row, 1).data(Qt.UserRole)["id"] for row in rows]
+
+    def delete_selected_clips(self, rows):
+        """批量删除选中的剪贴板记录"""
+        self.db.delete_clips(self.row_ids(rows))
+        self.remove_rows(rows)
+        self.show_notification("已删除", f"已移除 {len(rows)} 条记录（Ctrl+Z 撤销）")
+
+    def pin_selected_clips(self, rows, pinned):
+        """批量置顶/取消置顶，只更新对应行的显示"""
+        self.displayed_rows = None
+        self.db.set_clips_pinned(self.row_ids(rows), pinned)
+        for row in rows:
+            item = self.table_widget.item(row, 1)
+            clip_data = dict(item.data(Qt.UserRole))
+            clip_data["pinned"] = pinned
+            item.setData(Qt.UserRole, clip_data)
+            self.set_row_seq_text(row)
+
+    def add_selected_to_records(self, rows):
+        """批量添加为记录"""
+        contents = [self.table_widget.item(row, 1).data(Qt.UserRole)["content"] for row in rows]
+        self.add_to_records(contents)
     
     def strip_paste(self, clip_data):
         """strip粘贴"""
         if clip_data:
             content = clip_data["content"]
 
-            # 根据当前模式决定是否更新为最新记录
-            if self.current_mode == 'clip' and "id" in clip_data:
-                clip_id = clip_data["id"]
-                self.db.update_clip_as_latest(clip_id)
+            # 剪贴板模式下更新为最新记录
+            self.touch_clip(clip_data)
 
-            # 设置剪贴板内容
-            clipboard = QApplication.clipboard()
             content_strip = content.strip()
-            clipboard.setText(content)
-
 
             # 关闭窗口
             self.close_window()
@@ -747,7 +3733,7 @@ class ReuseHistoryWindow(QWidget):
         if reply == QMessageBox.Yes:
             self.db.clear_all()
             self.refresh_clips()
-            self.show_notification("已清空", "记录已清除")
+            self.show_notification("已清空", "记录已清除（Ctrl+Z 撤销）")
     
     def open_settings(self):
         """打开设置对话框"""
@@ -763,6 +3749,118 @@ class ReuseHistoryWindow(QWidget):
             self.refresh_clips()
             self.show_notification("设置已更新", f"将保存最多 {new_limit} 条记录")
     
+    def open_near_dup_settings(self):
+        """设置近似重复判定的最大差异位数"""
+        distance, ok = QInputDialog.getInt(
+            self, '近似重复',
+            '指纹最多相差的位数 (0-3，越大合并越激进):',
+            self.db.get_setting('near_dup_distance'), 0, 3, 1
+        )
+        if ok:
+            self.db.set_setting('near_dup_distance', distance)
+            self.show_notification("设置已更新", f"近似重复阈值为 {distance}")
+
+    def choose_sync_dir(self):
+        """选择多机共享的同步目录（如网盘或共享文件夹）"""
+        sync_dir = QFileDialog.getExistingDirectory(self, "选择同步目录", self.db.get_setting('sync_dir'))
+        if sync_dir:
+            self.sync.enable(sync_dir)
+            self.sync_now()
+
+    def sync_now(self):
+        """与同步目录交换增量变更"""
+        if not self.db.sync_enabled:
+            self.show_notification("提示", "请先设置同步目录")
+            return
+        try:
+            imported, exported = self.sync.sync()
+        except (OSError, ValueError, sqlite3.Error) as e:
+            QMessageBox.warning(self, "同步失败", str(e))
+            return
+        if imported:
+            self.load_group_filters()
+            self.refresh_data()
+        self.show_notification("同步完成", f"导入 {imported} 条，导出 {exported} 条变更")
+
+    def populate_undo_menu(self):
+        """撤销删除菜单：列出仍可撤销的删除批次，最新的在最上面"""
+        self.undo_menu.clear()
+        stack = self.db.undoable_deletions()
+        if not stack:
+            self.undo_menu.addAction("没有可撤销的删除").setEnabled(False)
+            return
+        for deletion, created, label in stack:
+            action = self.undo_menu.addAction(f"{datetime.fromtimestamp(created).strftime('%H:%M:%S')}  {label}")
+            action.triggered.connect(lambda _, d=deletion, l=label: self.undo_delete(d, l))
+
+    def undo_delete(self, deletion=None, label=None):
+        """撤销指定的删除批次，未指定时撤销最近一次删除"""
+        if deletion is None:
+            stack = self.db.undoable_deletions(1)
+            if not stack:
+                self.show_notification("撤销", "没有可撤销的删除")
+                return
+            deletion, _, label = stack[0]
+        restored = self.db.undo_deletion(deletion)
+        if restored is None:
+            self.show_notification("撤销", "该删除已超过可撤销时间")
+            return
+        if restored == 0:
+            self.show_notification("撤销", f"{label}：没有可恢复的内容")
+            return
+        self.load_group_filters()
+        self.refresh_data()
+        self.show_notification("已撤销", f"{label}（恢复 {restored} 项）")
+
+    def open_archive_settings(self):
+        """设置超过多少天的剪贴板内容移入归档库"""
+        days, ok = QInputDialog.getInt(
+            self, '自动归档',
+            '超过多少天的内容移入按月归档库（空闲时进行，置顶内容除外；0 表示不归档）:',
+            self.db.get_setting('archive_after_days'), 0, 36500, 1
+        )
+        if ok:
+            self.db.set_setting('archive_after_days', days)
+            self.show_notification("设置已更新", f"超过 {days} 天的内容将被归档" if days else "已关闭自动归档")
+
+    def search_archive(self):
+        """在后台按搜索框中的条件搜索所有归档月份"""
+        if not self.archive.list_months():
+            self.show_notification("提示", "还没有归档的内容")
+            return
+        if self.current_mode != 'clip':
+            self.switch_mode('clip')
+        self.archive_search_id += 1
+        search_id, keyword, limit = self.archive_search_id, self.search_box.text(), self.current_limit
+        emit = self.scan_signals.archive_results.emit
+        threading.Thread(target=lambda: emit(search_id, self.archive.search(keyword, limit)),
+                         name='reuse-archive-search', daemon=True).start()
+        print(f"正在搜索归档: {keyword!r}")
+
+    def show_archive_results(self, search_id, results):
+        """显示归档搜索结果；这些行只能粘贴或添加为记录，粘贴后重新加入剪贴板历史"""
+        if search_id != self.archive_search_id:
+            return
+        self.load_clips([row for _, row in results])
+        for row, (month, _) in enumerate(results):
+            item = self.table_widget.item(row, 1)
+            clip_data = dict(item.data(Qt.UserRole))
+            clip_data["archive"] = month
+            item.setData(Qt.UserRole, clip_data)
+            item.setToolTip(f"归档于 {month}")
+        if results:
+            self.table_widget.selectRow(0)
+        self.show_notification("搜索归档", f"在归档中找到 {len(results)} 条")
+
+    def touch_clip(self, clip_data):
+        """粘贴后把该条剪贴板内容设为最新记录；归档中的内容重新加入历史"""
+        if self.current_mode != 'clip':
+            return
+        if "archive" in clip_data:
+            self.db.save_clip(clip_data["content"])
+        elif "id" in clip_data:
+            self.db.update_clip_as_latest(clip_data["id"])
+
     def show_notification(self, title, message):
         """显示操作反馈通知"""
         msg = QMessageBox(self)
@@ -785,18 +3883,13 @@ class ReuseHistoryWindow(QWidget):
                     clip_data = content_item.data(Qt.UserRole)
                     if clip_data and "content" in clip_data:
                         content = clip_data["content"]
-                        clip_id = clip_data["id"]
-
-                        # 设置剪贴板内容
-                        clipboard = QApplication.clipboard()
-                        clipboard.setText(content)
 
                         # 关闭窗口
                         self.close_window()
                         self.search_box.clear()
 
                         # 更新数据库：设为最新记录
-                        self.db.update_clip_as_latest(clip_id)
+                        self.touch_clip(clip_data)
                         # 粘贴内容到之前焦点位置
                         QTimer.singleShot(100, lambda: self.paste_to_focus(content))
                     else:
@@ -825,10 +3918,13 @@ class ReuseHistoryWindow(QWidget):
     def load_records(self, keyword=""):
         """加载记录并支持按组筛选"""
         search_word = self.search_box.text().strip()
-        current_text = self.group_filter_combo.currentText().strip()
-        selected_group = None if current_text == "全部组" else current_text
+        selected_group = self.group_filter_combo.currentData()  # “全部组”为 None
 
         records = self.db.get_records(group=selected_group, keyword=search_word)
+        self.update_group_counts()
+        if records and records is self.displayed_rows:
+            return  # 与当前展示的是同一份缓存结果
+        self.displayed_rows = records
         self.set_table_headers()
         self.table_widget.setRowCount(0)
 
@@ -873,8 +3969,10 @@ class ReuseHistoryWindow(QWidget):
             time_item = self.table_widget.item(row, 2)
             time_item.setText(group)
 
-    def add_to_records(self, content):
-        group_list = [item[0] for item in self.db.conn.execute("SELECT name FROM groups").fetchall()]
+    def add_to_records(self, contents):
+        if isinstance(contents, str):
+            contents = [contents]
+        group_list = self.db.get_group_names()
         if not group_list:
             self.show_notification("提示", "没有可选择的组，请先新建组")
             reply = QMessageBox.question(
@@ -883,8 +3981,9 @@ class ReuseHistoryWindow(QWidget):
                 QMessageBox.Yes | QMessageBox.No, QMessageBox.No
             )
             if reply == QMessageBox.Yes:
-                self.db.add_record(content, '默认')
-                self.show_notification("已添加", "已保存为记录")
+                self.db.add_records(contents, '默认')
+                self.load_group_filters()
+                self.show_notification("已添加", f"已保存 {len(contents)} 条记录")
                 if self.current_mode == 'record':
                     self.load_records()
             return
@@ -894,8 +3993,8 @@ class ReuseHistoryWindow(QWidget):
         )
 
         if ok and group_name:
-            self.db.add_record(content, group_name or '默认')
-            self.show_notification("已添加", "已保存为记录")
+            self.db.add_records(contents, group_name or '默认')
+            self.show_notification("已添加", f"已保存 {len(contents)} 条记录")
             if self.current_mode == 'record':
                 self.load_records()
     
@@ -909,20 +4008,91 @@ class ReuseHistoryWindow(QWidget):
         if not ok or not new_content:
             return
 
-        new_group, ok2 = QInputDialog.getText(self, "编辑记录", "组名:", text=old_group)
+        # 只能选择已存在的组
+        group_list = self.db.get_group_names()
+        current = group_list.index(old_group) if old_group in group_list else 0
+        new_group, ok2 = QInputDialog.getItem(
+            self, "编辑记录", "组名:", group_list, current, editable=False
+        )
         if not ok2:
             new_group = old_group
 
         if ok and ok2:
-            self.db.update_record(record_id, new_content, new_group)
+            if not self.db.update_record(record_id, new_content, new_group):
+                QMessageBox.warning(self, "错误", f"组 '{new_group}' 不存在")
+                return
             self.load_records()  # 刷新记录列表
 
-    def delete_record(self, record_id, row):
-        """删除指定记录"""
-        self.db.delete_record(record_id)
-        self.table_widget.removeRow(row)
-        self.hide_preview()
-        self.show_notification("已删除", "记录已从数据库移除")
+    def delete_selected_records(self, rows):
+        """批量删除选中的记录"""
+        self.db.delete_records(self.row_ids(rows))
+        self.remove_rows(rows)
+        self.update_group_counts()
+        self.show_notification("已删除", f"已从数据库移除 {len(rows)} 条记录（Ctrl+Z 撤销）")
+
+    def reorder_records(self, rows, target_row):
+        """把选中的记录移到 target_row 之前（target_row 超出末行时放到组末尾），只支持组内调整"""
+        if not rows:
+            return
+        ids = self.row_ids(rows)
+        if target_row < self.table_widget.rowCount():
+            moved = self.db.place_records(ids, before_id=self.row_ids([target_row])[0])
+        else:
+            group = self.table_widget.item(rows[0], 1).data(Qt.UserRole)["group"]
+            moved = self.db.place_records(ids, group_name=group)
+        if moved:
+            self.show_reordered(ids)
+
+    def move_selected_records_to_top(self, rows):
+        ids = self.row_ids(rows)
+        self.db.move_records_to_top(ids)
+        self.show_reordered(ids)
+
+    def show_reordered(self, ids):
+        """调整顺序后重新加载并保持选中，排序键过长时安排稍后重排"""
+        self.load_records()
+        ids = set(ids)
+        self.table_widget.clearSelection()
+        for row in range(self.table_widget.rowCount()):
+            data = self.table_widget.item(row, 1).data(Qt.UserRole)
+            if data and data["id"] in ids:
+                self.table_widget.selectionModel().select(
+                    self.table_widget.model().index(row, 0),
+                    QItemSelectionModel.Select | QItemSelectionModel.Rows)
+        if self.db.unbalanced_groups:
+            self.rebalance_timer.start(self.REBALANCE_DELAY_MS)
+
+    def move_selected_records(self, rows):
+        """批量移动选中的记录到其他组"""
+        group_list = self.db.get_group_names()
+        if not group_list:
+            self.show_notification("提示", "没有可选择的组，请先新建组")
+            return
+
+        group_name, ok = QInputDialog.getItem(
+            self, "选择目标组", "组名:", group_list, editable=False
+        )
+        if not ok or not group_name:
+            return
+
+        if not self.db.move_records(self.row_ids(rows), group_name):
+            QMessageBox.warning(self, "错误", f"组 '{group_name}' 不存在")
+            return
+
+        # 当前按组筛选时，移出的行直接删除；否则只更新组列
+        self.displayed_rows = None
+        selected_group = self.group_filter_combo.currentData()
+        if selected_group and selected_group != group_name:
+            self.remove_rows(rows)
+        else:
+            for row in rows:
+                item = self.table_widget.item(row, 1)
+                record_data = dict(item.data(Qt.UserRole))
+                record_data["group"] = group_name
+                item.setData(Qt.UserRole, record_data)
+                self.table_widget.item(row, 2).setText(group_name)
+        self.update_group_counts()
+        self.show_notification("已移动", f"{len(rows)} 条记录已移动到组 '{group_name}'")
 
     def create_new_group(self):
         """新建组，防止重复名称"""
@@ -934,6 +4104,7 @@ class ReuseHistoryWindow(QWidget):
                 return
 
             if self.db.add_group(group_name):
+                self.load_group_filters()
                 self.show_notification("新建组", f"组 '{group_name}' 已创建")
                 break
             else:
@@ -941,7 +4112,7 @@ class ReuseHistoryWindow(QWidget):
 
     def delete_group(self):
         """删除组及该组下所有记录"""
-        group_list = [item[0] for item in self.db.conn.execute("SELECT name FROM groups").fetchall()]
+        group_list = self.db.get_group_names()
         if not group_list:
             self.show_notification("提示", "没有可删除的组")
             return
@@ -957,16 +4128,150 @@ class ReuseHistoryWindow(QWidget):
             )
             if reply == QMessageBox.Yes:
                 self.db.delete_group(group_name)
-                self.show_notification("删除成功", f"组 '{group_name}' 及其所有记录已被删除")
+                self.load_group_filters()
+                self.show_notification("删除成功", f"组 '{group_name}' 及其所有记录已被删除（Ctrl+Z 撤销）")
+
+    def rename_group(self):
+        """重命名组（记录通过组 ID 关联，无需改写记录）"""
+        group_list = self.db.get_group_names()
+        if not group_list:
+            self.show_notification("提示", "没有可重命名的组")
+            return
+
+        old_name, ok = QInputDialog.getItem(
+            self, "选择要重命名的组", "组名:", group_list, editable=False
+        )
+        if not ok or not old_name:
+            return
+
+        new_name, ok = QInputDialog.getText(self, "重命名组", "新组名:", text=old_name)
+        if not ok or not new_name or new_name == old_name:
+            return
+
+        if self.db.rename_group(old_name, new_name):
+            self.load_group_filters()
+            self.show_notification("重命名组", f"组 '{old_name}' 已重命名为 '{new_name}'")
+        else:
+            QMessageBox.warning(self, "错误", "组名已存在，请重新输入。")
+
+class QuickPastePalette(QWidget):
+    """快速粘贴面板：启动时创建好的无边框小窗口，列出最近的几条内容
+
+    条目只保存 ID 和单行摘要，在数据变化后提前更新；按下快捷键时只需移动并显示窗口，
+    不查询数据库、不重建列表。选中后才按 ID 读取完整内容并粘贴。
+    """
+    PREVIEW_CHARS = 60
+
+    def __init__(self, db, paste):
+        super().__init__()
+        self.db = db
+        self.paste = paste  # paste(content, clip_id, foreground_hwnd)
+        self.generation = None
+        self.foreground_hwnd = 0
+
+        self.setWindowFlags(Qt.Tool | Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.list_widget = QListWidget()
+        self.list_widget.setStyleSheet("""
+            QListWidget {
+                background-color: #FFFFFF;
+                border: 1px solid #B0B0B0;
+                font-size: 12px;
+            }
+            QListWidget::item {
+                padding: 4px 6px;
+            }
+            QListWidget::item:selected {
+                background-color: #4A90E2;
+                color: white;
+            }
+        """)
+        self.list_widget.itemActivated.connect(lambda item: self.choose(self.list_widget.row(item)))
+        self.list_widget.installEventFilter(self)
+        layout.addWidget(self.list_widget)
+        self.resize(420, 260)
+        self.winId()  # 提前创建原生窗口，首次显示也无需额外开销
+
+    def refresh(self):
+        """按最新数据重建条目（在数据变化后调用，不在弹出时调用）"""
+        self.generation = self.db.write_generation
+        self.list_widget.clear()
+        for number, (clip_id, preview) in enumerate(
+                self.db.get_recent_clips(self.db.get_setting('palette_size')), start=1):
+            line = ' '.join(preview.split())
+            if len(line) > self.PREVIEW_CHARS:
+                line = line[:self.PREVIEW_CHARS] + "..."
+            item = QListWidgetItem(f"{number}  {line}" if number <= 9 else f"    {line}")
+            item.setData(Qt.UserRole, clip_id)
+            self.list_widget.addItem(item)
+        rows = self.list_widget.count()
+        if rows:
+            height = self.list_widget.sizeHintForRow(0) * rows + 2 * self.list_widget.frameWidth()
+            self.resize(self.width(), min(height, 480))
+
+    def memory_usage(self):
+        count = self.list_widget.count()
+        chars = sum(len(self.list_widget.item(i).text()) for i in range(count))
+        return chars * 2, f"{count} 条"
+
+    def popup(self, foreground_hwnd=0):
+        """在鼠标位置显示面板"""
+        self.foreground_hwnd = foreground_hwnd
+        screen = QApplication.desktop().availableGeometry(QCursor.pos())
+        pos = QCursor.pos()
+        self.move(min(pos.x(), screen.right() - self.width()), min(pos.y(), screen.bottom() - self.height()))
+        self.list_widget.setCurrentRow(0)
+        self.show()
+        self.raise_()
+        self.activateWindow()
+        self.list_widget.setFocus()
+        if self.generation != self.db.write_generation:
+            QTimer.singleShot(0, self.refresh)  # 先显示，再补上显示期间之外的数据变化
+
+    def choose(self, row):
+        item = self.list_widget.item(row)
+        if item is None:
+            return
+        self.hide()
+        content = self.db.get_clip_content(item.data(Qt.UserRole))
+        if content is not None:
+            self.paste(content, item.data(Qt.UserRole), self.foreground_hwnd)
+
+    def eventFilter(self, source, event):
+        if source is self.list_widget and event.type() == QEvent.KeyPress:
+            key = event.key()
+            if key == Qt.Key_Escape:
+                self.hide()
+                return True
+            if Qt.Key_1 <= key <= Qt.Key_9:
+                self.choose(key - Qt.Key_1)
+                return True
+        return super().eventFilter(source, event)
+
+    def changeEvent(self, event):
+        # 点击其他地方、面板失去焦点时自动隐藏
+        if event.type() == QEvent.ActivationChange and not self.isActiveWindow():
+            self.hide()
+        super().changeEvent(event)
 
 class ReuseManager:
     """剪贴板管理核心类"""
-    def __init__(self):
+    def __init__(self, instance=None):
         self.db = ReuseDatabase()
-        self.last_clipboard_content = ""
+        # 只保存上一次内容的摘要，不保留可能很大的原文
+        self.last_clipboard_digest = None
+        self.pending_self_write = None  # 自身写入剪贴板的内容摘要
+        self.capture_stats = Counter()
+
+        # 短时间内的多次剪贴板变化合并为一次采集（固定窗口，持续风暴下也不会饿死）
+        self.coalesce_timer = QTimer()
+        self.coalesce_timer.setSingleShot(True)
+        self.coalesce_timer.timeout.connect(self.process_clipboard_change)
         
         # 创建历史窗口
         self.history_window = ReuseHistoryWindow(self.db)
+        self.history_window.clipboard_writer = self.write_clipboard
         
         # 初始化系统托盘
         self.tray_icon = QSystemTrayIcon()
@@ -985,6 +4290,71 @@ class ReuseManager:
         self.signals = WorkerSignals()
         # 绑定主窗口显示逻辑
         self.signals.show_window.connect(self.show_history_window)
+
+        # 快速粘贴面板（Ctrl+Shift+Space），预先创建并在数据变化后更新
+        self.palette = QuickPastePalette(self.db, self.paste_from_palette)
+        self.palette.refresh()
+        self.signals.show_palette.connect(self.palette.popup)
+
+        # 定时在线备份（后台线程完成后通过信号回到主线程）
+        self.backup = ReuseBackup(self.db, on_finished=self.signals.backup_finished.emit)
+        self.signals.backup_finished.connect(self.handle_backup_finished)
+        self.backup_timer = QTimer()
+        self.backup_timer.timeout.connect(self.run_scheduled_backup)
+        self.backup_timer.start(10 * 60 * 1000)
+        QTimer.singleShot(60 * 1000, self.run_scheduled_backup)
+
+        # 后台内容分类
+        self.classifier = ReuseClassifier(self.db, on_classified=self.signals.clips_classified.emit)
+        self.signals.clips_classified.connect(self.db.set_clip_kinds)
+        self.classifier.start()
+
+        # 旧版本升级后，已有记录的指纹在后台回填
+        self.fingerprinter = ReuseFingerprinter(self.db, on_fingerprints=self.signals.clip_fingerprints.emit)
+        self.signals.clip_fingerprints.connect(self.db.set_clip_fingerprints)
+        self.fingerprinter.start()
+
+        # 删除只做标记，超过可撤销时间后由后台分批彻底清理
+        self.purger = ReusePurger(self.db, on_cleared=self.signals.clear_purged.emit)
+        self.signals.clear_purged.connect(self.db.vector_index.discard_upto)
+        self.purger.start()
+
+        # 相似内容索引：后台加载已有向量并回填旧记录
+        self.vector_indexer = ReuseVectorIndexer(self.db, on_vectors=self.signals.clip_vectors.emit)
+        self.signals.clip_vectors.connect(self.db.set_clip_vectors)
+        self.vector_indexer.start()
+
+        # 内存统计：各子系统登记字节计数，托盘菜单查看报告
+        self.memory = ReuseMemoryMonitor(
+            os.path.join(os.path.dirname(os.path.abspath(self.db.db_path)), 'memory_snapshots'))
+        cache = self.db.query_cache
+        self.memory.register("查询缓存", lambda: (
+            cache.bytes, f"{len(cache.entries)} 个结果，预算 {cache.max_bytes // 1024} KB，"
+                         f"命中 {cache.hits} / 未命中 {cache.misses}，淘汰 {cache.evictions}"))
+        self.memory.register("历史窗口表格", self.history_window.table_memory)
+        self.memory.register("预览窗口文档", self.history_window.preview_memory)
+        self.memory.register("快速粘贴面板", self.palette.memory_usage)
+        self.memory.register("相似内容索引", self.db.vector_index.memory_usage)
+
+        # 托盘菜单开启的性能分析，结果写入数据库旁的 profiles 目录
+        self.profiler = ReuseProfiler(os.path.join(os.path.dirname(os.path.abspath(self.db.db_path)), 'profiles'))
+
+        # 空闲时的数据库维护：窗口隐藏且一段时间没有采集时在后台执行，有活动时立即暂停
+        self.last_activity = time.monotonic()
+        self.maintenance = ReuseMaintenance(self.db, archive=self.history_window.archive,
+                                            on_finished=self.signals.maintenance_finished.emit,
+                                            on_archived=self.signals.clips_archived.emit)
+        self.signals.maintenance_finished.connect(self.handle_maintenance_finished)
+        self.signals.clips_archived.connect(self.db.clips_archived)
+        self.history_window.search_box.textChanged.connect(lambda _: self.note_activity())
+        self.maintenance_timer = QTimer()
+        self.maintenance_timer.timeout.connect(self.run_idle_maintenance)
+        self.maintenance_timer.start(60 * 1000)
+
+        # 单实例：再次启动的进程把请求（显示窗口、搜索）转交过来
+        self.signals.instance_request.connect(self.handle_instance_request)
+        if instance is not None:
+            instance.serve(self.signals.instance_request.emit)
         # 注册快捷键
         self.register_hotkey()
     def register_hotkey(self):
@@ -1007,6 +4377,10 @@ class ReuseManager:
                     if self.ctrl_pressed and self.shift_pressed:
                         print("快捷键触发：Ctrl+Shift+Q")
                         self.signals.show_window.emit()
+                elif key == pynput_keyboard.Key.space:
+                    if self.ctrl_pressed and self.shift_pressed:
+                        # 在监听线程中记下当前前台窗口，粘贴时切回去
+                        self.signals.show_palette.emit(win32gui.GetForegroundWindow())
             except Exception as e:
                 print(f"按键错误: {e}")
 
@@ -1021,7 +4395,7 @@ class ReuseManager:
             on_release=on_release
         )
         self.hotkey_listener.start()
-        print("快捷键已注册: Ctrl+Shift+Q")
+        print("快捷键已注册: Ctrl+Shift+Q（历史窗口）, Ctrl+Shift+Space（快速粘贴）")
 
     def stop_hotkey_listener(self):
         if hasattr(self, 'hotkey_listener') and self.hotkey_listener is not None:
@@ -1046,6 +4420,25 @@ class ReuseManager:
         
         settings_action = tray_menu.addAction("设置")
         settings_action.triggered.connect(self.history_window.open_settings)
+
+        stats_action = tray_menu.addAction("采集统计")
+        stats_action.triggered.connect(self.show_capture_stats)
+
+        memory_menu = tray_menu.addMenu("内存")
+        memory_menu.addAction("内存占用报告").triggered.connect(self.show_memory_report)
+        self.trace_memory_action = memory_menu.addAction("跟踪内存分配")
+        self.trace_memory_action.setCheckable(True)
+        self.trace_memory_action.toggled.connect(self.toggle_memory_tracing)
+        memory_menu.addAction("保存内存快照").triggered.connect(self.save_memory_snapshot)
+
+        self.profile_action = tray_menu.addAction("开始性能分析")
+        self.profile_action.triggered.connect(self.toggle_profiling)
+
+        backup_action = tray_menu.addAction("立即备份")
+        backup_action.triggered.connect(self.start_backup)
+
+        restore_action = tray_menu.addAction("从备份恢复...")
+        restore_action.triggered.connect(self.restore_backup)
         
         tray_menu.addSeparator()
         
@@ -1057,13 +4450,96 @@ class ReuseManager:
         self.tray_icon.show()
         print("系统托盘图标已初始化")
     
+    def run_scheduled_backup(self):
+        """定时检查：超过备份间隔时在后台开始备份"""
+        if self.backup.is_due():
+            self.backup.start()
+
+    def start_backup(self):
+        if not self.backup.start():
+            self.tray_icon.showMessage("Reuse", "备份正在进行中")
+
+    def handle_backup_finished(self, ok, message):
+        if ok:
+            self.tray_icon.showMessage("Reuse", f"备份完成: {os.path.basename(message)}")
+        else:
+            self.tray_icon.showMessage("Reuse", f"备份失败: {message}", QSystemTrayIcon.Warning)
+
+    def note_activity(self):
+        """采集、搜索、打开窗口时调用：记录活动时间并暂停正在进行的维护"""
+        self.last_activity = time.monotonic()
+        self.maintenance.pause()
+
+    def run_idle_maintenance(self):
+        """定时检查：空闲足够久且距上次维护超过间隔时开始（或继续）维护"""
+        if self.history_window.isVisible() or self.backup.is_running():
+            return
+        idle = time.monotonic() - self.last_activity
+        if idle < self.db.get_setting('maintenance_idle_minutes') * 60:
+            return
+        interval = self.db.get_setting('maintenance_interval_hours') * 3600
+        if time.time() - self.db.get_setting('maintenance_last_run') < interval:
+            return
+        self.maintenance.start()
+
+    def handle_maintenance_finished(self, completed, message):
+        if completed:
+            self.db.set_setting('maintenance_last_run', int(time.time()))
+        if self.maintenance.archived:
+            self.maintenance.archived = 0
+            self.palette.refresh()
+
+    def restore_backup(self):
+        """选择一份备份并恢复"""
+        backup_path, _ = QFileDialog.getOpenFileName(
+            None, "选择要恢复的备份", self.backup.backup_dir(), "SQLite 数据库 (*.db)")
+        if not backup_path:
+            return
+        reply = QMessageBox.question(
+            None, "确认恢复",
+            f"当前数据将被备份 {os.path.basename(backup_path)} 覆盖，确定继续吗？",
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.No
+        )
+        if reply != QMessageBox.Yes:
+            return
+        self.backup.cancel()
+        if self.backup.thread:
+            self.backup.thread.join()
+        self.maintenance.pause()
+        if self.maintenance.thread:
+            self.maintenance.thread.join()
+        try:
+            self.backup.restore(backup_path)
+        except sqlite3.Error as e:
+            QMessageBox.warning(None, "恢复失败", str(e))
+            return
+        self.fingerprinter.start()
+        self.vector_indexer.start()
+        self.history_window.load_group_filters()
+        self.history_window.refresh_data()
+        self.tray_icon.showMessage("Reuse", "已从备份恢复")
+
     def tray_icon_activated(self, reason):
         """托盘图标点击处理"""
         if reason == QSystemTrayIcon.DoubleClick:
             self.show_history_window()
     
+    def handle_instance_request(self, request):
+        """处理再次启动时转交来的请求"""
+        print(f"收到转交的请求: {request}")
+        self.show_history_window()
+        if request.get('action') == 'search':
+            if self.history_window.current_mode != 'clip':
+                self.history_window.switch_mode('clip')
+            text = request.get('text', '')
+            if self.history_window.search_box.text() == text:
+                self.history_window.search_clips(text)
+            else:
+                self.history_window.search_box.setText(text)
+
     def show_history_window(self):
         """显示历史记录窗口"""
+        self.note_activity()
         # 每次显示窗口时刷新数据
         self.history_window.refresh_data()
         # 先恢复窗口状态（防止最小化）
@@ -1102,29 +4578,119 @@ class ReuseManager:
             win32gui.SetForegroundWindow(hwnd)
         except Exception as e:
             print("激活窗口失败:", e)
+    def write_clipboard(self, content):
+        """程序自身写入剪贴板：记下摘要，随后触发的变化不再采集"""
+        self.pending_self_write = content_digest(content)
+        self.clipboard.setText(content)
+
     def handle_clipboard_change(self):
-        """处理剪贴板内容变化"""
+        """剪贴板变化：窗口期内只安排一次采集，其余变化计为合并"""
+        self.capture_stats['events'] += 1
+        if self.coalesce_timer.isActive():
+            self.capture_stats['coalesced'] += 1
+            return
+        self.coalesce_timer.start(max(self.db.get_setting('capture_coalesce_ms'), 0))
+
+    def process_clipboard_change(self):
+        """读取剪贴板当前内容并采集"""
+        # 自身写入的标记只对紧接着的这一次采集有效：同一窗口期内用户又复制了别的内容时，
+        # 标记也在这里作废，否则之后真正复制相同内容时会被误当作自身写入而忽略
+        pending_self_write, self.pending_self_write = self.pending_self_write, None
         try:
-            # 获取文本内容
-            if self.clipboard.mimeData().hasText():
-                new_content = self.clipboard.text()
-                print(f"剪贴板变化: {new_content[:50]}{'...' if len(new_content) > 50 else ''}")
-                
-                # 忽略空内容和重复内容
-                if new_content and new_content != self.last_clipboard_content:
-                    print(f"检测到新内容: {new_content[:50]}{'...' if len(new_content) > 50 else ''}")
-                    self.last_clipboard_content = new_content
-                    
-                    # 保存到数据库
-                    if self.db.save_clip(new_content):
-                        print("内容已保存到数据库")
-                        # 如果历史窗口正在显示，刷新它
-                        if self.history_window.isVisible():
-                            self.history_window.refresh_clips()
-                            print("刷新历史窗口")
+            # 获取文本内容（无文本时为空字符串）
+            new_content = self.clipboard.text()
+            if not new_content:
+                return
+
+            max_chars = self.db.get_setting('max_capture_chars')
+            if max_chars and len(new_content) > max_chars:
+                self.capture_stats['dropped_oversize'] += 1
+                print(f"内容过长（{len(new_content)} 字符），未采集")
+                return
+
+            # 按摘要比较，忽略重复内容和程序自身写入的内容
+            digest = content_digest(new_content)
+            if digest == pending_self_write:
+                self.last_clipboard_digest = digest
+                self.capture_stats['suppressed'] += 1
+                return
+            if digest == self.last_clipboard_digest:
+                self.capture_stats['duplicates'] += 1
+                return
+            self.last_clipboard_digest = digest
+            self.note_activity()
+
+            # 保存到数据库
+            if self.db.save_clip(new_content):
+                self.capture_stats['saved'] += 1
+                self.classifier.wake()
+                self.palette.refresh()
+                # 如果历史窗口正在显示，刷新它
+                if self.history_window.isVisible():
+                    self.history_window.refresh_clips()
+            else:
+                self.capture_stats['duplicates'] += 1
         except Exception as e:
             print(f"剪贴板处理错误: {e}")
 
+    def paste_from_palette(self, content, clip_id, foreground_hwnd):
+        """快速粘贴：切回原来的前台窗口后粘贴，并把该内容移到最新"""
+        self.db.update_clip_as_latest(clip_id)
+        self.palette.refresh()
+        try:
+            if foreground_hwnd:
+                win32gui.SetForegroundWindow(foreground_hwnd)
+        except Exception as e:
+            print("切换前台窗口失败:", e)
+        QTimer.singleShot(50, lambda: self.history_window.paste_to_focus(content))
+
+    def show_memory_report(self):
+        report = self.memory.report()
+        print(report)
+        QMessageBox.information(None, "内存占用", report)
+
+    def toggle_memory_tracing(self, enabled):
+        if enabled:
+            self.memory.start_tracing()
+        else:
+            self.memory.stop_tracing()
+
+    def save_memory_snapshot(self):
+        if not self.memory.is_tracing():
+            self.trace_memory_action.setChecked(True)  # 先开启跟踪，下一次保存才有分配数据
+        try:
+            path, diff = self.memory.save_snapshot()
+        except (OSError, RuntimeError) as e:
+            QMessageBox.warning(None, "保存失败", str(e))
+            return
+        message = f"快照已保存: {path}"
+        if diff:
+            message += "\n\n与上一份快照相比变化最大的代码行:\n" + "\n".join(diff)
+        print(message)
+        QMessageBox.information(None, "内存快照", message)
+
+    def toggle_profiling(self):
+        if not self.profiler.is_running():
+            self.profiler.start()
+            self.profile_action.setText("停止性能分析")
+            return
+        self.profile_action.setText("开始性能分析")
+        try:
+            paths, summary = self.profiler.stop()
+        except OSError as e:
+            QMessageBox.warning(None, "性能分析", f"写入结果失败: {e}")
+            return
+        print(summary)
+        QMessageBox.information(None, "性能分析", "结果文件:\n" + "\n".join(paths) + "\n\n" + summary)
+
+    def show_capture_stats(self):
+        stats = self.capture_stats
+        self.tray_icon.showMessage(
+            "采集统计",
+            f"剪贴板变化 {stats['events']} 次，合并 {stats['coalesced']} 次，"
+            f"自身写入 {stats['suppressed']} 次，重复 {stats['duplicates']} 次，"
+            f"超长丢弃 {stats['dropped_oversize']} 次，已保存 {stats['saved']} 条")
+
 def main():
     app = QApplication(sys.argv)
     app.setQuitOnLastWindowClosed(False)
@@ -1143,7 +4709,11 @@ def main():
             print(f"设置应用ID失败: {e}")
     
     # 启动管理器
-    manager = ReuseManager()
+    manager = ReuseManager(instance=INSTANCE)
+    app.aboutToQuit.connect(manager.history_window.scan_engine.shutdown)
+    app.aboutToQuit.connect(INSTANCE.release)
+    if INSTANCE_REQUEST['action'] != 'show':
+        manager.handle_instance_request(INSTANCE_REQUEST)
     print("剪贴板管理器已启动")
     
     sys.exit(app.exec_())
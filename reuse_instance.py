@@ -0,0 +1,134 @@
+"""单实例保护：锁文件 + 本机回环套接字
+
+第一个启动的进程持有数据库旁的锁文件，并在 127.0.0.1 的随机端口上监听，把端口和一次性口令写入实例信息文件。
+之后再次启动时拿不到锁，就读取实例信息，把本次的请求（显示窗口、搜索某内容）发给正在运行的实例后立即退出。
+本模块只使用标准库，reuse.py 在导入 Qt、打开数据库之前调用它，转交请求只需几毫秒。
+
+命令行：
+    python reuse.py                 显示历史窗口（已在运行时）
+    python reuse.py --search 关键词  显示历史窗口并搜索
+"""
+import os
+import sys
+import json
+import time
+import socket
+import secrets
+import threading
+
+LOCK_NAME = 'reuse_history.db.lock'      # 与默认数据库文件放在一起，保护的是同一个数据库
+INFO_NAME = 'reuse_history.db.instance'  # 端口和口令；Windows 下被锁定的文件其他进程无法读取，因此单独存放
+CONNECT_TIMEOUT = 1.0
+STARTUP_WAIT = 3.0       # 另一个实例刚启动、还没写出实例信息时最多等待的时间
+MAX_REQUEST_BYTES = 65536
+
+
+def parse_request(argv):
+    """命令行参数 -> 请求字典"""
+    if len(argv) >= 2 and argv[0] == '--search':
+        return {'action': 'search', 'text': ' '.join(argv[1:])}
+    return {'action': 'show'}
+
+
+class SingleInstance:
+    """持有锁的一方调用 acquire() 后 serve(handler)；其他进程调用 send(request)"""
+
+    def __init__(self, base_dir):
+        self.lock_path = os.path.join(base_dir, LOCK_NAME)
+        self.info_path = os.path.join(base_dir, INFO_NAME)
+        self.lock_file = None
+        self.server = None
+        self.token = None
+
+    def acquire(self):
+        """尝试成为唯一实例：拿到锁后开始监听并写出实例信息，返回是否成功"""
+        lock_file = open(self.lock_path, 'a+b')
+        try:
+            self._lock(lock_file)
+        except OSError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+
+        # 先监听再写信息文件，其他进程读到端口时连接一定能成功（请求在队列中等待 serve）
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(8)
+        self.token = secrets.token_hex(16)
+        info = {'pid': os.getpid(), 'port': self.server.getsockname()[1], 'token': self.token}
+        tmp_path = self.info_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+        os.replace(tmp_path, self.info_path)
+        return True
+
+    @staticmethod
+    def _lock(lock_file):
+        """非阻塞地锁定锁文件；进程退出（包括崩溃）时由操作系统自动释放"""
+        if sys.platform == 'win32':
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def send(self, request):
+        """把请求交给正在运行的实例，返回是否送达"""
+        deadline = time.monotonic() + STARTUP_WAIT
+        while True:
+            try:
+                with open(self.info_path, encoding='utf-8') as f:
+                    info = json.load(f)
+                with socket.create_connection(('127.0.0.1', info['port']), timeout=CONNECT_TIMEOUT) as conn:
+                    conn.sendall(json.dumps(dict(request, token=info['token'])).encode('utf-8') + b'\n')
+                    return conn.makefile('rb').readline().strip() == b'ok'
+            except (OSError, ValueError, KeyError):
+                # 运行中的实例可能刚拿到锁、还没写出新的实例信息
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.05)
+
+    def serve(self, handler):
+        """在后台线程中接收其他进程转交的请求，handler(request) 在该线程中调用"""
+        threading.Thread(target=self._accept_loop, args=(handler,), name='reuse-instance', daemon=True).start()
+
+    def _accept_loop(self, handler):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return  # 已关闭
+            with conn:
+                try:
+                    conn.settimeout(CONNECT_TIMEOUT)
+                    line = conn.makefile('rb').readline(MAX_REQUEST_BYTES)
+                    request = json.loads(line.decode('utf-8'))
+                    if not isinstance(request, dict) or request.pop('token', None) != self.token:
+                        continue
+                    handler(request)
+                    conn.sendall(b'ok\n')
+                except (OSError, ValueError) as e:
+                    print(f"处理转交的请求失败: {e}")
+
+    def release(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        if self.lock_file is not None:
+            self.lock_file.close()  # 关闭即释放锁
+            self.lock_file = None
+
+
+def claim_instance(base_dir, argv):
+    """成为唯一实例时返回 (SingleInstance, 本次请求)；已有实例在运行时转交请求并退出进程"""
+    instance = SingleInstance(base_dir)
+    request = parse_request(argv)
+    if instance.acquire():
+        return instance, request
+    started = time.perf_counter()
+    if instance.send(request):
+        print(f"Reuse 已在运行，请求已转交（{(time.perf_counter() - started) * 1000:.1f} ms）")
+        sys.exit(0)
+    print("Reuse 已在运行，但无法连接到该实例")
+    sys.exit(1)
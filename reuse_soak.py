@@ -0,0 +1,364 @@
+"""剪贴板风暴压测 / 长时间浸泡测试工具
+
+在无界面环境（QT_QPA_PLATFORM=offscreen）下创建真实的 ReuseManager，用假的剪贴板对象代替系统剪贴板，
+按合成或录制的事件序列驱动 handle_clipboard_change，统计采集延迟分位数、丢弃事件、数据库增长和内存。
+win32 与 pynput 相关模块以空实现代替，因此可以在任何平台上运行。
+
+示例：
+    python reuse_soak.py --rate 1000 --duration 60
+    python reuse_soak.py --rate 200 --duration 3600 --report-every 60 --sizes 40:70,2000:25,200000:5
+    python reuse_soak.py --rate 1000 --duration 10 --record storm.jsonl
+    python reuse_soak.py --trace storm.jsonl --speed 2
+"""
+import os
+import sys
+import json
+import time
+import types
+import random
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+
+def install_platform_stubs():
+    """用空实现代替 win32con / win32api / win32gui / pynput（压测不需要全局快捷键和窗口激活）"""
+    class Anything:
+        def __getattr__(self, name):
+            return Anything()
+
+        def __call__(self, *args, **kwargs):
+            return 0
+
+    def stub_module(name):
+        module = types.ModuleType(name)
+        module.__getattr__ = lambda attr: Anything()
+        sys.modules[name] = module
+        return module
+
+    for name in ('win32con', 'win32api', 'win32gui'):
+        stub_module(name)
+
+    class Listener:
+        def __init__(self, **kwargs):
+            pass
+
+        def start(self):
+            pass
+
+        def stop(self):
+            pass
+
+    pynput = stub_module('pynput')
+    keyboard = stub_module('pynput.keyboard')
+    keyboard.Key = Anything()
+    keyboard.Listener = Listener
+    pynput.keyboard = keyboard
+
+
+install_platform_stubs()
+
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+from PyQt5.QtCore import QObject, QTimer, QEventLoop, pyqtSignal  # noqa: E402
+
+import reuse  # noqa: E402
+
+
+class FakeClipboard(QObject):
+    """代替 QClipboard：setText 立即发出 dataChanged，与系统剪贴板的行为一致"""
+    dataChanged = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.content = ''
+
+    def text(self):
+        return self.content
+
+    def setText(self, text):
+        self.content = text
+        self.dataChanged.emit()
+
+    def receivers(self, signal):
+        return 1
+
+
+def parse_sizes(spec):
+    """'40:70,2000:25' -> ([40, 2000], [70, 25])"""
+    sizes, weights = [], []
+    for part in spec.split(','):
+        size, _, weight = part.partition(':')
+        sizes.append(int(size))
+        weights.append(float(weight or 1))
+    return sizes, weights
+
+
+def synthetic_trace(rate, duration, sizes, weights, dup_ratio, seed):
+    """按固定速率生成事件 [(时间偏移秒, 大小, 编号), ...]，dup_ratio 的事件重复之前出现过的内容"""
+    rng = random.Random(seed)
+    events = []
+    for i in range(int(rate * duration)):
+        if events and rng.random() < dup_ratio:
+            _, size, key = rng.choice(events[-50:])
+        else:
+            size, key = rng.choices(sizes, weights)[0], i
+        events.append((i / rate, size, key))
+    return events
+
+
+def event_text(size, key):
+    """由大小和编号确定生成内容（同一编号总是得到相同内容，便于录制和重放）"""
+    head = f"soak-{key} "
+    body = (f"line {key} " * (size // 8 + 1))
+    return (head + body)[:max(size, len(head))]
+
+
+def load_trace(path):
+    events = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                event = json.loads(line)
+                text = event.get('text')
+                events.append((event['t'], len(text) if text is not None else event['size'],
+                               text if text is not None else event['key']))
+    return events
+
+
+def save_trace(path, events):
+    with open(path, 'w', encoding='utf-8') as f:
+        for t, size, key in events:
+            f.write(json.dumps({'t': round(t, 6), 'size': size, 'key': key}) + '\n')
+
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return {p: 0.0 for p in points + ('max',)}
+    ordered = sorted(values)
+    result = {p: ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)] for p in points}
+    result['max'] = ordered[-1]
+    return result
+
+
+def format_ms(stats):
+    return ', '.join(f"p{k}={v * 1000:.1f}ms" if k != 'max' else f"max={v * 1000:.1f}ms"
+                     for k, v in stats.items())
+
+
+def rss_bytes():
+    """当前进程常驻内存；无法读取时返回 0"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                 ctypes.byref(counters), counters.cb)
+        return counters.WorkingSetSize
+    except Exception:
+        return 0
+
+
+class SoakRun:
+    """驱动一次压测：回放事件、记录每条内容从写入剪贴板到保存完成的延迟"""
+    HEARTBEAT_MS = 10
+
+    def __init__(self, manager, clipboard, events, speed, out):
+        self.manager = manager
+        self.clipboard = clipboard
+        self.events = events
+        self.speed = speed
+        self.out = out
+        self.next_event = 0
+        self.sent_at = {}          # 内容摘要 -> 最近一次写入剪贴板的时间
+        self.capture_latency = []  # 写入剪贴板到保存完成
+        self.save_duration = []    # save_clip 本身的耗时（阻塞主线程的时间）
+        self.loop_lag = []         # 主线程事件循环的延迟
+        self.samples = []
+
+        original_save = manager.db.save_clip
+
+        def timed_save(content):
+            started = time.perf_counter()
+            saved = original_save(content)
+            finished = time.perf_counter()
+            self.save_duration.append(finished - started)
+            sent = self.sent_at.pop(reuse.content_digest(content), None)
+            if sent is not None:
+                self.capture_latency.append(finished - sent)
+            return saved
+        manager.db.save_clip = timed_save
+
+    def db_size(self):
+        path = os.path.abspath(self.manager.db.db_path)
+        return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+    def sample(self, elapsed):
+        rows = self.manager.db.conn.execute("SELECT COUNT(*) FROM clips").fetchone()[0]
+        traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        lib = reuse.sqlite_library()
+        sample = {
+            'elapsed': round(elapsed, 1),
+            'events': self.next_event,
+            'saved': self.manager.capture_stats['saved'],
+            'rows': rows,
+            'db_bytes': self.db_size(),
+            'rss_bytes': rss_bytes(),
+            'python_bytes': traced,
+            'sqlite_bytes': lib.sqlite3_memory_used() if lib is not None else 0,
+            'capture': percentiles(self.capture_latency[-5000:]),
+            'lag': percentiles(self.loop_lag[-5000:]),
+        }
+        self.samples.append(sample)
+        print(f"[{sample['elapsed']:>7.1f}s] 事件 {sample['events']}，保存 {sample['saved']}，"
+              f"行数 {rows}，数据库 {sample['db_bytes'] / 1024:.0f} KB，RSS {sample['rss_bytes'] / 1048576:.1f} MB，"
+              f"采集延迟 {format_ms(sample['capture'])}，主线程延迟 p99={sample['lag'][99] * 1000:.1f}ms",
+              file=self.out, flush=True)
+
+    def run(self, report_every):
+        loop = QEventLoop()
+        start = time.perf_counter()
+        last_report = start
+        last_beat = start
+
+        def heartbeat():
+            nonlocal last_beat
+            now = time.perf_counter()
+            self.loop_lag.append(max(now - last_beat - self.HEARTBEAT_MS / 1000, 0))
+            last_beat = now
+
+        def pump():
+            # 把已到时间的事件全部发出，然后回到事件循环，让合并定时器和保存正常运行
+            nonlocal last_report
+            now = time.perf_counter()
+            elapsed = (now - start) * self.speed
+            while self.next_event < len(self.events) and self.events[self.next_event][0] <= elapsed:
+                _, size, key = self.events[self.next_event]
+                text = key if isinstance(key, str) else event_text(size, key)
+                self.sent_at[reuse.content_digest(text)] = time.perf_counter()
+                self.clipboard.setText(text)
+                self.next_event += 1
+            if report_every and now - last_report >= report_every:
+                last_report = now
+                self.sample(now - start)
+            if self.next_event >= len(self.events):
+                pump_timer.stop()
+                QTimer.singleShot(1000, loop.quit)  # 等待最后一次合并采集完成
+
+        beat_timer = QTimer()
+        beat_timer.timeout.connect(heartbeat)
+        beat_timer.start(self.HEARTBEAT_MS)
+        pump_timer = QTimer()
+        pump_timer.timeout.connect(pump)
+        pump_timer.start(0)
+        loop.exec_()
+        beat_timer.stop()
+        self.sample(time.perf_counter() - start)
+        return time.perf_counter() - start
+
+    def summary(self, wall_time, rows_before, size_before):
+        stats = self.manager.capture_stats
+        sent = self.next_event
+        # 被合并的事件是预期行为；既未保存、也不属于合并/重复/自身写入/超长的才算真正丢失
+        accounted = stats['saved'] + stats['coalesced'] + stats['duplicates'] + stats['suppressed'] \
+            + stats['dropped_oversize']
+        final = self.samples[-1]
+        return {
+            'events_sent': sent,
+            'events_per_second': round(sent / wall_time, 1) if wall_time else 0,
+            'clipboard_events_seen': stats['events'],
+            'saved': stats['saved'],
+            'coalesced': stats['coalesced'],
+            'duplicates': stats['duplicates'],
+            'dropped_oversize': stats['dropped_oversize'],
+            'lost': max(sent - accounted, 0),
+            'capture_latency': percentiles(self.capture_latency),
+            'save_duration': percentiles(self.save_duration),
+            'loop_lag': percentiles(self.loop_lag),
+            'rows_growth': final['rows'] - rows_before,
+            'db_growth_bytes': final['db_bytes'] - size_before,
+            'rss_peak_bytes': max(s['rss_bytes'] for s in self.samples),
+            'python_peak_bytes': tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0,
+            'samples': self.samples,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reuse 剪贴板风暴压测")
+    parser.add_argument('--rate', type=float, default=1000, help="合成事件速率（次/秒）")
+    parser.add_argument('--duration', type=float, default=10, help="合成事件持续时间（秒）")
+    parser.add_argument('--sizes', default='40:70,2000:25,200000:5',
+                        help="内容大小分布，格式 大小:权重,...")
+    parser.add_argument('--dup-ratio', type=float, default=0.1, help="重复之前内容的事件比例")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--trace', help="回放录制的事件文件（JSONL：t 与 text，或 t、size、key）")
+    parser.add_argument('--record', help="把合成的事件序列写入文件，便于之后重放")
+    parser.add_argument('--speed', type=float, default=1.0, help="回放速度倍数")
+    parser.add_argument('--workdir', help="数据库所在目录（默认新建临时目录）")
+    parser.add_argument('--report-every', type=float, default=10, help="每隔多少秒输出一次采样")
+    parser.add_argument('--tracemalloc', action='store_true', help="同时跟踪 Python 内存分配")
+    parser.add_argument('--json', help="把最终结果写入 JSON 文件")
+    parser.add_argument('--verbose', action='store_true', help="显示程序自身的日志输出")
+    args = parser.parse_args()
+
+    if args.trace:
+        events = load_trace(args.trace)
+    else:
+        sizes, weights = parse_sizes(args.sizes)
+        events = synthetic_trace(args.rate, args.duration, sizes, weights, args.dup_ratio, args.seed)
+        if args.record:
+            save_trace(args.record, events)
+    out = sys.stdout
+
+    app = QApplication(sys.argv)
+    clipboard = FakeClipboard()
+    QApplication.clipboard = staticmethod(lambda: clipboard)
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix='reuse-soak-'))
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    quiet = open(os.devnull, 'w') if not args.verbose else None
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        manager = reuse.ReuseManager()
+        rows_before = manager.db.conn.execute("SELECT COUNT(*) FROM clips").fetchone()[0]
+        run = SoakRun(manager, clipboard, events, args.speed, out)
+        size_before = run.db_size()
+        print(f"开始压测: {len(events)} 个事件，数据库 {os.path.abspath(manager.db.db_path)}",
+              file=out, flush=True)
+        wall_time = run.run(args.report_every)
+        result = run.summary(wall_time, rows_before, size_before)
+        manager.classifier.stop()
+        manager.history_window.scan_engine.shutdown()
+
+    print("=" * 60, file=out)
+    print(f"发送事件 {result['events_sent']}（{result['events_per_second']}/s），"
+          f"保存 {result['saved']}，合并 {result['coalesced']}，重复 {result['duplicates']}，"
+          f"超长丢弃 {result['dropped_oversize']}，丢失 {result['lost']}", file=out)
+    print(f"采集延迟: {format_ms(result['capture_latency'])}", file=out)
+    print(f"保存耗时: {format_ms(result['save_duration'])}", file=out)
+    print(f"主线程延迟: {format_ms(result['loop_lag'])}", file=out)
+    print(f"数据库增长: {result['rows_growth']} 行，{result['db_growth_bytes'] / 1024:.0f} KB；"
+          f"RSS 峰值 {result['rss_peak_bytes'] / 1048576:.1f} MB", file=out)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    app.quit()
+
+
+if __name__ == '__main__':
+    main()